@@ -0,0 +1,209 @@
+"""Benchmark the per-update hot path: parse_data and the sensor attributes.
+
+Runs every scenario of payloads.py (or a captured payload given with
+`--payload`) in ALL, route-filtered and destination-filtered mode and
+reports time per call and tracemalloc peak memory. Decoding the response
+body is timed with json and, if installed, orjson.
+
+    python benchmarks/bench_parse.py
+    python benchmarks/bench_parse.py --save baseline.json
+    python benchmarks/bench_parse.py --compare baseline.json --tolerance 0.25
+
+With `--compare` the exit status is 1 if any median got slower than the
+baseline by more than the tolerance, so it can gate a change.
+
+Only the component's pure modules are imported, Home Assistant is not
+needed.
+"""
+
+import argparse
+import importlib
+import json
+from pathlib import Path
+import statistics
+import sys
+import timeit
+import tracemalloc
+import types
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from payloads import SCENARIOS, busiest_route, stop_payload
+
+COMPONENT = Path(__file__).resolve().parent.parent / "custom_components" / "hslhrt"
+PACKAGE = "hslhrt_bench"
+
+
+def load_component(name):
+    """Import a module of the component without running its __init__."""
+    if PACKAGE not in sys.modules:
+        package = types.ModuleType(PACKAGE)
+        package.__path__ = [str(COMPONENT)]
+        sys.modules[PACKAGE] = package
+    return importlib.import_module(f"{PACKAGE}.{name}")
+
+
+parser = load_component("parser")
+const = load_component("const")
+
+
+def measure(func, repeat):
+    """Return the min and median seconds per call of func."""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    runs = [total / number for total in timer.repeat(repeat=repeat, number=number)]
+    return min(runs), statistics.median(runs)
+
+
+def peak_memory(func):
+    """Return the peak bytes allocated while running func once."""
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def modes(payload):
+    """Return the filters to benchmark a payload with."""
+    route, headsign = busiest_route(payload)
+    routes = sorted({r["shortName"] for r in payload["data"]["stop"]["routes"]})
+    return {
+        "all": parser.build_filter(const.ALL),
+        "route": parser.build_filter(route),
+        "destination": parser.build_filter(None, headsign[:5]),
+        # A per-route stop entry following up to six routes
+        "per_route": parser.build_filter(
+            groups=[(short_name, None) for short_name in routes[:6]]
+        ),
+    }
+
+
+def run_case(name, payload, repeat):
+    """Benchmark one payload in every mode."""
+    results = {}
+    limit = const.DEFAULT_ATTRIBUTE_DEPARTURES
+
+    body = json.dumps(payload, ensure_ascii=False).encode()
+    decoders = {"json": json.loads}
+    if orjson is not None:
+        decoders["orjson"] = orjson.loads
+    for decoder, loads in decoders.items():
+        best, median = measure(lambda: loads(body), repeat)
+        results[f"{name}/decode/{decoder}"] = {
+            "best_us": best * 1e6,
+            "median_us": median * 1e6,
+        }
+
+    for mode, departure_filter in modes(payload).items():
+        parsed = parser.parse_data(data=payload, departure_filter=departure_filter)
+        routes = parsed.get(const.DICT_KEY_ROUTES) or []
+        if not routes:
+            continue
+
+        def parse():
+            return parser.parse_data(data=payload, departure_filter=departure_filter)
+
+        def update():
+            data = parse()
+            parser.departures_fingerprint(data)
+            return parser.route_attributes(data, limit)
+
+        cases = {
+            "parse": parse,
+            "fingerprint": lambda: parser.departures_fingerprint(parsed),
+            "attributes": lambda: parser.route_attributes(parsed, limit),
+            # What the sensor cost before the attribute cap
+            "attributes_uncapped": lambda: parser.route_attributes(parsed, len(routes)),
+        }
+        for case, func in cases.items():
+            best, median = measure(func, repeat)
+            results[f"{name}/{mode}/{case}"] = {
+                "best_us": best * 1e6,
+                "median_us": median * 1e6,
+            }
+
+        results[f"{name}/{mode}/update"] = {
+            "departures": len(routes),
+            "peak_kib": peak_memory(update) / 1024,
+            "attributes_kib": len(json.dumps(update(), ensure_ascii=False)) / 1024,
+        }
+
+    return results
+
+
+def print_results(results, baseline):
+    """Print a table, with the change against a baseline if given."""
+    for key, values in results.items():
+        line = f"{key:45}"
+        if "median_us" in values:
+            line += f" {values['median_us']:11.1f} us (best {values['best_us']:.1f})"
+            previous = (baseline or {}).get(key)
+            if previous:
+                change = values["median_us"] / previous["median_us"] - 1
+                line += f" {change:+7.1%}"
+        else:
+            line += (
+                f" {values['departures']:5} departures,"
+                f" peak {values['peak_kib']:8.1f} KiB,"
+                f" attributes {values['attributes_kib']:6.1f} KiB"
+            )
+        print(line)
+
+
+def regressions(results, baseline, tolerance):
+    """Return the keys whose median got slower than the tolerance allows."""
+    return [
+        key
+        for key, values in results.items()
+        if "median_us" in values
+        and key in baseline
+        and values["median_us"] > baseline[key]["median_us"] * (1 + tolerance)
+    ]
+
+
+def main():
+    """Run the benchmarks."""
+    args = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    args.add_argument("--payload", action="append", default=[], help="captured JSON")
+    args.add_argument("--repeat", type=int, default=5)
+    args.add_argument("--save", help="write the results to a JSON file")
+    args.add_argument("--compare", help="baseline JSON written with --save")
+    args.add_argument("--tolerance", type=float, default=0.25)
+    args = args.parse_args()
+
+    if args.payload:
+        payloads = {
+            Path(path).stem: json.loads(Path(path).read_text(encoding="utf-8"))
+            for path in args.payload
+        }
+    else:
+        payloads = {name: stop_payload(name) for name in SCENARIOS}
+
+    results = {}
+    for name, payload in payloads.items():
+        results.update(run_case(name, payload, args.repeat))
+
+    baseline = None
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text(encoding="utf-8"))
+
+    print_results(results, baseline)
+
+    if args.save:
+        Path(args.save).write_text(json.dumps(results, indent=2), encoding="utf-8")
+
+    if baseline:
+        slower = regressions(results, baseline, args.tolerance)
+        for key in slower:
+            print(f"REGRESSION {key}", file=sys.stderr)
+        return 1 if slower else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
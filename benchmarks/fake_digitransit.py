@@ -0,0 +1,266 @@
+"""Stand-in for the Digitransit routing GraphQL endpoint.
+
+Serves the documents the integration sends, from generated fixture stops:
+
+- batched `sN: stop(id: $idN) { gtfsId stoptimesWithoutPatterns(...) }` and
+  `stopTimesForPattern` selections,
+- `stops(ids: $ids)` metadata, `stops(name: $id)` search and the bulk
+  `stops` list.
+
+It is not a GraphQL engine: documents are recognised by the selections
+the integration builds. Stoptimes are cut down to the fields of the
+document's Stoptime fragment and responses are compressed when the client
+accepts it, so response sizes are comparable to Digitransit's.
+
+Latency, HTTP 500 errors and 429 responses can be injected:
+
+    python benchmarks/fake_digitransit.py --port 8080 --stops 200 \\
+        --latency 80 --error-rate 0.01 --throttle-rate 0.02
+"""
+
+import argparse
+import asyncio
+import random
+import re
+import time
+
+from aiohttp import web
+
+from payloads import SCENARIOS, stop_payload
+
+STOP_SELECTION = re.compile(r"(\w+): stop \(id: \$(\w+)\) \{ gtfsId (.*) \}")
+PATTERN_SELECTION = re.compile(
+    r"(\w+): stopTimesForPattern \(id: \$(\w+), startTime: \$(\w+), "
+    r"numberOfDepartures: \$(\w+)\)"
+)
+FRAGMENT = re.compile(r"fragment Stoptime on Stoptime \{(.*)\}", re.DOTALL)
+STOPTIMES_SELECTION = re.compile(
+    r"stoptimesWithoutPatterns \(startTime: \$(\w+), numberOfDepartures: \$(\w+)"
+    r"(?:, timeRange: \$(\w+))?\)"
+)
+
+
+class FakeDigitransit:
+    """Fixture data, fault injection and request statistics."""
+
+    def __init__(
+        self,
+        stops=100,
+        latency=0.0,
+        jitter=0.0,
+        error_rate=0.0,
+        throttle_rate=0.0,
+        retry_after=5,
+        seed=0,
+    ):
+        """Generate `stops` fixture stops cycling through the scenarios."""
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self._random = random.Random(seed)
+
+        self.stops = {}
+        scenarios = list(SCENARIOS)
+        now = int(time.time())
+        for index in range(stops):
+            stop = stop_payload(scenarios[index % len(scenarios)], now, seed + index)
+            stop = stop["data"]["stop"]
+            stop["gtfsId"] = gtfs_id(index)
+            stop["code"] = f"H{index:04}"
+            self.stops[stop["gtfsId"]] = stop
+
+        self.counters = {"requests": 0, "stops": 0, "errors": 0, "throttled": 0}
+
+    async def handle(self, request):
+        """Answer one POSTed document."""
+        self.counters["requests"] += 1
+
+        if self.latency or self.jitter:
+            await asyncio.sleep(
+                max(0.0, self._random.gauss(self.latency, self.jitter)) / 1000
+            )
+        if self._random.random() < self.throttle_rate:
+            self.counters["throttled"] += 1
+            return web.json_response(
+                {"message": "Too many requests"},
+                status=429,
+                headers={"Retry-After": str(self.retry_after)},
+            )
+        if self._random.random() < self.error_rate:
+            self.counters["errors"] += 1
+            return web.Response(status=500, text="Internal Server Error")
+
+        body = await request.json()
+        query = body.get("query", "")
+        variables = body.get("variables") or {}
+        response = web.json_response(self.execute(query, variables))
+        response.enable_compression()
+        return response
+
+    def execute(self, query, variables):
+        """Return the response to a document."""
+        if "stops(ids: $ids)" in query:
+            return {"data": {"stops": [self._metadata(i) for i in variables["ids"]]}}
+        if "stops (name: $id)" in query:
+            return {"data": {"stops": self._search(variables["id"])}}
+        if "stops {" in query and "$" not in query:
+            return {"data": {"stops": [self._metadata(i) for i in self.stops]}}
+
+        fragment = FRAGMENT.search(query)
+        fields = _field_tree(fragment.group(1)) if fragment else {}
+
+        data, errors = {}, []
+        for alias, id_var, selection in STOP_SELECTION.findall(query):
+            stop = self.stops.get(variables.get(id_var))
+            self.counters["stops"] += 1
+            if stop is None:
+                data[alias] = None
+                errors.append({"message": "Stop not found", "path": [alias]})
+                continue
+            data[alias] = self._stoptimes(stop, selection, variables, fields)
+
+        response = {"data": data}
+        if errors:
+            response["errors"] = errors
+        return response
+
+    def _metadata(self, stop_id):
+        """Return name, code and routes of a stop."""
+        stop = self.stops.get(stop_id)
+        if stop is None:
+            return None
+        return {key: stop[key] for key in ("name", "code", "gtfsId", "routes")}
+
+    def _search(self, name):
+        """Return stops whose name contains `name`."""
+        return [
+            {key: stop[key] for key in ("gtfsId", "name", "code", "routes")}
+            for stop in self.stops.values()
+            if name in stop["name"]
+        ]
+
+    def _stoptimes(self, stop, selection, variables, fields):
+        """Return the stoptimes of one stop selection."""
+        result = {"gtfsId": stop["gtfsId"]}
+        rows = stop["stoptimesWithoutPatterns"]
+
+        patterns = PATTERN_SELECTION.findall(selection)
+        if patterns:
+            for alias, pattern_var, start_var, count_var in patterns:
+                code = variables[pattern_var]
+                matching = [row for row in rows if _pattern_code(row) == code]
+                result[alias] = [
+                    _project(row, fields)
+                    for row in _window(
+                        matching, variables[start_var], variables[count_var]
+                    )
+                ]
+            return result
+
+        match = STOPTIMES_SELECTION.search(selection)
+        if match:
+            start_var, count_var, range_var = match.groups()
+            result["stoptimesWithoutPatterns"] = [
+                _project(row, fields)
+                for row in _window(
+                    rows,
+                    variables[start_var],
+                    variables[count_var],
+                    variables.get(range_var) if range_var else None,
+                )
+            ]
+        return result
+
+
+def gtfs_id(index):
+    """Return the GTFS id of the fixture stop at an index."""
+    return f"HSL:{1000000 + index}"
+
+
+def _pattern_code(row):
+    """Return the pattern code of a fixture stoptime."""
+    trip = row["trip"]
+    return f"{trip['route']['gtfsId']}:{trip['directionId']}:01"
+
+
+def _field_tree(selection):
+    """Parse a selection like `a b { c }` into {"a": {}, "b": {"c": {}}}."""
+    root = node = {}
+    stack = []
+    last = None
+    for token in re.findall(r"[{}]|\w+", selection):
+        if token == "{":
+            stack.append(node)
+            node = node[last]
+        elif token == "}":
+            node = stack.pop()
+        else:
+            node[token] = {}
+            last = token
+    return root
+
+
+def _project(value, fields):
+    """Return value cut down to a field tree; an empty tree keeps it all."""
+    if not fields or not isinstance(value, dict):
+        return value
+    return {
+        name: _project(value[name], children)
+        for name, children in fields.items()
+        if name in value
+    }
+
+
+def _window(rows, start, count, time_range=None):
+    """Return at most `count` rows departing at `start` or later."""
+    end = start + time_range if time_range else None
+    window = []
+    for row in rows:
+        epoch = row["serviceDay"] + row["realtimeArrival"]
+        if epoch < start:
+            continue
+        if end is not None and epoch > end:
+            continue
+        window.append(row)
+        if len(window) >= count:
+            break
+    return window
+
+
+def create_app(fake):
+    """Return the aiohttp application serving a FakeDigitransit."""
+    app = web.Application()
+    app.router.add_post("/routing/v2/hsl/gtfs/v1", fake.handle)
+    app.router.add_get("/stats", lambda _: web.json_response(fake.counters))
+    return app
+
+
+def main():
+    """Serve until interrupted."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--stops", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0, help="mean, ms")
+    parser.add_argument("--jitter", type=float, default=0, help="std dev, ms")
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--throttle-rate", type=float, default=0)
+    parser.add_argument("--retry-after", type=int, default=5)
+    args = parser.parse_args()
+
+    fake = FakeDigitransit(
+        args.stops,
+        args.latency,
+        args.jitter,
+        args.error_rate,
+        args.throttle_rate,
+        args.retry_after,
+    )
+    print(f"Serving {len(fake.stops)} stops, first {gtfs_id(0)}")
+    web.run_app(create_app(fake), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
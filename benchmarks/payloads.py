@@ -0,0 +1,107 @@
+"""Stop payloads shaped like Digitransit `stop` query responses.
+
+The generators are seeded, so every run benchmarks the same data. Real
+responses can be captured with the integration's debug logging (or curl)
+and passed to the benchmark with `--payload` instead.
+"""
+
+import random
+import time
+
+HEADSIGNS = (
+    "Itäkeskus", "Kamppi", "Rautatientori", "Pasila", "Malmi", "Vuosaari",
+    "Tapiola", "Leppävaara", "Kivenlahti", "Herttoniemi", "Munkkivuori",
+    "Arabianranta", "Meilahti", "Lauttasaari", "Jätkäsaari", "Kalasatama",
+    "Viikki", "Pukinmäki", "Mellunmäki", "Kontula",
+)
+
+# name, number of routes, number of departures
+SCENARIOS = {
+    "small": ("Jupperi", 3, 60),
+    "tram": ("Töölöntori", 8, 400),
+    "metro_hub": ("Itäkeskus", 40, 1500),
+}
+
+
+def _route_names(count, rng):
+    """Return distinct short names like 55, 550, 7, 9N."""
+    names = set()
+    while len(names) < count:
+        number = rng.randint(1, 999)
+        names.add(f"{number}{rng.choice(('', '', '', 'N', 'K', 'B'))}")
+    return sorted(names)
+
+
+def stop_payload(scenario, now=None, seed=0):
+    """Return a full `{"data": {"stop": ...}}` payload for a scenario."""
+    name, route_count, departures = SCENARIOS[scenario]
+    rng = random.Random(seed)
+    now = int(time.time() if now is None else now)
+    service_day = now - now % 86400
+
+    routes = []
+    for index, short_name in enumerate(_route_names(route_count, rng)):
+        headsigns = rng.sample(HEADSIGNS, 2)
+        routes.append(
+            {
+                "gtfsId": f"HSL:{1000 + index}",
+                "shortName": short_name,
+                "patterns": [
+                    {"code": f"HSL:{1000 + index}:{direction}:01", "headsign": headsign}
+                    for direction, headsign in enumerate(headsigns)
+                ],
+            }
+        )
+
+    stoptimes = []
+    start = now - service_day
+    for trip in range(departures):
+        route = rng.choice(routes)
+        direction = rng.randrange(2)
+        # Spread the departures evenly over the rest of the day
+        scheduled = start + trip * max(1, (86400 - start) // departures)
+        delay = rng.randint(-60, 180) if trip < 30 else 0
+        stoptimes.append(
+            {
+                "scheduledArrival": scheduled,
+                "realtimeArrival": scheduled + delay,
+                "arrivalDelay": delay,
+                "scheduledDeparture": scheduled,
+                "realtimeDeparture": scheduled + delay,
+                "departureDelay": delay,
+                "realtime": trip < 30,
+                "realtimeState": "UPDATED" if trip < 30 else "SCHEDULED",
+                "serviceDay": service_day,
+                "headsign": route["patterns"][direction]["headsign"],
+                "trip": {
+                    "gtfsId": f"HSL:{route['gtfsId'][4:]}_{trip}",
+                    "directionId": direction,
+                    "route": {
+                        "gtfsId": route["gtfsId"],
+                        "shortName": route["shortName"],
+                    },
+                    "departureStoptime": {"scheduledDeparture": scheduled - 600},
+                },
+            }
+        )
+
+    return {
+        "data": {
+            "stop": {
+                "name": name,
+                "code": f"H{rng.randint(1000, 9999)}",
+                "gtfsId": f"HSL:{rng.randint(1000000, 1999999)}",
+                "routes": routes,
+                "stoptimesWithoutPatterns": stoptimes,
+            }
+        }
+    }
+
+
+def busiest_route(payload):
+    """Return the short name and a headsign of the most frequent route."""
+    counts = {}
+    for stoptime in payload["data"]["stop"]["stoptimesWithoutPatterns"]:
+        key = stoptime["trip"]["route"]["shortName"], stoptime["headsign"]
+        counts[key] = counts.get(key, 0) + 1
+    return max(counts, key=counts.get)
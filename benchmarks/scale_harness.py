@@ -0,0 +1,288 @@
+"""Run hundreds of coordinators against the fake Digitransit server.
+
+Sets up a bare Home Assistant instance, adds `--entries` coordinators
+spread over `--stops` fixture stops (cycling through ALL, route and
+destination filters) and lets them poll for `--duration` seconds. Reports:
+
+- requests per second reaching the server and the governor counters,
+- p50/p99 update latency of the coordinators,
+- event loop blocking, measured as the lateness of a 10 ms ticker,
+- tracemalloc memory after setup and at the end, and peak RSS.
+
+    python benchmarks/scale_harness.py --entries 500 --stops 150 \\
+        --interval 15 --duration 120 --latency 80 --throttle-rate 0.01
+
+The server runs in a thread of this process by default. Start
+fake_digitransit.py separately and pass `--url` to keep its CPU time out
+of the loop measurements.
+
+Needs a Home Assistant development install (`pip install homeassistant`).
+"""
+
+import argparse
+import asyncio
+from datetime import timedelta
+import json
+from pathlib import Path
+import resource
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import types
+
+import aiohttp
+from aiohttp import web
+
+from fake_digitransit import FakeDigitransit, create_app, gtfs_id
+from payloads import SCENARIOS, busiest_route, stop_payload
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from homeassistant.core import HomeAssistant  # noqa: E402
+
+from custom_components.hslhrt import (  # noqa: E402
+    HSLHRTDataUpdateCoordinator,
+    async_get_batch_scheduler,
+    async_get_governor,
+    async_get_metadata_cache,
+    async_get_snapshot_store,
+)
+from custom_components.hslhrt.const import (  # noqa: E402
+    ALL,
+    APIKEY,
+    CONF_BATCH_SIZE,
+    DEFAULT_BATCH_SIZE,
+    DESTINATION,
+    DOMAIN,
+    ROUTE,
+    STOP_CODE,
+    STOP_GTFS,
+    STOP_NAME,
+    TRANSPORT,
+)
+from custom_components.hslhrt.hub import async_get_stop_hub  # noqa: E402
+from custom_components.hslhrt.transport import HSLHRTGraphQLTransport  # noqa: E402
+
+TICK = 0.01
+FILTERS = ("all", "route", "destination")
+
+
+def entry_data(index, stops, apikeys):
+    """Return the config entry data of the entry at an index."""
+    stop = index % stops
+    scenario = list(SCENARIOS)[stop % len(SCENARIOS)]
+    route, headsign = busiest_route(stop_payload(scenario, seed=stop))
+
+    data = {
+        STOP_GTFS: gtfs_id(stop),
+        STOP_NAME: SCENARIOS[scenario][0],
+        STOP_CODE: f"H{stop:04}",
+        APIKEY: f"bench-{index % apikeys}",
+        ROUTE: ALL,
+        DESTINATION: ALL,
+    }
+    mode = FILTERS[(index // stops) % len(FILTERS)]
+    if mode == "route":
+        data[ROUTE] = route
+    elif mode == "destination":
+        data[ROUTE] = None
+        data[DESTINATION] = headsign[:5]
+    return data
+
+
+def start_server(fake):
+    """Serve a FakeDigitransit from a thread and return its URL."""
+    loop = asyncio.new_event_loop()
+    runner = web.AppRunner(create_app(fake))
+    loop.run_until_complete(runner.setup())
+    loop.run_until_complete(web.TCPSite(runner, "127.0.0.1", 0).start())
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    host, port = runner.addresses[0][:2]
+    return f"http://{host}:{port}/routing/v2/hsl/gtfs/v1"
+
+
+async def fetch_stats(session, url):
+    """Return the request counters of the fake server."""
+    async with session.get(url.split("/routing/")[0] + "/stats") as response:
+        return await response.json()
+
+
+async def async_add_coordinator(hass, session, entry, latencies, interval):
+    """Set up a coordinator like async_setup_entry, without entities."""
+    scheduler = async_get_batch_scheduler(hass)
+    scheduler.set_batch_size(
+        entry.entry_id, entry.options.get(CONF_BATCH_SIZE, DEFAULT_BATCH_SIZE)
+    )
+    metadata = await async_get_metadata_cache(hass)
+    snapshots = await async_get_snapshot_store(hass)
+    hub = async_get_stop_hub(
+        hass, entry.data[STOP_GTFS], scheduler.async_fetch_stop, metadata
+    )
+    coordinator = HSLHRTDataUpdateCoordinator(hass, session, entry, hub, snapshots)
+    hub.attach(coordinator)
+
+    if interval:
+        coordinator.min_interval = coordinator.max_interval = timedelta(
+            seconds=interval
+        )
+        coordinator.update_interval = coordinator.min_interval
+
+    update = coordinator._async_update_data
+
+    async def timed_update():
+        start = time.perf_counter()
+        try:
+            return await update()
+        finally:
+            latencies.append(time.perf_counter() - start)
+
+    coordinator._async_update_data = timed_update
+
+    await asyncio.sleep(async_get_governor(hass).start_delay())
+    await coordinator.async_refresh()
+    # Coordinators only keep polling while something listens
+    coordinator.async_add_listener(lambda: None)
+    return coordinator
+
+
+async def monitor_loop(lags, stop):
+    """Record how late a TICK sleep wakes up until stop is set."""
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        start = loop.time()
+        await asyncio.sleep(TICK)
+        lags.append(max(0.0, loop.time() - start - TICK))
+
+
+def percentile(values, fraction):
+    """Return a percentile of a list of values."""
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+async def async_run(args, url, config_dir):
+    """Set up the coordinators, poll for a while and return the results."""
+    try:
+        hass = HomeAssistant(config_dir)
+    except TypeError:
+        # Before 2024.3 the config dir was set after construction
+        hass = HomeAssistant()
+        hass.config.config_dir = config_dir
+    await hass.async_start()
+
+    session = aiohttp.ClientSession()
+    hass.data[DOMAIN] = {
+        TRANSPORT: HSLHRTGraphQLTransport(hass, session, endpoint=url)
+    }
+
+    entries = [
+        types.SimpleNamespace(
+            entry_id=f"bench{index}",
+            data=entry_data(index, args.stops, args.apikeys),
+            options={},
+        )
+        for index in range(args.entries)
+    ]
+
+    tracemalloc.start()
+    latencies, lags = [], []
+    stop = asyncio.Event()
+    monitor = asyncio.ensure_future(monitor_loop(lags, stop))
+
+    started = time.perf_counter()
+    coordinators = await asyncio.gather(
+        *(
+            async_add_coordinator(hass, session, entry, latencies, args.interval)
+            for entry in entries
+        )
+    )
+    setup_time = time.perf_counter() - started
+    setup_memory = tracemalloc.get_traced_memory()[0]
+
+    before = await fetch_stats(session, url)
+    await asyncio.sleep(args.duration)
+    after = await fetch_stats(session, url)
+
+    stop.set()
+    await monitor
+    memory, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    results = {
+        "entries": len(coordinators),
+        "failing": sum(not c.last_update_success for c in coordinators),
+        "setup_s": setup_time,
+        "requests_per_s": (after["requests"] - before["requests"]) / args.duration,
+        "stops_per_s": (after["stops"] - before["stops"]) / args.duration,
+        "server": after,
+        "governor": dict(async_get_governor(hass).counters),
+        "updates": len(latencies),
+        "update_p50_ms": percentile(latencies, 0.5) * 1000,
+        "update_p99_ms": percentile(latencies, 0.99) * 1000,
+        "loop_lag_p99_ms": percentile(lags, 0.99) * 1000,
+        "loop_lag_max_ms": max(lags, default=0.0) * 1000,
+        "loop_blocked_s": sum(lag for lag in lags if lag > 0.05),
+        "loop_lag_mean_ms": statistics.fmean(lags) * 1000 if lags else 0.0,
+        "memory_setup_mib": setup_memory / 2**20,
+        "memory_end_mib": memory / 2**20,
+        "memory_peak_mib": peak / 2**20,
+        "memory_per_entry_kib": memory / len(coordinators) / 1024,
+        "rss_max_mib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+    for coordinator in coordinators:
+        await coordinator.async_shutdown()
+    await session.close()
+    await hass.async_stop(force=True)
+    return results
+
+
+def main():
+    """Run the harness."""
+    args = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    args.add_argument("--entries", type=int, default=300)
+    args.add_argument("--stops", type=int, default=100)
+    args.add_argument("--apikeys", type=int, default=1)
+    args.add_argument("--interval", type=float, help="poll interval override, s")
+    args.add_argument("--duration", type=float, default=60)
+    args.add_argument("--url", help="endpoint of a separately started fake server")
+    args.add_argument("--latency", type=float, default=50, help="mean, ms")
+    args.add_argument("--jitter", type=float, default=20, help="std dev, ms")
+    args.add_argument("--error-rate", type=float, default=0)
+    args.add_argument("--throttle-rate", type=float, default=0)
+    args.add_argument("--retry-after", type=int, default=5)
+    args.add_argument("--save", help="write the results to a JSON file")
+    args = args.parse_args()
+
+    url = args.url
+    if url is None:
+        url = start_server(
+            FakeDigitransit(
+                args.stops,
+                args.latency,
+                args.jitter,
+                args.error_rate,
+                args.throttle_rate,
+                args.retry_after,
+            )
+        )
+
+    with tempfile.TemporaryDirectory() as config_dir:
+        results = asyncio.run(async_run(args, url, config_dir))
+
+    for key, value in results.items():
+        if isinstance(value, float):
+            value = f"{value:.2f}"
+        print(f"{key:22} {value}")
+
+    if args.save:
+        Path(args.save).write_text(json.dumps(results, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,50 +1,185 @@
-from homeassistant.core import HomeAssistant
-from homeassistant.exceptions import ConfigEntryNotReady
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.exceptions import ConfigEntryAuthFailed
 from homeassistant.helpers.aiohttp_client import async_get_clientsession
 from homeassistant.helpers.update_coordinator import DataUpdateCoordinator, UpdateFailed
+from homeassistant.util import dt as dt_util
 from aiohttp import ContentTypeError, ClientError
 
 from async_timeout import timeout
-import datetime
+import asyncio
+from datetime import timedelta
 import time
 
-from python_graphql_client import GraphqlClient
-
 from .const import (
-    BASE_URL,
     DESTINATION,
     DOMAIN,
     STOP_NAME,
     STOP_GTFS,
-    STOP_CODE,
     ROUTE,
     DESTINATION,
-    ROUTE_QUERY_WITH_LIMIT,
-    MIN_TIME_BETWEEN_UPDATES,
+    ROUTE_GROUPS,
     COORDINATOR,
-    UNDO_UPDATE_LISTENER,
-    DICT_KEY_ROUTE,
+    BATCH_SCHEDULER,
+    METADATA_CACHE,
+    TRANSPORT,
+    GTFS_ENGINES,
+    STOP_DIRECTORY,
+    GOVERNOR,
+    SNAPSHOTS,
+    SNAPSHOT_HORIZON,
+    STARTUP_LIMITER,
+    STARTUP_CONCURRENCY,
+    CONF_BATCH_SIZE,
+    DEFAULT_BATCH_SIZE,
+    CONF_SERVER_FILTER,
+    DEFAULT_SERVER_FILTER,
+    CONF_MAX_DEPARTURES,
+    DEFAULT_MAX_DEPARTURES,
+    CONF_INCREMENTAL,
+    DEFAULT_INCREMENTAL,
+    CONF_HORIZON,
+    DEFAULT_HORIZON,
+    CONF_MIN_INTERVAL,
+    DEFAULT_MIN_INTERVAL,
+    CONF_MAX_INTERVAL,
+    DEFAULT_MAX_INTERVAL,
     DICT_KEY_ROUTES,
-    DICT_KEY_DEST,
-    DICT_KEY_ARRIVAL,
-    ALL,
-    VAR_ID,
-    VAR_CURR_EPOCH,
-    VAR_LIMIT,
-    LIMIT,
-    SECS_IN_DAY,
+    PARSE_EXECUTOR_ROWS,
+    CONF_GTFS_PATH,
+    DEFAULT_GTFS_PATH,
+    CONF_ATTRIBUTE_DEPARTURES,
+    DEFAULT_ATTRIBUTE_DEPARTURES,
+    CONF_HFP_BROKER,
+    DEFAULT_HFP_BROKER,
+    UNDO_UPDATE_LISTENER,
     _LOGGER,
     APIKEY,
 )
+from .batch import HSLHRTBatchScheduler
+from .parser import (
+    build_filter,
+    departures_fingerprint,
+    parse_data,
+    stale_snapshot,
+    trimmed_snapshot,
+)
+from .polling import compute_update_interval
+from .gtfs import HSLHRTTimetableEngine
+from .hfp import async_get_hfp_client
+from .metadata import HSLHRTMetadataCache
+from .metrics import HSLHRTMetrics
+from .hub import async_get_stop_hub, async_release_stop_hub
+from .services import async_setup_services
+from .stopindex import HSLHRTStopDirectory
+from .governor import HSLHRTRequestGovernor
+from .snapshot import HSLHRTSnapshotStore
+from .transport import HSLHRTAuthFailed, HSLHRTGraphQLTransport, is_transient
 
 DOMAIN = "hslhrt"
 PLATFORMS = ["sensor"]
 
-graph_client = GraphqlClient(endpoint=BASE_URL)
+
+def async_get_transport(hass):
+    """Return the GraphQL transport shared by all entries."""
+    transport = hass.data[DOMAIN].get(TRANSPORT)
+    if transport is None:
+        transport = hass.data[DOMAIN][TRANSPORT] = HSLHRTGraphQLTransport(
+            hass, async_get_clientsession(hass)
+        )
+    return transport
+
+
+def async_get_governor(hass):
+    """Return the governor pacing every Digitransit request."""
+    governor = hass.data[DOMAIN].get(GOVERNOR)
+    if governor is None:
+        governor = hass.data[DOMAIN][GOVERNOR] = HSLHRTRequestGovernor(
+            async_get_transport(hass).async_execute
+        )
+    return governor
+
+
+async def async_get_metadata_cache(hass):
+    """Return the loaded stop metadata cache."""
+    cache = hass.data[DOMAIN].get(METADATA_CACHE)
+    if cache is None:
+        cache = hass.data[DOMAIN][METADATA_CACHE] = HSLHRTMetadataCache(
+            hass, async_get_governor(hass).async_execute
+        )
+    await cache.async_load()
+    return cache
+
+
+def async_get_stop_directory(hass):
+    """Return the local stop search directory."""
+    directory = hass.data[DOMAIN].get(STOP_DIRECTORY)
+    if directory is None:
+        directory = hass.data[DOMAIN][STOP_DIRECTORY] = HSLHRTStopDirectory(
+            hass, async_get_governor(hass).async_execute
+        )
+    return directory
+
+
+async def async_get_snapshot_store(hass):
+    """Return the loaded store of last good departures."""
+    snapshots = hass.data[DOMAIN].get(SNAPSHOTS)
+    if snapshots is None:
+        snapshots = hass.data[DOMAIN][SNAPSHOTS] = HSLHRTSnapshotStore(hass)
+    await snapshots.async_load()
+    return snapshots
+
+
+def async_get_timetable_engine(hass, path):
+    """Return the offline timetable engine of a GTFS zip, if configured."""
+    if not path:
+        return None
+
+    path = hass.config.path(path)
+    engines = hass.data[DOMAIN].setdefault(GTFS_ENGINES, {})
+    engine = engines.get(path)
+    if engine is None:
+        engine = engines[path] = HSLHRTTimetableEngine(hass, path)
+    return engine
+
+
+def async_get_batch_scheduler(hass):
+    """Return the scheduler batching stop fetches of all entries."""
+    scheduler = hass.data[DOMAIN].get(BATCH_SCHEDULER)
+    if scheduler is None:
+        scheduler = hass.data[DOMAIN][BATCH_SCHEDULER] = HSLHRTBatchScheduler(
+            hass, async_get_governor(hass).async_execute
+        )
+    return scheduler
 
 
-def base_unique_id(gtfs_id, route=None, dest=None):
+def async_get_startup_limiter(hass):
+    """Return the semaphore bounding how many first refreshes run at once."""
+    limiter = hass.data[DOMAIN].get(STARTUP_LIMITER)
+    if limiter is None:
+        limiter = hass.data[DOMAIN][STARTUP_LIMITER] = asyncio.Semaphore(
+            STARTUP_CONCURRENCY
+        )
+    return limiter
+
+
+async def async_startup_refresh(hass, coordinator):
+    """Run an entry's first refresh as part of a bounded background wave."""
+    # Spread the first requests of entries starting together
+    await asyncio.sleep(async_get_governor(hass).start_delay())
+    async with async_get_startup_limiter(hass):
+        await coordinator.async_refresh()
+
+
+def base_unique_id(gtfs_id, route=None, dest=None, groups=None):
     """Return a globally unique ID for config entries and entities."""
+    if groups:
+        # Per-route entries are told apart by the routes they show
+        parts = sorted(
+            f"{route}/{headsign}" if headsign else route
+            for route, headsign in groups
+        )
+        return f"{gtfs_id}_ROUTES_{'_'.join(parts).upper()}"
+
     route_part = (route or "ALL").upper()
     dest_part = (dest or "ALL").upper()
 
@@ -60,6 +195,7 @@ def base_unique_id(gtfs_id, route=None, dest=None):
 async def async_setup(hass: HomeAssistant, config: dict) -> bool:
     """Set up configured HSL HRT."""
     hass.data.setdefault(DOMAIN, {})
+    async_setup_services(hass)
     return True
 
 
@@ -68,11 +204,29 @@ async def async_setup_entry(hass, config_entry) -> bool:
 
     websession = async_get_clientsession(hass)
 
-    coordinator = HSLHRTDataUpdateCoordinator(hass, websession, config_entry)
-    await coordinator.async_refresh()
-
-    if not coordinator.last_update_success:
-        raise ConfigEntryNotReady
+    scheduler = async_get_batch_scheduler(hass)
+    scheduler.set_batch_size(
+        config_entry.entry_id,
+        config_entry.options.get(CONF_BATCH_SIZE, DEFAULT_BATCH_SIZE),
+    )
+
+    metadata = await async_get_metadata_cache(hass)
+    snapshots = await async_get_snapshot_store(hass)
+
+    hub = async_get_stop_hub(
+        hass,
+        config_entry.data.get(STOP_GTFS, ""),
+        scheduler.async_fetch_stop,
+        metadata,
+    )
+    coordinator = HSLHRTDataUpdateCoordinator(
+        hass, websession, config_entry, hub, snapshots
+    )
+    hub.attach(coordinator)
+
+    # Entities start from the stored departures and the first refresh runs
+    # in the background, so startup does not wait for Digitransit
+    coordinator.async_restore()
 
     undo_listener = config_entry.add_update_listener(update_listener)
 
@@ -90,6 +244,12 @@ async def async_setup_entry(hass, config_entry) -> bool:
 
     await hass.config_entries.async_forward_entry_setups(config_entry, PLATFORMS)
 
+    config_entry.async_create_background_task(
+        hass,
+        async_startup_refresh(hass, coordinator),
+        f"{DOMAIN} first refresh {config_entry.entry_id}",
+    )
+
     return True
 
 
@@ -98,11 +258,20 @@ async def async_unload_entry(hass, config_entry):
     await hass.config_entries.async_forward_entry_unload_platforms(config_entry, PLATFORMS)
 
     hass.data[DOMAIN][config_entry.entry_id][UNDO_UPDATE_LISTENER]()
-    hass.data[DOMAIN].pop(config_entry.entry_id)
+    entry_data = hass.data[DOMAIN].pop(config_entry.entry_id)
+    async_release_stop_hub(hass, entry_data[COORDINATOR])
+    async_get_batch_scheduler(hass).remove_entry(config_entry.entry_id)
 
     return True
 
 
+async def async_remove_entry(hass, config_entry):
+    """Drop the stored departures of a removed entry."""
+    hass.data.setdefault(DOMAIN, {})
+    snapshots = await async_get_snapshot_store(hass)
+    snapshots.remove(config_entry.entry_id)
+
+
 async def update_listener(hass, config_entry):
     """Update FMI listener."""
     await hass.config_entries.async_reload(config_entry.entry_id)
@@ -111,7 +280,7 @@ async def update_listener(hass, config_entry):
 class HSLHRTDataUpdateCoordinator(DataUpdateCoordinator):
     """Class to manage fetching HSL HRT data API."""
 
-    def __init__(self, hass, session, config_entry):
+    def __init__(self, hass, session, config_entry, hub, snapshots):
         """Initialize."""
 
         ##if config_entry.data.get(STOP_NAME, "None") is not None:
@@ -126,158 +295,162 @@ class HSLHRTDataUpdateCoordinator(DataUpdateCoordinator):
         )
 
         self.gtfs_id = config_entry.data.get(STOP_GTFS, "")
+        self.stop_name = config_entry.data.get(STOP_NAME, "")
         self.route = config_entry.data.get(ROUTE, "")
         self.dest = config_entry.data.get(DESTINATION, "")
+        # Per-route stop entries, one sensor per (route, headsign or None)
+        self.groups = [
+            tuple(group) for group in config_entry.data.get(ROUTE_GROUPS) or ()
+        ]
         self.apikey = config_entry.data.get(APIKEY, "")
+        self.server_filter = config_entry.options.get(
+            CONF_SERVER_FILTER, DEFAULT_SERVER_FILTER
+        )
+        self.max_departures = config_entry.options.get(
+            CONF_MAX_DEPARTURES, DEFAULT_MAX_DEPARTURES
+        )
+        self.incremental = config_entry.options.get(
+            CONF_INCREMENTAL, DEFAULT_INCREMENTAL
+        )
+        self.horizon = config_entry.options.get(CONF_HORIZON, DEFAULT_HORIZON)
+        self.attribute_departures = config_entry.options.get(
+            CONF_ATTRIBUTE_DEPARTURES, DEFAULT_ATTRIBUTE_DEPARTURES
+        )
+        self.departure_filter = build_filter(self.route, self.dest, self.groups)
+        self.gtfs_engine = async_get_timetable_engine(
+            hass, config_entry.options.get(CONF_GTFS_PATH, DEFAULT_GTFS_PATH)
+        )
+        self.hfp = async_get_hfp_client(
+            hass, config_entry.options.get(CONF_HFP_BROKER, DEFAULT_HFP_BROKER)
+        )
+        self.min_interval = timedelta(
+            minutes=config_entry.options.get(CONF_MIN_INTERVAL, DEFAULT_MIN_INTERVAL)
+        )
+        self.max_interval = max(
+            self.min_interval,
+            timedelta(
+                minutes=config_entry.options.get(
+                    CONF_MAX_INTERVAL, DEFAULT_MAX_INTERVAL
+                )
+            ),
+        )
 
         self.route_data = None
+        self._fingerprint = None
+        self._entry_id = config_entry.entry_id
+        self._snapshots = snapshots
+        self._last_good = snapshots.get(config_entry.entry_id)
+        self._stale_since = None
+        self.metrics = HSLHRTMetrics()
+        # Set while profiling, so cProfile on the event loop sees every parse
+        self.parse_inline = False
+        self.hub = hub
         self._hass = hass
 
-        _LOGGER.debug("Data will be updated every %s min", MIN_TIME_BETWEEN_UPDATES)
+        _LOGGER.debug(
+            "Data will be updated every %s to %s", self.min_interval, self.max_interval
+        )
 
+        # Listeners are only notified when the returned data changes
         super().__init__(
-            hass, _LOGGER, name=DOMAIN, update_interval=MIN_TIME_BETWEEN_UPDATES
+            hass,
+            _LOGGER,
+            name=DOMAIN,
+            update_interval=self.min_interval,
+            always_update=False,
         )
 
+    @callback
+    def async_restore(self):
+        """Serve the stored departures until the first refresh completes."""
+        if self._last_good:
+            self.route_data = self.data = stale_snapshot(
+                self._last_good, time.time(), None
+            )
+
     async def _async_update_data(self):
-        """Update data via HSl HRT Open API."""
-
-        def parse_data(data=None, line_from_user=None, dest_from_user=None):
-            parsed_data = {}
-            bus_lines = {}
-
-            graph_data = data.get("data", None)
-
-            if graph_data is not None:
-                hsl_stop_data = graph_data.get("stop", None)
-
-                if hsl_stop_data is not None:
-                    parsed_data[STOP_NAME] = hsl_stop_data.get("name", "")
-                    parsed_data[STOP_CODE] = hsl_stop_data.get("code", "")
-                    parsed_data[STOP_GTFS] = hsl_stop_data.get("gtfsId", "")
-
-                    bus_lines = hsl_stop_data.get("routes", None)
-                    route_data = hsl_stop_data.get("stoptimesWithoutPatterns", None)
-
-                    if route_data is not None:
-                        routes = []
-                        for route in route_data:
-                            route_dict = {}
-                            arrival = route.get("realtimeArrival", None)
-
-                            if arrival is None:
-                                arrival = route.get("scheduledArrival", 0)
-
-                            ## Arrival time is num of secs from midnight when the trip started.
-                            ## If the trip starts on this day and arrival time is next day (e.g late night trips)
-                            ## the arrival time shows the number of secs more than 24hrs ending up with a
-                            ## 1 day, hh:mm:ss on the displays. This corrects it.
-                            if arrival >= SECS_IN_DAY:
-                                arrival = arrival - SECS_IN_DAY
-
-                            route_dict[DICT_KEY_ARRIVAL] = str(
-                                datetime.timedelta(seconds=arrival)
-                            )
-                            route_dict[DICT_KEY_DEST] = route.get("headsign", "")
-
-                            route_dict[DICT_KEY_ROUTE] = ""
-                            if route_dict[DICT_KEY_DEST] != "":
-                                for bus in bus_lines:
-                                    line = bus.get("shortName", None)
-
-                                    if line is None:
-                                        continue
-
-                                    # Check if the line and trip route names match for this
-                                    # schedule
-                                    trip = route.get("trip", "")
-                                    if trip != "":
-                                        trip_route = trip.get("route", "")
-                                        if trip_route != "":
-                                            trip_route_shortname = trip_route.get(
-                                                "shortName", ""
-                                            )
-                                            if trip_route_shortname != "":
-                                                if (
-                                                    trip_route_shortname.lower()
-                                                    == line.lower()
-                                                ):
-                                                    route_dict[DICT_KEY_ROUTE] = line
-
-                            routes.append(route_dict)
-
-                        parsed_data[DICT_KEY_ROUTES] = routes
-                else:
-                    _LOGGER.error("Invalid GTFS Id")
-                    return
-
-            time_line_parsed_data = []
-            if line_from_user is not None:
-                if line_from_user.lower() != ALL.lower():
-                    if line_from_user.lower() != "":
-                        routes = parsed_data.get(DICT_KEY_ROUTES, None)
-                        if routes is not None:
-                            for rt in routes:
-                                line_in_data = rt.get(DICT_KEY_ROUTE, None)
-                                if line_in_data is not None:
-                                    if line_from_user.lower() == line_in_data.lower():
-                                        time_line_parsed_data.append(rt)
-
-                            parsed_data[DICT_KEY_ROUTES] = time_line_parsed_data
-            elif dest_from_user is not None:
-                if dest_from_user.lower() != ALL.lower():
-                    if dest_from_user.lower() != "":
-                        routes = parsed_data.get(DICT_KEY_ROUTES, None)
-                        if routes is not None:
-                            for rt in routes:
-                                dest_in_data = rt.get(DICT_KEY_DEST, None)
-                                if dest_in_data is not None:
-                                    if dest_from_user.lower() in dest_in_data.lower():
-                                        time_line_parsed_data.append(rt)
-
-                            parsed_data[DICT_KEY_ROUTES] = time_line_parsed_data
-            else:
-                routes = parsed_data.get(DICT_KEY_ROUTES, None)
-                if routes is not None:
-                    for rt in routes:
-                        line_in_data = rt.get(DICT_KEY_ROUTE, None)
-                        dest_in_data = rt.get(DICT_KEY_DEST, None)
-                        if line_in_data is not None and dest_in_data is not None:
-                            if line_in_data != "" and dest_in_data != "":
-                                time_line_parsed_data.append(rt)
-
-                    parsed_data[DICT_KEY_ROUTES] = time_line_parsed_data
-
-            return parsed_data
+        """Update data, serving the last good departures while it fails.
 
+        Only transient failures (connection, timeout, 5xx) are bridged with
+        stale data. A rejected API key starts reauthentication and other
+        rejected requests are raised, as retrying will not fix them.
+        """
         try:
-            async with timeout(10):
-                # Find all the trips for the day
-                current_epoch = int(time.time())
-                variables = {
-                    VAR_ID: self.gtfs_id.upper(),
-                    VAR_CURR_EPOCH: current_epoch,
-                    VAR_LIMIT: LIMIT,
-                }
+            route_data = await self._async_fetch_departures()
+        except ConfigEntryAuthFailed:
+            self.metrics.record_failure()
+            raise
+        except UpdateFailed as error:
+            self.metrics.record_failure()
+            if not self._last_good or not is_transient(error):
+                raise
+            if self._stale_since is None:
+                self._stale_since = dt_util.utcnow().isoformat()
+                _LOGGER.warning(
+                    "Serving cached departures of %s while Digitransit fails: %s",
+                    self.gtfs_id,
+                    error,
+                )
+            self._fingerprint = None
+            self.route_data = stale_snapshot(
+                self._last_good, time.time(), self._stale_since
+            )
+            return self.route_data
+
+        self._stale_since = None
+
+        # Keep the previous object when nothing visible changed, so
+        # sensors skip their state write
+        fingerprint = departures_fingerprint(route_data)
+        if self.route_data is None or fingerprint != self._fingerprint:
+            self.route_data = route_data
+            self._fingerprint = fingerprint
+            _LOGGER.debug("DATA: %s", self.route_data)
+
+            if route_data and route_data.get(DICT_KEY_ROUTES) is not None:
+                self._last_good = route_data
+                self._snapshots.set(
+                    self._entry_id,
+                    trimmed_snapshot(route_data, time.time(), SNAPSHOT_HORIZON),
+                )
 
-                if not self.apikey:
-                    raise UpdateFailed("Digitransit API key missing. Add your API key in the integration options.")
+        # Poll less often while the next departure is far away
+        self.update_interval = compute_update_interval(
+            (self.route_data or {}).get(DICT_KEY_ROUTES),
+            time.time(),
+            self.min_interval,
+            self.max_interval,
+        )
 
-                # Some Digitransit gateways accept either header name
-                graph_client.headers["digitransit-subscription-key"] = self.apikey
-                graph_client.headers["Ocp-Apim-Subscription-Key"] = self.apikey
-                graph_client.headers["Accept"] = "application/json"
+        return self.route_data
 
-                # Asynchronous request
-                data = await graph_client.execute_async(
-                    query=ROUTE_QUERY_WITH_LIMIT, variables=variables
-                )
+    async def _async_fetch_departures(self):
+        """Fetch and parse departures via HSl HRT Open API."""
+        try:
+            async with timeout(10):
+                if not self.apikey:
+                    raise UpdateFailed("Digitransit API key missing. Add your API key in the integration options.")
 
-                self.route_data = parse_data(
-                    data=data, line_from_user=self.route, dest_from_user=self.dest
+                # Find all the trips for the day, shared with other entries
+                # watching the same stop
+                started = time.perf_counter()
+                data = await self.hub.async_get_data(self.apikey, requester=self)
+                fetched = time.perf_counter()
+
+                route_data = await self._async_parse(data)
+                self.metrics.record(
+                    fetched - started,
+                    self.hub.pop_response_bytes(self),
+                    data,
+                    time.perf_counter() - fetched,
+                    route_data,
                 )
-                _LOGGER.debug(f"DATA: {self.route_data}")
+                return route_data
 
+        except HSLHRTAuthFailed as error:
+            raise ConfigEntryAuthFailed(
+                "Digitransit rejected the API key. Enter a valid key to continue."
+            ) from error
         except ContentTypeError as cte:
             # Digitransit returned a non-JSON body (often 401/403 or HTML) -> likely bad/missing API key
             raise UpdateFailed(
@@ -287,4 +460,18 @@ class HSLHRTDataUpdateCoordinator(DataUpdateCoordinator):
             raise UpdateFailed(f"Network error talking to Digitransit: {str(ce)}") from ce
         except Exception as error:
             raise UpdateFailed(str(error)) from error
-            return {}
+
+    async def _async_parse(self, data):
+        """Parse a payload, in the executor if it is large.
+
+        The hub replaces the stoptime list and its updated rows instead of
+        changing them in place, so a parse in the executor always works on
+        a consistent payload.
+        """
+        stop = ((data or {}).get("data") or {}).get("stop") or {}
+        rows = len(stop.get("stoptimesWithoutPatterns") or ())
+        if rows > PARSE_EXECUTOR_ROWS and not self.parse_inline:
+            return await self.hass.async_add_executor_job(
+                parse_data, data, None, None, self.departure_filter
+            )
+        return parse_data(data=data, departure_filter=self.departure_filter)
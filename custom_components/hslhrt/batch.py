@@ -0,0 +1,195 @@
+"""Batch stop requests of all coordinators into one aliased GraphQL request."""
+
+import asyncio
+from collections import namedtuple
+import time
+
+from homeassistant.helpers.update_coordinator import UpdateFailed
+
+from .const import (
+    _LOGGER,
+    BATCH_WINDOW,
+    DEFAULT_BATCH_SIZE,
+    DEFAULT_MAX_DEPARTURES,
+    LIMIT,
+    STOPTIME_FIELDS,
+)
+from .query import (
+    build_batch_query,
+    build_batch_variables,
+    merge_pattern_stoptimes,
+    request_shape,
+    stop_alias,
+)
+
+_StopRequest = namedtuple(
+    "_StopRequest", "future patterns departures horizon realtime fields stats"
+)
+
+
+class HSLHRTBatchScheduler:
+    """Gather stop fetches that are due together and send them as one request.
+
+    The first fetch arms a short timer (BATCH_WINDOW). Every stop requested
+    before it fires is sent in the same document, one alias per stop, split
+    into chunks of at most `batch_size` stops. Requests using different API
+    keys are never mixed. The response is split back per alias, so an error
+    reported for one stop only fails that stop's callers.
+    """
+
+    def __init__(self, hass, execute):
+        """Initialize."""
+        self._hass = hass
+        self._execute = execute
+        self._pending = {}
+        self._timer = None
+        self._batch_sizes = {}
+
+    @property
+    def batch_size(self):
+        """Return the smallest batch size any config entry asked for."""
+        return min(self._batch_sizes.values(), default=DEFAULT_BATCH_SIZE)
+
+    def set_batch_size(self, entry_id, size):
+        """Record the batch size configured for an entry."""
+        self._batch_sizes[entry_id] = max(1, int(size))
+
+    def remove_entry(self, entry_id):
+        """Forget an unloaded entry."""
+        self._batch_sizes.pop(entry_id, None)
+
+    async def async_fetch_stop(
+        self,
+        apikey,
+        gtfs_id,
+        patterns=None,
+        departures=None,
+        horizon=None,
+        realtime=False,
+        fields=STOPTIME_FIELDS,
+        stats=None,
+    ):
+        """Queue a stop for the next batch and wait for its own response.
+
+        When `patterns` is given only the stoptimes of those patterns are
+        fetched, at most `departures` per pattern. When `horizon` is given
+        only departures within the next `horizon` seconds are fetched, and
+        with `realtime` at most `departures` of them. `fields` are the
+        stoptime fields to select. A `stats` dict receives the stop's share
+        of the response size under "bytes".
+        """
+        stops = self._pending.setdefault(apikey, {})
+        request = stops.get(gtfs_id)
+        if request is None:
+            request = stops[gtfs_id] = _StopRequest(
+                self._hass.loop.create_future(),
+                tuple(patterns) if patterns else None,
+                departures,
+                horizon,
+                realtime,
+                frozenset(fields),
+                stats,
+            )
+        future = request.future
+
+        if self._timer is None:
+            self._timer = self._hass.loop.call_later(
+                BATCH_WINDOW.total_seconds(), self._flush
+            )
+
+        # Shield so that one caller timing out does not fail the others
+        return await asyncio.shield(future)
+
+    def _flush(self):
+        """Send everything gathered during the window."""
+        self._timer = None
+        pending, self._pending = self._pending, {}
+        size = self.batch_size
+
+        for apikey, stops in pending.items():
+            items = list(stops.items())
+            for start in range(0, len(items), size):
+                self._hass.async_create_task(
+                    self._async_send(apikey, items[start : start + size])
+                )
+
+    async def _async_send(self, apikey, items):
+        """Execute one aliased request and resolve its futures."""
+        _LOGGER.debug("Fetching %d stop(s) in one request", len(items))
+
+        shapes = tuple(
+            request_shape(request.patterns, request.horizon, request.realtime)
+            for _, request in items
+        )
+        # Every stop gets its own departure count and time range variables
+        requests = [
+            (
+                gtfs_id,
+                shape,
+                request.patterns,
+                request.departures or DEFAULT_MAX_DEPARTURES,
+                request.horizon,
+            )
+            for (gtfs_id, request), shape in zip(items, shapes)
+        ]
+
+        # The fragment is shared too, select what any of the stops needs
+        fields = frozenset().union(*(request.fields for _, request in items))
+
+        stats = {}
+        try:
+            data = await self._execute(
+                apikey,
+                build_batch_query(shapes, fields),
+                build_batch_variables(requests, int(time.time()), LIMIT),
+                stats=stats,
+            )
+        except Exception as error:  # pylint: disable=broad-except
+            for _, request in items:
+                if not request.future.done():
+                    request.future.set_exception(error)
+            return
+
+        graph_data = data.get("data") or {}
+        errors = _errors_by_alias(data.get("errors") or [])
+        stop_data = [
+            merge_pattern_stoptimes(graph_data.get(stop_alias(index)), shape)
+            for index, shape in enumerate(shapes)
+        ]
+        shares = _response_shares(stats.get("bytes", 0), stop_data)
+
+        for index, (gtfs_id, request) in enumerate(items):
+            future = request.future
+            if future.done():
+                continue
+
+            alias = stop_alias(index)
+            if alias in errors and graph_data.get(alias) is None:
+                future.set_exception(
+                    UpdateFailed(f"Digitransit error for {gtfs_id}: {errors[alias]}")
+                )
+            elif not graph_data and None in errors:
+                future.set_exception(UpdateFailed(errors[None]))
+            else:
+                if request.stats is not None:
+                    request.stats["bytes"] = shares[index]
+                # Same shape as a single-stop response so parsing is unchanged
+                future.set_result({"data": {"stop": stop_data[index]}})
+
+
+def _errors_by_alias(errors):
+    """Map GraphQL error messages to the alias at the root of their path."""
+    result = {}
+    for error in errors:
+        path = error.get("path") or [None]
+        result.setdefault(path[0], error.get("message", "Unknown error"))
+    return result
+
+
+def _response_shares(total, stop_data):
+    """Split the size of a batch response between its stops by row count."""
+    rows = [
+        len((stop or {}).get("stoptimesWithoutPatterns") or ()) + 1
+        for stop in stop_data
+    ]
+    return [total * count // sum(rows) for count in rows]
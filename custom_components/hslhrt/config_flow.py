@@ -4,9 +4,17 @@ import re
 import voluptuous as vol
 
 from homeassistant import config_entries
+from homeassistant.core import callback
+from homeassistant.helpers import config_validation as cv
+from homeassistant.helpers.selector import (
+    SelectSelector,
+    SelectSelectorConfig,
+    SelectSelectorMode,
+)
 
 from . import base_unique_id
 from .helpers import (
+    lookup_stop,
     lookup_stops,
     lookup_routes,
     lookup_destinations,
@@ -20,7 +28,36 @@ from .const import (
     ALL,
     ROUTE,
     DESTINATION,
+    PER_ROUTE,
+    PER_HEADSIGN,
+    ROUTE_GROUPS,
     APIKEY,
+    CONF_BATCH_SIZE,
+    DEFAULT_BATCH_SIZE,
+    MAX_BATCH_SIZE,
+    CONF_SERVER_FILTER,
+    DEFAULT_SERVER_FILTER,
+    CONF_MAX_DEPARTURES,
+    DEFAULT_MAX_DEPARTURES,
+    MAX_DEPARTURES,
+    CONF_ATTRIBUTE_DEPARTURES,
+    DEFAULT_ATTRIBUTE_DEPARTURES,
+    MAX_ATTRIBUTE_DEPARTURES,
+    CONF_HFP_BROKER,
+    DEFAULT_HFP_BROKER,
+    CONF_INCREMENTAL,
+    DEFAULT_INCREMENTAL,
+    CONF_HORIZON,
+    DEFAULT_HORIZON,
+    MIN_HORIZON,
+    MAX_HORIZON,
+    CONF_MIN_INTERVAL,
+    DEFAULT_MIN_INTERVAL,
+    CONF_MAX_INTERVAL,
+    DEFAULT_MAX_INTERVAL,
+    MAX_INTERVAL,
+    CONF_GTFS_PATH,
+    DEFAULT_GTFS_PATH,
 )
 
 GTFS_REGEX = re.compile(r"^HSL:\d+$")
@@ -32,6 +69,12 @@ class HSLHRTConfigFlowHandler(config_entries.ConfigFlow, domain=DOMAIN):
     VERSION = 1
     CONNECTION_CLASS = config_entries.CONN_CLASS_CLOUD_POLL
 
+    @staticmethod
+    @callback
+    def async_get_options_flow(config_entry):
+        """Return the options flow handler."""
+        return HSLHRTOptionsFlowHandler(config_entry)
+
     async def async_step_apikey(self, user_input=None):
         """Ask the user for the Digitransit API key."""
         errors = {}
@@ -57,6 +100,37 @@ class HSLHRTConfigFlowHandler(config_entries.ConfigFlow, domain=DOMAIN):
             errors=errors,
         )
 
+    async def async_step_reauth(self, entry_data):
+        """Ask for a new API key after Digitransit rejected the stored one."""
+        self._reauth_entry = self.hass.config_entries.async_get_entry(
+            self.context["entry_id"]
+        )
+        return await self.async_step_reauth_confirm()
+
+    async def async_step_reauth_confirm(self, user_input=None):
+        """Store the new API key and reload the entry."""
+        errors = {}
+
+        if user_input is not None:
+            key = user_input.get(APIKEY, "").strip()
+
+            if not key:
+                errors["base"] = "missing_apikey"
+            else:
+                self.hass.data.setdefault(DOMAIN, {})[APIKEY] = key
+                return self.async_update_reload_and_abort(
+                    self._reauth_entry,
+                    data={**self._reauth_entry.data, APIKEY: key},
+                )
+
+        return self.async_show_form(
+            step_id="reauth_confirm",
+            data_schema=vol.Schema({
+                vol.Required(APIKEY): str
+            }),
+            errors=errors,
+        )
+
     async def async_step_user(self, user_input=None):
         """Ask for stop name or GTFS ID."""
         errors = {}
@@ -76,9 +150,8 @@ class HSLHRTConfigFlowHandler(config_entries.ConfigFlow, domain=DOMAIN):
                 self.selected_stop = self.stop_query
 
                 # Fetch stop info for naming
-                stops = await lookup_stops(self.existing_key, self.stop_query)
-                if stops:
-                    s = stops[0]
+                s = await lookup_stop(self.hass, self.existing_key, self.stop_query)
+                if s:
                     self.selected_stop_name = s["name"]
                     self.selected_stop_code = s["code"]
                 else:
@@ -107,7 +180,7 @@ class HSLHRTConfigFlowHandler(config_entries.ConfigFlow, domain=DOMAIN):
 
         # Only fetch stops on first render
         if user_input is None:
-            stops = await lookup_stops(apikey, self.stop_query)
+            stops = await lookup_stops(self.hass, apikey, self.stop_query)
 
             if not stops:
                 return self.async_show_form(
@@ -161,27 +234,39 @@ class HSLHRTConfigFlowHandler(config_entries.ConfigFlow, domain=DOMAIN):
         if not apikey:
             return self.async_abort(reason="missing_apikey")
 
-        routes = await lookup_routes(apikey, self.selected_stop)
+        routes = await lookup_routes(self.hass, apikey, self.selected_stop)
         # Deduplicate shortNames
         self.routes = sorted(set(r["shortName"] for r in routes))
 
         if not self.routes:
             return self.async_abort(reason="no_routes_found")
 
-        route_options = self.routes + [ALL]
+        route_options = self.routes + [ALL, PER_ROUTE]
+        # ALL and PER_ROUTE are labelled through the "route" selector translations
+        schema = vol.Schema({
+            vol.Required("route"): SelectSelector(
+                SelectSelectorConfig(
+                    options=route_options,
+                    mode=SelectSelectorMode.DROPDOWN,
+                    translation_key="route",
+                )
+            )
+        })
 
         if user_input is not None:
             route = user_input.get("route")
             if route not in route_options:
                 return self.async_show_form(
                     step_id="pick_route",
-                    data_schema=vol.Schema({
-                        vol.Required("route"): vol.In(route_options)
-                    }),
+                    data_schema=schema,
                     errors={"route": "invalid_route"},
                 )
 
             self.selected_route = route
+            self.selected_groups = None
+
+            if self.selected_route == PER_ROUTE:
+                return await self.async_step_pick_routes()
 
             if self.selected_route == ALL:
                 self.selected_dest = ALL
@@ -191,9 +276,45 @@ class HSLHRTConfigFlowHandler(config_entries.ConfigFlow, domain=DOMAIN):
 
         return self.async_show_form(
             step_id="pick_route",
-            data_schema=vol.Schema({
-                vol.Required("route"): vol.In(route_options)
-            }),
+            data_schema=schema,
+            errors={},
+        )
+
+    async def async_step_pick_routes(self, user_input=None):
+        """Pick the routes of a stop entry with one sensor per route."""
+        schema = vol.Schema({
+            vol.Required("routes"): cv.multi_select(self.routes),
+            vol.Optional(PER_HEADSIGN, default=False): bool,
+        })
+
+        if user_input is not None:
+            routes = [r for r in self.routes if r in user_input.get("routes", [])]
+            if not routes:
+                return self.async_show_form(
+                    step_id="pick_routes",
+                    data_schema=schema,
+                    errors={"routes": "no_routes_selected"},
+                )
+
+            groups = []
+            for route in routes:
+                dests = [None]
+                if user_input.get(PER_HEADSIGN):
+                    dests = await lookup_destinations(
+                        self.hass, self.existing_key, self.selected_stop, route
+                    )
+                    # A route without known headsigns gets one sensor
+                    dests = [d for d in dests if d != "ALL"] or [None]
+                groups.extend([route, dest] for dest in dests)
+
+            self.selected_groups = groups
+            self.selected_route = ALL
+            self.selected_dest = ALL
+            return await self._create_final_entry()
+
+        return self.async_show_form(
+            step_id="pick_routes",
+            data_schema=schema,
             errors={},
         )
 
@@ -203,7 +324,9 @@ class HSLHRTConfigFlowHandler(config_entries.ConfigFlow, domain=DOMAIN):
         if not apikey:
             return self.async_abort(reason="missing_apikey")
 
-        dests = await lookup_destinations(apikey, self.selected_stop, self.selected_route)
+        dests = await lookup_destinations(
+            self.hass, apikey, self.selected_stop, self.selected_route
+        )
         # Deduplicate destinations
         self.dests = sorted(set(dests))
 
@@ -237,6 +360,7 @@ class HSLHRTConfigFlowHandler(config_entries.ConfigFlow, domain=DOMAIN):
             self.selected_stop,
             self.selected_route,
             self.selected_dest,
+            groups=self.selected_groups,
         )
 
         await self.async_set_unique_id(unique_id)
@@ -245,21 +369,92 @@ class HSLHRTConfigFlowHandler(config_entries.ConfigFlow, domain=DOMAIN):
         # Build a clean, human-friendly title
         stop_label = f"{self.selected_stop_name} ({self.selected_stop_code})"
 
-        if self.selected_route == ALL:
+        if self.selected_groups:
+            routes = dict.fromkeys(route for route, _ in self.selected_groups)
+            title = f"{stop_label} – {', '.join(routes)}"
+        elif self.selected_route == ALL:
             title = f"{stop_label} – ALL"
         elif self.selected_dest == ALL:
             title = f"{stop_label} – {self.selected_route} (ALL)"
         else:
             title = f"{stop_label} – {self.selected_route} → {self.selected_dest}"
 
-        return self.async_create_entry(
-            title=title,
-            data={
-                STOP_GTFS: self.selected_stop,
-                STOP_NAME: self.selected_stop_name,
-                STOP_CODE: self.selected_stop_code,
-                ROUTE: self.selected_route,
-                DESTINATION: self.selected_dest,
-                APIKEY: self.existing_key,
-            },
+        data = {
+            STOP_GTFS: self.selected_stop,
+            STOP_NAME: self.selected_stop_name,
+            STOP_CODE: self.selected_stop_code,
+            ROUTE: self.selected_route,
+            DESTINATION: self.selected_dest,
+            APIKEY: self.existing_key,
+        }
+        if self.selected_groups:
+            data[ROUTE_GROUPS] = self.selected_groups
+
+        return self.async_create_entry(title=title, data=data)
+
+
+class HSLHRTOptionsFlowHandler(config_entries.OptionsFlow):
+    """Options flow handler for HSL HRT."""
+
+    def __init__(self, config_entry):
+        """Initialize."""
+        self._entry = config_entry
+
+    async def async_step_init(self, user_input=None):
+        """Manage the polling options."""
+        if user_input is not None:
+            return self.async_create_entry(title="", data=user_input)
+
+        options = self._entry.options
+
+        return self.async_show_form(
+            step_id="init",
+            data_schema=vol.Schema({
+                vol.Optional(
+                    CONF_BATCH_SIZE,
+                    default=options.get(CONF_BATCH_SIZE, DEFAULT_BATCH_SIZE),
+                ): vol.All(vol.Coerce(int), vol.Range(min=1, max=MAX_BATCH_SIZE)),
+                vol.Optional(
+                    CONF_SERVER_FILTER,
+                    default=options.get(CONF_SERVER_FILTER, DEFAULT_SERVER_FILTER),
+                ): bool,
+                vol.Optional(
+                    CONF_MAX_DEPARTURES,
+                    default=options.get(CONF_MAX_DEPARTURES, DEFAULT_MAX_DEPARTURES),
+                ): vol.All(vol.Coerce(int), vol.Range(min=1, max=MAX_DEPARTURES)),
+                vol.Optional(
+                    CONF_INCREMENTAL,
+                    default=options.get(CONF_INCREMENTAL, DEFAULT_INCREMENTAL),
+                ): bool,
+                vol.Optional(
+                    CONF_HORIZON,
+                    default=options.get(CONF_HORIZON, DEFAULT_HORIZON),
+                ): vol.All(
+                    vol.Coerce(int), vol.Range(min=MIN_HORIZON, max=MAX_HORIZON)
+                ),
+                vol.Optional(
+                    CONF_MIN_INTERVAL,
+                    default=options.get(CONF_MIN_INTERVAL, DEFAULT_MIN_INTERVAL),
+                ): vol.All(vol.Coerce(int), vol.Range(min=1, max=MAX_INTERVAL)),
+                vol.Optional(
+                    CONF_MAX_INTERVAL,
+                    default=options.get(CONF_MAX_INTERVAL, DEFAULT_MAX_INTERVAL),
+                ): vol.All(vol.Coerce(int), vol.Range(min=1, max=MAX_INTERVAL)),
+                vol.Optional(
+                    CONF_GTFS_PATH,
+                    default=options.get(CONF_GTFS_PATH, DEFAULT_GTFS_PATH),
+                ): str,
+                vol.Optional(
+                    CONF_ATTRIBUTE_DEPARTURES,
+                    default=options.get(
+                        CONF_ATTRIBUTE_DEPARTURES, DEFAULT_ATTRIBUTE_DEPARTURES
+                    ),
+                ): vol.All(
+                    vol.Coerce(int), vol.Range(min=1, max=MAX_ATTRIBUTE_DEPARTURES)
+                ),
+                vol.Optional(
+                    CONF_HFP_BROKER,
+                    default=options.get(CONF_HFP_BROKER, DEFAULT_HFP_BROKER),
+                ): str,
+            }),
         )
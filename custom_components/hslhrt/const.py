@@ -9,7 +9,71 @@ NAME = DEFAULT_NAME = "HSLHRT"
 MANUFACTURER = "Helsinki Regional Transport Authority"
 
 COORDINATOR = "coordinator"
+HUBS = "hubs"
+BATCH_SCHEDULER = "batch_scheduler"
+METADATA_CACHE = "metadata_cache"
+TRANSPORT = "transport"
+GTFS_ENGINES = "gtfs_engines"
+HFP_CLIENTS = "hfp_clients"
+LOOKUP_CACHE = "lookup_cache"
+STOP_DIRECTORY = "stop_directory"
+GOVERNOR = "governor"
+SNAPSHOTS = "snapshots"
+STARTUP_LIMITER = "startup_limiter"
 MIN_TIME_BETWEEN_UPDATES = timedelta(minutes=1)
+HUB_MAX_AGE = timedelta(seconds=15)
+BATCH_WINDOW = timedelta(seconds=1)
+TIMETABLE_REFRESH = timedelta(hours=1)
+DEPARTURE_LEAD = timedelta(minutes=5)
+GTFS_REALTIME_HORIZON = timedelta(minutes=30)
+GTFS_REALTIME_TRIPS = 10
+METADATA_TTL = timedelta(days=1)
+LOOKUP_TTL = timedelta(minutes=10)
+STOP_INDEX_TTL = timedelta(days=7)
+STOP_SEARCH_LIMIT = 20
+
+# Request governor, shared by every entry using the same API key
+RATE_LIMIT = 5
+RATE_BURST = 10
+BACKOFF_BASE = timedelta(seconds=2)
+BACKOFF_MAX = timedelta(minutes=5)
+MAX_DEFER = timedelta(seconds=5)
+START_STAGGER = timedelta(milliseconds=50)
+START_JITTER = timedelta(seconds=1)
+# First refreshes running at once after a restart, one full batch
+STARTUP_CONCURRENCY = 20
+CIRCUIT_THRESHOLD = 3
+CIRCUIT_COOLDOWN = timedelta(minutes=1)
+CIRCUIT_MAX_COOLDOWN = timedelta(minutes=15)
+HFP_RECONCILE_INTERVAL = timedelta(minutes=10)
+COUNTDOWN_INTERVAL = timedelta(seconds=15)
+# Larger payloads are decoded and parsed in the executor
+DECODE_EXECUTOR_BYTES = 256 * 1024
+PARSE_EXECUTOR_ROWS = 500
+
+# Performance metrics kept per entry
+METRICS_HISTORY = 60
+METRIC_LATENCY = "request_latency"
+METRIC_BYTES = "response_bytes"
+METRIC_DEPARTURES = "departures_parsed"
+METRIC_PARSE_TIME = "parse_time"
+METRIC_HIT_RATIO = "filter_hit_ratio"
+METRIC_FAILURES = "consecutive_failures"
+# Upper bucket edges of the diagnostics histograms
+METRIC_BUCKETS = {
+    METRIC_LATENCY: (50, 100, 250, 500, 1000, 2500, 5000, 10000),
+    METRIC_BYTES: (10000, 50000, 100000, 250000, 500000, 1000000),
+    METRIC_PARSE_TIME: (1, 2, 5, 10, 25, 50, 100),
+}
+
+STORAGE_VERSION = 1
+METADATA_STORAGE_KEY = f"{DOMAIN}.metadata"
+METADATA_SAVE_DELAY = 30
+STOP_INDEX_STORAGE_KEY = f"{DOMAIN}.stops"
+SNAPSHOT_STORAGE_KEY = f"{DOMAIN}.snapshots"
+SNAPSHOT_SAVE_DELAY = 60
+# Seconds of upcoming departures kept in a saved snapshot
+SNAPSHOT_HORIZON = 3 * 3600
 UNDO_UPDATE_LISTENER = "undo_update_listener"
 
 BASE_URL = "https://api.digitransit.fi/routing/v2/hsl/gtfs/v1"
@@ -19,24 +83,84 @@ STOP_CODE = "stop_code"
 STOP_NAME = "stop_name"
 STOP_GTFS = "stop_gtfs"
 ROUTE = "route"
+NEXT_DEPARTURE = "next_departure"
+COUNTDOWN = "countdown"
 ROUTE_DEST = "route_destination"
 DESTINATION = "destination"
 ALL = "all"
+# Route choice of a stop entry with one sensor per route
+PER_ROUTE = "per_route"
+PER_HEADSIGN = "per_headsign"
+# Entry data of such an entry, [route, headsign or None] per sensor
+ROUTE_GROUPS = "route_groups"
 ERROR = "err"
 APIKEY = "apikey"
 
+# Options
+CONF_BATCH_SIZE = "batch_size"
+DEFAULT_BATCH_SIZE = 20
+MAX_BATCH_SIZE = 100
+CONF_SERVER_FILTER = "server_filter"
+DEFAULT_SERVER_FILTER = False
+CONF_MAX_DEPARTURES = "max_departures"
+DEFAULT_MAX_DEPARTURES = 20
+MAX_DEPARTURES = 200
+CONF_INCREMENTAL = "incremental"
+DEFAULT_INCREMENTAL = False
+CONF_HORIZON = "horizon"
+DEFAULT_HORIZON = 60
+MIN_HORIZON = 15
+MAX_HORIZON = 180
+CONF_MIN_INTERVAL = "min_interval"
+DEFAULT_MIN_INTERVAL = 1
+CONF_MAX_INTERVAL = "max_interval"
+DEFAULT_MAX_INTERVAL = 15
+MAX_INTERVAL = 120
+CONF_GTFS_PATH = "gtfs_path"
+DEFAULT_GTFS_PATH = ""
+CONF_ATTRIBUTE_DEPARTURES = "attribute_departures"
+DEFAULT_ATTRIBUTE_DEPARTURES = 10
+MAX_ATTRIBUTE_DEPARTURES = 100
+CONF_HFP_BROKER = "hfp_broker"
+DEFAULT_HFP_BROKER = ""
+
+# Services
+SERVICE_GET_DEPARTURES = "get_departures"
+ATTR_ENTRY_ID = "entry_id"
+ATTR_START = "start"
+ATTR_WITHIN = "within"
+ATTR_OFFSET = "offset"
+ATTR_LIMIT = "limit"
+DEFAULT_SERVICE_LIMIT = 50
+MAX_SERVICE_LIMIT = 1000
+SERVICE_PROFILE = "profile"
+ATTR_CYCLES = "cycles"
+DEFAULT_PROFILE_CYCLES = 5
+MAX_PROFILE_CYCLES = 60
+# Loop lag sampling while profiling
+PROFILE_TICK = timedelta(milliseconds=10)
+PROFILE_BLOCKED = timedelta(milliseconds=50)
+PROFILE_TOP = 40
+
 # Graphql variables
 VAR_NAME_CODE = "name_code"
 VAR_ID = "id"
 VAR_SECS_LEFT = "sec_left_in_day"
 VAR_CURR_EPOCH = "current_epoch"
 VAR_LIMIT = "limit"
+VAR_PATTERN = "pattern"
+VAR_DEPARTURES = "departures"
+VAR_TIME_RANGE = "time_range"
 
 # Dict keys
 DICT_KEY_ROUTE = "route"
 DICT_KEY_ROUTES = "routes"
 DICT_KEY_DEST = "destination"
 DICT_KEY_ARRIVAL = "arrival"
+DICT_KEY_EPOCH = "epoch"
+DICT_KEY_REALTIME = "realtime"
+DICT_KEY_STALE_SINCE = "stale_since"
+DICT_KEY_GROUPS = "groups"
 
 ATTR_ROUTE = "ROUTE"
 ATTR_DEST = "DESTINATION"
@@ -44,7 +168,10 @@ ATTR_ARR_TIME = "ARRIVAL TIME"
 ATTR_STOP_NAME = "STOP NAME"
 ATTR_STOP_CODE = "STOP CODE"
 ATTR_STOP_GTFS = "GTFS ID"
+ATTR_REALTIME = "REALTIME"
+ATTR_STALE_SINCE = "stale_since"
 
+ATTR_ATTRIBUTION = "attribution"
 ATTRIBUTION = "Data provided by Helsinki Regional Transport(HSL HRT)"
 
 LIMIT = 1500
@@ -66,6 +193,16 @@ STOP_ID_QUERY = """
     }
 	"""
 
+ALL_STOPS_QUERY = """
+    query {
+        stops {
+            gtfsId
+            name
+            code
+        }
+    }
+	"""
+
 STOP_ID_BY_GTFS_QUERY = """ 
 	query ($ids: [String!]) { 
 		stops(ids: $ids) { 
@@ -75,6 +212,7 @@ STOP_ID_BY_GTFS_QUERY = """
 			routes { 
 				shortName 
 				patterns { 
+					code
 					headsign 
 				} 
 			} 
@@ -129,35 +267,26 @@ ROUTE_QUERY_WITH_RANGE = """
 	}
 """
 
-ROUTE_QUERY_WITH_LIMIT = """
-    query ($id: String!, $current_epoch: Long!, $limit: Int!) {
-		stop (id: $id) {
-			name
-			code
-			gtfsId
-			routes {
-		  		shortName
-		  		patterns {
-					headsign
-		  		}
-			}
-			stoptimesWithoutPatterns (startTime: $current_epoch, numberOfDepartures: $limit){
-				scheduledArrival
-	  			realtimeArrival
-	  			arrivalDelay
-	  			scheduledDeparture
-	  			realtimeDeparture
-	  			departureDelay
-	  			realtime
-	  			realtimeState
-	  			serviceDay
-				headsign
-				trip {
-					route {
-						shortName
-					}
-				}
-			}
-		}
-	}
-"""
+# Stoptime fields as dotted paths, see query.build_stoptime_fragment.
+# Every poll fetches what parsing needs, the rest only when a consumer is on.
+STOPTIME_FIELDS = frozenset(
+    {
+        "serviceDay",
+        "scheduledArrival",
+        "realtimeArrival",
+        "realtime",
+        "headsign",
+        "trip.route.shortName",
+    }
+)
+# Matching rows of the same trip across fetches (incremental, GTFS overlay)
+TRIP_MATCH_FIELDS = frozenset({"trip.gtfsId"})
+# Matching rows to HFP vehicle events
+HFP_FIELDS = frozenset(
+    {
+        "scheduledDeparture",
+        "trip.directionId",
+        "trip.route.gtfsId",
+        "trip.departureStoptime.scheduledDeparture",
+    }
+)
@@ -0,0 +1,28 @@
+"""Diagnostics support for HSL HRT."""
+
+from homeassistant.components.diagnostics import async_redact_data
+
+from .const import (
+    APIKEY,
+    COORDINATOR,
+    DOMAIN,
+    GOVERNOR,
+)
+
+TO_REDACT = {APIKEY}
+
+
+async def async_get_config_entry_diagnostics(hass, config_entry):
+    """Return diagnostics for a config entry."""
+    governor = hass.data[DOMAIN].get(GOVERNOR)
+    entry_data = hass.data[DOMAIN].get(config_entry.entry_id) or {}
+    coordinator = entry_data.get(COORDINATOR)
+
+    return {
+        "entry": {
+            "data": async_redact_data(dict(config_entry.data), TO_REDACT),
+            "options": dict(config_entry.options),
+        },
+        "request_governor": dict(governor.counters) if governor else None,
+        "metrics": coordinator.metrics.as_dict() if coordinator else None,
+    }
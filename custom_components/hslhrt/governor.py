@@ -0,0 +1,200 @@
+"""Shared request governor keeping all entries inside Digitransit's quota."""
+
+import asyncio
+import random
+import time
+
+from .const import (
+    _LOGGER,
+    BACKOFF_BASE,
+    BACKOFF_MAX,
+    CIRCUIT_COOLDOWN,
+    CIRCUIT_MAX_COOLDOWN,
+    CIRCUIT_THRESHOLD,
+    MAX_DEFER,
+    RATE_BURST,
+    RATE_LIMIT,
+    START_JITTER,
+    START_STAGGER,
+)
+from .transport import HSLHRTRateLimited, HSLHRTTransientError, is_transient
+
+
+class HSLHRTCircuitOpen(HSLHRTTransientError):
+    """Digitransit is failing and requests are paused."""
+
+
+class TokenBucket:
+    """Token bucket handing out reservations instead of rejections.
+
+    A caller that finds the bucket empty still takes a token, driving the
+    level negative, and is told how long to wait for it. Callers are
+    therefore served in arrival order at `rate` per second after a burst of
+    `capacity`.
+    """
+
+    def __init__(self, rate, capacity):
+        """Initialize a full bucket."""
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+
+    def reserve(self):
+        """Take a token and return the seconds to wait before using it."""
+        now = time.monotonic()
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._updated) * self.rate
+        )
+        self._updated = now
+        self._tokens -= 1
+        return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+
+class HSLHRTRequestGovernor:
+    """Pace every Digitransit request of the integration.
+
+    - One token bucket per API key caps the request rate however many
+      entries share the key.
+    - A 429 blocks the key for its Retry-After, or an exponential jittered
+      backoff when the server gives none. Requests made while blocked wait if
+      the block ends within MAX_DEFER and fail fast otherwise, so a rate
+      limited key is not retried by every coordinator at once.
+    - Coordinators starting together (e.g. after a restart) get staggered,
+      jittered start delays.
+    - After CIRCUIT_THRESHOLD consecutive transient failures (connection,
+      timeout or 5xx) of a key, its circuit breaker opens and the key's
+      requests fail without touching the network for a cooldown that
+      doubles up to CIRCUIT_MAX_COOLDOWN. Then a single trial request
+      decides whether to close it again. Rejected requests and GraphQL
+      errors pass through without counting, so one misconfigured entry
+      does not pause the others.
+
+    `counters` tracks how often this happened.
+    """
+
+    def __init__(self, execute):
+        """Initialize."""
+        self._execute = execute
+        self._buckets = {}
+        self._blocked_until = {}
+        self._failures = {}
+        self._next_start = 0.0
+        self._circuit_failures = {}
+        self._circuit_open_until = {}
+        self._probing = set()
+        self.counters = {
+            "requests": 0,
+            "throttled": 0,
+            "deferred": 0,
+            "rate_limited": 0,
+            "failed": 0,
+            "short_circuited": 0,
+            "circuit_opened": 0,
+        }
+
+    def circuit_open(self, apikey):
+        """Return True while a key's requests are paused by its circuit breaker."""
+        return (
+            apikey in self._probing
+            or self._circuit_open_until.get(apikey, 0.0) > time.monotonic()
+        )
+
+    def start_delay(self):
+        """Return how long a starting coordinator should wait."""
+        now = time.monotonic()
+        slot = max(now, self._next_start)
+        self._next_start = slot + START_STAGGER.total_seconds()
+        return slot - now + random.uniform(0, START_JITTER.total_seconds())
+
+    async def async_execute(self, apikey, query, variables=None, **kwargs):
+        """Execute a request once the key's quota and backoff allow it."""
+        if self.circuit_open(apikey):
+            self.counters["short_circuited"] += 1
+            raise HSLHRTCircuitOpen("Digitransit is failing, requests are paused")
+
+        # Past the threshold this is the half-open trial request
+        probing = self._circuit_failures.get(apikey, 0) >= CIRCUIT_THRESHOLD
+        if probing:
+            self._probing.add(apikey)
+
+        try:
+            await self._async_wait_turn(apikey)
+
+            self.counters["requests"] += 1
+            try:
+                result = await self._execute(apikey, query, variables, **kwargs)
+            except HSLHRTRateLimited as error:
+                self._back_off(apikey, error.retry_after)
+                raise
+            except Exception as error:
+                if is_transient(error):
+                    self._trip(apikey)
+                else:
+                    # Digitransit answered, the request itself was at fault
+                    self._close(apikey)
+                raise
+        finally:
+            if probing:
+                self._probing.discard(apikey)
+
+        self._failures.pop(apikey, None)
+        self._close(apikey)
+        return result
+
+    def _close(self, apikey):
+        """Reset a key's circuit after Digitransit answered."""
+        if self._circuit_failures.pop(apikey, 0) >= CIRCUIT_THRESHOLD:
+            _LOGGER.info("Digitransit is responding again, resuming requests")
+
+    async def _async_wait_turn(self, apikey):
+        """Wait for the key's backoff and a token of its bucket."""
+        wait = self._blocked_until.get(apikey, 0.0) - time.monotonic()
+        if wait > 0:
+            self.counters["deferred"] += 1
+            if wait > MAX_DEFER.total_seconds():
+                raise HSLHRTRateLimited(wait)
+            await asyncio.sleep(wait)
+
+        bucket = self._buckets.get(apikey)
+        if bucket is None:
+            bucket = self._buckets[apikey] = TokenBucket(RATE_LIMIT, RATE_BURST)
+        wait = bucket.reserve()
+        if wait > 0:
+            self.counters["throttled"] += 1
+            await asyncio.sleep(wait)
+
+    def _trip(self, apikey):
+        """Count a transient failure and open the key's circuit past the threshold."""
+        self.counters["failed"] += 1
+        failures = self._circuit_failures[apikey] = (
+            self._circuit_failures.get(apikey, 0) + 1
+        )
+        excess = failures - CIRCUIT_THRESHOLD
+        if excess < 0:
+            return
+
+        cooldown = min(
+            CIRCUIT_MAX_COOLDOWN.total_seconds(),
+            CIRCUIT_COOLDOWN.total_seconds() * 2 ** excess,
+        )
+        self._circuit_open_until[apikey] = time.monotonic() + cooldown
+        self.counters["circuit_opened"] += 1
+        _LOGGER.warning(
+            "Digitransit failed %d times in a row, pausing requests for %.0f s",
+            failures,
+            cooldown,
+        )
+
+    def _back_off(self, apikey, retry_after):
+        """Block a key after a 429."""
+        failures = self._failures[apikey] = self._failures.get(apikey, 0) + 1
+        delay = min(
+            BACKOFF_MAX.total_seconds(),
+            BACKOFF_BASE.total_seconds() * 2 ** (failures - 1),
+        )
+        delay = max(delay, retry_after or 0) * random.uniform(1, 1.25)
+
+        self.counters["rate_limited"] += 1
+        self._blocked_until[apikey] = time.monotonic() + delay
+        _LOGGER.warning("Digitransit rate limit hit, pausing requests for %.0f s", delay)
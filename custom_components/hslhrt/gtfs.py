@@ -0,0 +1,426 @@
+"""Offline GTFS static timetable engine for HSL HRT.
+
+The engine reads a local GTFS static zip (e.g. HSL's hsl.zip) and keeps a
+compact per-stop departure index for the configured stops only. It answers
+with payloads shaped like a Digitransit `stop` query, so the regular parser
+and sensors work unchanged. Digitransit is then only asked for realtime
+deltas of the next few trips, which are overlaid on the schedule.
+"""
+
+from array import array
+from bisect import bisect_left
+import csv
+from datetime import date, datetime, time as dt_time, timedelta
+import io
+import zipfile
+from zoneinfo import ZoneInfo
+
+from .const import (
+    _LOGGER,
+    LIMIT,
+    SECS_IN_DAY,
+)
+
+DEFAULT_TIMEZONE = "Europe/Helsinki"
+DEFAULT_FEED = "HSL"
+
+# calendar.txt weekday columns, Monday first like date.weekday()
+WEEKDAYS = (
+    "monday",
+    "tuesday",
+    "wednesday",
+    "thursday",
+    "friday",
+    "saturday",
+    "sunday",
+)
+
+
+def _parse_gtfs_time(value):
+    """Return an HH:MM:SS GTFS time (hours may exceed 23) as seconds."""
+    hours, minutes, seconds = value.strip().split(":")
+    return int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+
+
+def _parse_gtfs_date(value):
+    """Return a YYYYMMDD GTFS date."""
+    return date(int(value[0:4]), int(value[4:6]), int(value[6:8]))
+
+
+def _read_csv(feed, name):
+    """Yield the rows of a feed file as dicts, or nothing if it is missing."""
+    try:
+        handle = feed.open(name)
+    except KeyError:
+        return
+    with io.TextIOWrapper(handle, encoding="utf-8-sig", newline="") as text:
+        yield from csv.DictReader(text)
+
+
+def read_stops(path, feed_id=DEFAULT_FEED):
+    """Return every boarding stop of a GTFS zip in lookup format (blocking)."""
+    with zipfile.ZipFile(path) as feed:
+        return [
+            {
+                "gtfsId": f"{feed_id}:{row['stop_id']}",
+                "name": row.get("stop_name", ""),
+                "code": row.get("stop_code", ""),
+            }
+            for row in _read_csv(feed, "stops.txt")
+            # Stations, entrances and nodes cannot be boarded at
+            if row.get("location_type", "") in ("", "0")
+        ]
+
+
+class GTFSTimetable:
+    """Compact departure index of a set of stops built from a GTFS zip.
+
+    Per stop and service id the arrival times are kept in sorted `array`s
+    with parallel arrays of trip and headsign indices. Trips, routes and
+    headsigns are interned once, so the index stays small even for busy hub
+    stops.
+    """
+
+    def __init__(self, feed_id=DEFAULT_FEED, timezone=DEFAULT_TIMEZONE):
+        """Initialize an empty timetable."""
+        self.feed_id = feed_id
+        self.timezone = ZoneInfo(timezone)
+        self.stops = {}
+        self._index = {}
+        self._stop_routes = {}
+        self._route_names = []
+        self._headsigns = []
+        self._trip_ids = []
+        self._trip_route = array("I")
+        self._services = []
+        self._calendar = {}
+        self._calendar_dates = {}
+
+    @classmethod
+    def from_zip(cls, path, gtfs_ids, feed_id=DEFAULT_FEED):
+        """Build the index of the given stops from a GTFS zip (blocking)."""
+        prefix = f"{feed_id}:"
+        wanted = {
+            gtfs_id[len(prefix):] if gtfs_id.upper().startswith(prefix) else gtfs_id
+            for gtfs_id in gtfs_ids
+        }
+
+        with zipfile.ZipFile(path) as feed:
+            agency = next(_read_csv(feed, "agency.txt"), {})
+            timetable = cls(feed_id, agency.get("agency_timezone") or DEFAULT_TIMEZONE)
+            timetable._load(feed, wanted)
+
+        _LOGGER.debug(
+            "Indexed %d stop(s) and %d trip(s) from %s",
+            len(timetable.stops),
+            len(timetable._trip_ids),
+            path,
+        )
+        return timetable
+
+    def _load(self, feed, wanted):
+        """Read the feed files needed for the wanted stops."""
+        for row in _read_csv(feed, "stops.txt"):
+            if row["stop_id"] in wanted:
+                self.stops[row["stop_id"]] = {
+                    "name": row.get("stop_name", ""),
+                    "code": row.get("stop_code", ""),
+                }
+
+        # Only the stop_times of the wanted stops are kept in memory
+        stop_times = []
+        trip_ids = {}
+        for row in _read_csv(feed, "stop_times.txt"):
+            stop_id = row["stop_id"]
+            if stop_id not in wanted:
+                continue
+            arrival = row.get("arrival_time") or row.get("departure_time")
+            if not arrival:
+                continue
+            trip = trip_ids.setdefault(row["trip_id"], len(trip_ids))
+            stop_times.append(
+                (stop_id, _parse_gtfs_time(arrival), trip, row.get("stop_headsign", ""))
+            )
+
+        routes = {}
+        for row in _read_csv(feed, "routes.txt"):
+            routes[row["route_id"]] = row.get("route_short_name") or row.get(
+                "route_long_name", ""
+            )
+
+        route_index = {}
+        headsign_index = {}
+        service_index = {}
+        trip_service = array("I", [0]) * len(trip_ids)
+        trip_headsign = array("I", [0]) * len(trip_ids)
+        self._trip_ids = [None] * len(trip_ids)
+        self._trip_route = array("I", [0]) * len(trip_ids)
+
+        def intern(index, values, value):
+            position = index.get(value)
+            if position is None:
+                position = index[value] = len(values)
+                values.append(value)
+            return position
+
+        for row in _read_csv(feed, "trips.txt"):
+            trip = trip_ids.get(row["trip_id"])
+            if trip is None:
+                continue
+            self._trip_ids[trip] = row["trip_id"]
+            self._trip_route[trip] = intern(
+                route_index, self._route_names, routes.get(row["route_id"], "")
+            )
+            trip_headsign[trip] = intern(
+                headsign_index, self._headsigns, row.get("trip_headsign", "")
+            )
+            trip_service[trip] = intern(service_index, self._services, row["service_id"])
+
+        # Group per stop and service, sorted by arrival
+        grouped = {}
+        for stop_id, arrival, trip, stop_headsign in stop_times:
+            if self._trip_ids[trip] is None:
+                continue
+            # A stop-specific headsign overrides the trip's one
+            headsign = (
+                intern(headsign_index, self._headsigns, stop_headsign)
+                if stop_headsign
+                else trip_headsign[trip]
+            )
+            grouped.setdefault((stop_id, trip_service[trip]), []).append(
+                (arrival, trip, headsign)
+            )
+            self._stop_routes.setdefault(stop_id, {}).setdefault(
+                self._route_names[self._trip_route[trip]], set()
+            ).add(self._headsigns[headsign])
+
+        for (stop_id, service), rows in grouped.items():
+            rows.sort()
+            self._index.setdefault(stop_id, {})[service] = (
+                array("i", [row[0] for row in rows]),
+                array("I", [row[1] for row in rows]),
+                array("I", [row[2] for row in rows]),
+            )
+
+        for row in _read_csv(feed, "calendar.txt"):
+            service = service_index.get(row["service_id"])
+            if service is None:
+                continue
+            self._calendar[service] = (
+                _parse_gtfs_date(row["start_date"]),
+                _parse_gtfs_date(row["end_date"]),
+                tuple(row.get(day) == "1" for day in WEEKDAYS),
+            )
+
+        for row in _read_csv(feed, "calendar_dates.txt"):
+            service = service_index.get(row["service_id"])
+            if service is None:
+                continue
+            self._calendar_dates.setdefault(_parse_gtfs_date(row["date"]), {})[
+                service
+            ] = row.get("exception_type") == "1"
+
+    def has_stop(self, gtfs_id):
+        """Return True if the stop is in the index."""
+        return self._stop_id(gtfs_id) in self._index
+
+    def _stop_id(self, gtfs_id):
+        """Strip the feed prefix from a Digitransit GTFS id."""
+        prefix = f"{self.feed_id}:"
+        if gtfs_id.upper().startswith(prefix):
+            return gtfs_id[len(prefix):]
+        return gtfs_id
+
+    def _active_services(self, service_date):
+        """Return the service indices running on a date."""
+        active = set()
+        weekday = service_date.weekday()
+        for service, (start, end, days) in self._calendar.items():
+            if start <= service_date <= end and days[weekday]:
+                active.add(service)
+        for service, added in self._calendar_dates.get(service_date, {}).items():
+            if added:
+                active.add(service)
+            else:
+                active.discard(service)
+        return active
+
+    def _service_day(self, service_date):
+        """Return the epoch GTFS times of a service date are relative to.
+
+        GTFS defines it as noon minus 12 hours, which differs from midnight on
+        daylight saving transition days.
+        """
+        noon = datetime.combine(service_date, dt_time(12), self.timezone)
+        return int(noon.timestamp()) - SECS_IN_DAY // 2
+
+    def stoptimes(self, gtfs_id, now, limit=LIMIT, time_range=SECS_IN_DAY):
+        """Return the scheduled stoptimes of a stop after `now`.
+
+        Rows use the same fields as Digitransit's `Stoptime`, ordered by
+        arrival and covering at most `time_range` seconds.
+        """
+        services = self._index.get(self._stop_id(gtfs_id))
+        if services is None:
+            return []
+
+        today = datetime.fromtimestamp(now, self.timezone).date()
+        candidates = []
+
+        # Yesterday's service covers trips running past midnight
+        for offset in (-1, 0, 1):
+            service_date = today + timedelta(days=offset)
+            service_day = self._service_day(service_date)
+            start = now - service_day
+            end = start + time_range
+
+            for service in self._active_services(service_date):
+                rows = services.get(service)
+                if rows is None:
+                    continue
+                arrivals, trips, headsigns = rows
+                position = bisect_left(arrivals, start)
+                for arrival, trip, headsign in zip(
+                    arrivals[position : position + limit],
+                    trips[position : position + limit],
+                    headsigns[position : position + limit],
+                ):
+                    if arrival >= end:
+                        break
+                    candidates.append(
+                        (service_day + arrival, service_day, arrival, trip, headsign)
+                    )
+
+        candidates.sort()
+        return [
+            self._stoptime(service_day, arrival, trip, headsign)
+            for _, service_day, arrival, trip, headsign in candidates[:limit]
+        ]
+
+    def _stoptime(self, service_day, arrival, trip, headsign):
+        """Return a Digitransit-shaped scheduled stoptime."""
+        return {
+            "scheduledArrival": arrival,
+            "realtimeArrival": arrival,
+            "arrivalDelay": 0,
+            "realtime": False,
+            "realtimeState": "SCHEDULED",
+            "serviceDay": service_day,
+            "headsign": self._headsigns[headsign],
+            "trip": {
+                "gtfsId": f"{self.feed_id}:{self._trip_ids[trip]}",
+                "route": {"shortName": self._route_names[self._trip_route[trip]]},
+            },
+        }
+
+    def stop_payload(self, gtfs_id, now, limit=LIMIT):
+        """Return a payload shaped like Digitransit's `stop` selection."""
+        stop_id = self._stop_id(gtfs_id)
+        if stop_id not in self._index:
+            return None
+
+        stoptimes = self.stoptimes(gtfs_id, now, limit)
+        routes = self._stop_routes.get(stop_id, {})
+
+        info = self.stops.get(stop_id, {})
+        return {
+            "name": info.get("name", ""),
+            "code": info.get("code", ""),
+            "gtfsId": f"{self.feed_id}:{stop_id}",
+            "routes": [
+                {
+                    "shortName": name,
+                    "patterns": [{"headsign": headsign} for headsign in sorted(headsigns)],
+                }
+                for name, headsigns in sorted(routes.items())
+            ],
+            "stoptimesWithoutPatterns": stoptimes,
+        }
+
+
+def overlay_realtime(schedule, realtime, now):
+    """Apply realtime stoptimes on top of a scheduled stop payload.
+
+    Rows of `realtime` replace the scheduled rows of the same trip; realtime
+    trips missing from the schedule (e.g. added trips) are inserted. Rows that
+    already departed are dropped.
+    """
+    if schedule is None:
+        return realtime
+    if not realtime:
+        return schedule
+
+    updates = {
+        _trip_key(row): row for row in realtime.get("stoptimesWithoutPatterns") or []
+    }
+    rows = []
+    for row in schedule.get("stoptimesWithoutPatterns") or []:
+        rows.append(updates.pop(_trip_key(row), row))
+    rows.extend(updates.values())
+
+    rows = [row for row in rows if _arrival_epoch(row) >= now]
+    rows.sort(key=_arrival_epoch)
+    return {**schedule, "stoptimesWithoutPatterns": rows}
+
+
+def _trip_key(stoptime):
+    """Return a key identifying the trip of a stoptime on its service day."""
+    trip = stoptime.get("trip") or {}
+    return trip.get("gtfsId"), stoptime.get("serviceDay")
+
+
+def _arrival_epoch(stoptime):
+    """Return the arrival of a stoptime as seconds since the epoch."""
+    arrival = stoptime.get("realtimeArrival")
+    if arrival is None:
+        arrival = stoptime.get("scheduledArrival", 0)
+    return stoptime.get("serviceDay", 0) + arrival
+
+
+class HSLHRTTimetableEngine:
+    """Keep a GTFSTimetable of the stops in use, rebuilt in the executor.
+
+    Stops are indexed on demand: the first request for an unknown stop
+    schedules a rebuild covering all requested stops, and until it completes
+    the caller falls back to Digitransit.
+    """
+
+    def __init__(self, hass, path):
+        """Initialize."""
+        self._hass = hass
+        self.path = path
+        self._wanted = set()
+        self._timetable = None
+        self._build_task = None
+
+    def stop_payload(self, gtfs_id, now):
+        """Return the scheduled payload of a stop, or None if not indexed yet."""
+        gtfs_id = gtfs_id.upper()
+        if gtfs_id not in self._wanted:
+            self._wanted.add(gtfs_id)
+            self._schedule_build()
+
+        if self._timetable is None or not self._timetable.has_stop(gtfs_id):
+            return None
+        return self._timetable.stop_payload(gtfs_id, now)
+
+    def _schedule_build(self):
+        """Rebuild the index unless a build is already running."""
+        if self._build_task is None or self._build_task.done():
+            self._build_task = self._hass.async_create_task(self._async_build())
+
+    async def _async_build(self):
+        """Build the index for every wanted stop."""
+        while True:
+            stops = frozenset(self._wanted)
+            try:
+                self._timetable = await self._hass.async_add_executor_job(
+                    GTFSTimetable.from_zip, self.path, stops
+                )
+            except (OSError, KeyError, ValueError, zipfile.BadZipFile) as error:
+                _LOGGER.error("Loading GTFS feed %s failed: %s", self.path, error)
+                return
+
+            # Stops requested while building need another pass
+            if self._wanted <= stops:
+                return
@@ -1,72 +1,154 @@
 """Helper functions for HSL HRT integration."""
 
+import asyncio
 import logging
-from . import graph_client
+import time
+
+from . import (
+    async_get_governor,
+    async_get_metadata_cache,
+    async_get_stop_directory,
+)
 from .const import (
+    DOMAIN,
+    LOOKUP_CACHE,
+    LOOKUP_TTL,
     STOP_ID_QUERY,
-    STOP_ID_BY_GTFS_QUERY,
 )
 
 _LOGGER = logging.getLogger(__name__)
 
 
-async def _set_headers(apikey: str):
-    """Set Digitransit API headers."""
-    graph_client.headers["digitransit-subscription-key"] = apikey
-    graph_client.headers["Ocp-Apim-Subscription-Key"] = apikey
-    graph_client.headers["Accept"] = "application/json"
+# ---------------------------------------------------------
+# SHARED LOOKUP CACHE
+# ---------------------------------------------------------
+
+async def _async_lookup(hass, key, factory):
+    """
+    Run factory() once per key and LOOKUP_TTL.
+    Concurrent callers, e.g. parallel config flows, await the same in-flight
+    request and later callers reuse its result. Failed lookups are not cached.
+    """
+    cache = hass.data.setdefault(DOMAIN, {}).setdefault(LOOKUP_CACHE, {})
+    now = time.monotonic()
+
+    for expired in [k for k, (expires, _) in cache.items() if expires < now]:
+        cache.pop(expired)
+
+    entry = cache.get(key)
+    if entry is None:
+        future = asyncio.ensure_future(factory())
+        entry = cache[key] = (now + LOOKUP_TTL.total_seconds(), future)
+
+        def _forget_failure(done):
+            if (done.cancelled() or done.exception()) and cache.get(key) is entry:
+                cache.pop(key)
+
+        future.add_done_callback(_forget_failure)
+
+    # Shield so that an aborted flow does not cancel the shared request
+    return await asyncio.shield(entry[1])
 
 
 # ---------------------------------------------------------
 # STOP LOOKUP
 # ---------------------------------------------------------
 
-async def lookup_stops(apikey: str, name_query: str):
+async def lookup_stops(hass, apikey: str, name_query: str):
     """
-    Return a list of stops matching a partial name.
+    Return a list of stops matching a partial name or code.
     Output format:
     [
         {"name": "...", "code": "...", "gtfsId": "..."},
         ...
     ]
+    Searched in the local stop index, so "toolontori" finds "Töölöntori"
+    without a request. Falls back to a Digitransit name search if the stop
+    list cannot be loaded.
     """
-    await _set_headers(apikey)
+    try:
+        directory = async_get_stop_directory(hass)
+        return await directory.async_search(apikey, name_query)
+    except Exception as e:
+        _LOGGER.warning("Stop index unavailable, searching online: %s", e)
 
-    stops = []
+    try:
+        stops = await _async_lookup(
+            hass,
+            ("stops", name_query),
+            lambda: _search_stops(hass, apikey, name_query),
+        )
+    except Exception as e:
+        _LOGGER.error("Stop lookup failed for '%s': %s", name_query, e)
+        return []
+
+    return [
+        {
+            "name": s.get("name"),
+            "code": s.get("code"),
+            "gtfsId": s.get("gtfsId"),
+        }
+        for s in stops
+    ]
+
+
+async def _search_stops(hass, apikey: str, name_query: str):
+    """Search stops by name, raising if every attempt failed."""
+    governor = async_get_governor(hass)
+    attempts = (name_query, name_query.upper(), name_query.lower())
+    error = None
 
     # Try multiple case variations for better matching
-    for attempt in (name_query, name_query.upper(), name_query.lower()):
+    for attempt in dict.fromkeys(attempts):
         variables = {"id": attempt}
 
-        try:          
-            data = await graph_client.execute_async(
-                query=STOP_ID_QUERY,
-                variables=variables
-            )            
+        try:
+            data = await governor.async_execute(apikey, STOP_ID_QUERY, variables)
         except Exception as e:
-            _LOGGER.error("Stop lookup failed for '%s': %s", attempt, e)
+            _LOGGER.debug("Stop lookup failed for '%s': %s", attempt, e)
+            error = e
             continue
 
+        error = None
         result = data.get("data", {}).get("stops", [])
         if result:
-            stops = result
-            break
+            return result
 
-    return [
-        {
-            "name": s.get("name"),
-            "code": s.get("code"),
-            "gtfsId": s.get("gtfsId"),
-        }
-        for s in stops
-    ]
+    if error is not None:
+        raise error
+    return []
+
+
+async def lookup_stop(hass, apikey: str, gtfs_id: str):
+    """
+    Return a stop by GTFS id, or None if it does not exist.
+    Output format:
+    {"name": "...", "code": "...", "gtfsId": "..."}
+    Resolved through the stop metadata cache, so picking a route afterwards
+    does not cost another request.
+    """
+    try:
+        cache = await async_get_metadata_cache(hass)
+        stop = await cache.async_get(apikey, gtfs_id)
+    except Exception as e:
+        _LOGGER.error("Stop lookup failed for %s: %s", gtfs_id, e)
+        return None
+
+    if stop is None:
+        return None
+
+    return {
+        "name": stop.get("name"),
+        "code": stop.get("code"),
+        "gtfsId": stop.get("gtfsId"),
+    }
 
 
 # ---------------------------------------------------------
 # ROUTE LOOKUP
 # ---------------------------------------------------------
 
-async def lookup_routes(apikey: str, gtfs_id: str):
+async def lookup_routes(hass, apikey: str, gtfs_id: str):
     """
     Return all routes serving a stop.
     Output format:
@@ -74,25 +156,22 @@ async def lookup_routes(apikey: str, gtfs_id: str):
         {"shortName": "550", "patterns": [...]},
         ...
     ]
+    Reads through the persistent stop metadata cache, which also primes it
+    for the entry being configured.
     """
-    await _set_headers(apikey)
-
-    variables = {"ids": [gtfs_id]}
-
     try:
-        data = await graph_client.execute_async(
-            query=STOP_ID_BY_GTFS_QUERY,
-            variables=variables
-        )
+        cache = await async_get_metadata_cache(hass)
+        stop = await cache.async_get(apikey, gtfs_id)
     except Exception as e:
         _LOGGER.error("Route lookup failed for %s: %s", gtfs_id, e)
         return []
 
-    stops = data.get("data", {}).get("stops", [])
-    if not stops:
-        return []
+    return _routes_of(stop)
+
 
-    routes = stops[0].get("routes", [])
+def _routes_of(stop):
+    """Return the routes of a stop in lookup_routes format."""
+    routes = (stop or {}).get("routes") or []
     return [
         {
             "shortName": r.get("shortName"),
@@ -107,7 +186,7 @@ async def lookup_routes(apikey: str, gtfs_id: str):
 # DESTINATION LOOKUP
 # ---------------------------------------------------------
 
-async def lookup_destinations(apikey: str, gtfs_id: str, route_short_name: str):
+async def lookup_destinations(hass, apikey: str, gtfs_id: str, route_short_name: str):
     """
     Return all destination headsigns for a route at a stop.
     Output format:
@@ -116,7 +195,7 @@ async def lookup_destinations(apikey: str, gtfs_id: str, route_short_name: str):
     if route_short_name.upper() == "ALL":
         return ["ALL"]
 
-    routes = await lookup_routes(apikey, gtfs_id)
+    routes = await lookup_routes(hass, apikey, gtfs_id)
 
     dests = set()
     for r in routes:
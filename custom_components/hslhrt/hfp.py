@@ -0,0 +1,274 @@
+"""Push updates from HSL's high-frequency positioning (HFP) MQTT feed.
+
+Vehicles publish their position and schedule offset about once a second on
+topics of the form
+
+    /hfp/v2/journey/ongoing/<event>/<mode>/<operator>/<vehicle>/<route>/
+    <direction>/<headsign>/<start>/<next stop>/<geohash level>/<geohash>/<sid>
+
+Only the route and direction pairs a stop needs are subscribed to, so the
+broker drops everything else. Position events (`vp`) carry the trip's delay,
+which is applied to the stop's cached departures; departure events (`dep`)
+at the stop itself remove the trip.
+"""
+
+from datetime import datetime
+import json
+import uuid
+from urllib.parse import urlparse
+from zoneinfo import ZoneInfo
+
+try:
+    import paho.mqtt.client as mqtt
+except ImportError:
+    # Push updates are optional, entries keep polling without paho
+    mqtt = None
+
+from homeassistant.const import EVENT_HOMEASSISTANT_STOP
+from homeassistant.core import callback
+
+from .const import (
+    _LOGGER,
+    DOMAIN,
+    HFP_CLIENTS,
+)
+
+HFP_TOPIC_PREFIX = "/hfp/v2/journey/ongoing"
+HFP_EVENT_POSITION = "vp"
+HFP_EVENT_DEPARTURE = "dep"
+HFP_TIMEZONE = ZoneInfo("Europe/Helsinki")
+
+# Index of the event type in a topic split on "/"
+_TOPIC_EVENT = 5
+
+
+def _local_id(gtfs_id):
+    """Strip the feed prefix from a GTFS id, HFP topics use bare ids."""
+    return (gtfs_id or "").partition(":")[2] or gtfs_id
+
+
+def topic_filters(gtfs_id, routes):
+    """Return the topic filters for a stop and its (route id, direction) pairs.
+
+    `routes` holds GTFS route ids and GTFS direction ids (0/1), HFP numbers
+    directions 1/2.
+    """
+    stop = _local_id(gtfs_id)
+    filters = set()
+    for route_id, direction in routes:
+        route = _local_id(route_id)
+        direction = "+" if direction is None else str(direction + 1)
+        filters.add(
+            f"{HFP_TOPIC_PREFIX}/{HFP_EVENT_POSITION}/+/+/+/{route}/{direction}/#"
+        )
+        filters.add(
+            f"{HFP_TOPIC_PREFIX}/{HFP_EVENT_DEPARTURE}/+/+/+/{route}/{direction}"
+            f"/+/+/{stop}/#"
+        )
+    return filters
+
+
+def stoptime_trip_key(stoptime):
+    """Return the HFP key (route, direction, operating day, start) of a stoptime.
+
+    Returns None when the payload lacks the fields needed to match it.
+    """
+    trip = stoptime.get("trip") or {}
+    route_id = (trip.get("route") or {}).get("gtfsId")
+    direction = trip.get("directionId")
+    start = (trip.get("departureStoptime") or {}).get("scheduledDeparture")
+    service_day = stoptime.get("serviceDay")
+    if None in (route_id, direction, start, service_day):
+        return None
+
+    # serviceDay is noon minus 12h, so noon always falls on the service date
+    oday = datetime.fromtimestamp(service_day + 12 * 3600, HFP_TIMEZONE)
+    hours, minutes = divmod(start // 60, 60)
+
+    return (
+        _local_id(route_id),
+        str(direction + 1),
+        oday.date().isoformat(),
+        f"{hours % 24:02}:{minutes:02}",
+    )
+
+
+def event_trip_key(event):
+    """Return the HFP key of an event payload."""
+    return (
+        str(event.get("route")),
+        str(event.get("dir")),
+        event.get("oday"),
+        event.get("start"),
+    )
+
+
+def stop_number(gtfs_id):
+    """Return the stop id used in HFP payloads."""
+    return _local_id(gtfs_id)
+
+
+class HSLHRTHFPClient:
+    """Share one MQTT connection to an HFP broker between all stop hubs.
+
+    Subscriptions are reference counted per topic filter. The connection is
+    opened with the first subscription and closed after the last one goes
+    away. paho runs its network loop in its own thread; messages are handed
+    over to the event loop before any listener sees them.
+    """
+
+    def __init__(self, hass, url):
+        """Initialize."""
+        parsed = urlparse(url)
+        self._hass = hass
+        self.url = url
+        self._tls = parsed.scheme == "mqtts"
+        self._host = parsed.hostname
+        self._port = parsed.port or (8883 if self._tls else 1883)
+        self._listeners = {}
+        self._client = None
+        self._connecting = None
+        self._matches = None
+
+    async def async_subscribe(self, topic, listener):
+        """Subscribe a listener(event_type, event) to a topic filter.
+
+        Returns a callable that removes the subscription.
+        """
+        listeners = self._listeners.setdefault(topic, [])
+        listeners.append(listener)
+
+        if self._client is None:
+            await self._async_connect()
+        elif len(listeners) == 1:
+            self._client.subscribe(topic)
+
+        @callback
+        def async_unsubscribe():
+            listeners.remove(listener)
+            if listeners:
+                return
+            self._listeners.pop(topic, None)
+            if self._client is not None:
+                self._client.unsubscribe(topic)
+            if not self._listeners:
+                self._hass.async_create_task(self.async_disconnect())
+
+        return async_unsubscribe
+
+    async def _async_connect(self):
+        """Start the client, subscriptions are made once it is connected."""
+        if self._connecting is None:
+            self._connecting = self._hass.async_add_executor_job(self._connect)
+        try:
+            await self._connecting
+        finally:
+            self._connecting = None
+
+    def _connect(self):
+        """Create the paho client and start its network loop (blocking)."""
+        client_id = f"{DOMAIN}-{uuid.uuid4().hex[:12]}"
+        if hasattr(mqtt, "CallbackAPIVersion"):
+            client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION1, client_id)
+        else:
+            client = mqtt.Client(client_id)
+
+        self._matches = mqtt.topic_matches_sub
+        if self._tls:
+            client.tls_set()
+        client.on_connect = self._on_connect
+        client.on_message = self._on_message
+        client.reconnect_delay_set(min_delay=1, max_delay=120)
+        client.connect_async(self._host, self._port, keepalive=60)
+        client.loop_start()
+
+        self._client = client
+        _LOGGER.debug("Connecting to HFP broker %s", self.url)
+
+    async def async_disconnect(self):
+        """Stop the client if nobody subscribes any more."""
+        if not self._listeners:
+            await self.async_stop()
+
+    async def async_stop(self, *_):
+        """Stop the client."""
+        client = self._client
+        if client is None:
+            return
+
+        self._client = None
+        await self._hass.async_add_executor_job(self._disconnect, client)
+
+    @staticmethod
+    def _disconnect(client):
+        """Disconnect and join paho's network thread (blocking)."""
+        client.disconnect()
+        client.loop_stop()
+
+    def _on_connect(self, _client, _userdata, _flags, result, *_):
+        """Resubscribe after every (re)connect, called from paho's thread."""
+        if result != 0:
+            _LOGGER.warning("HFP broker %s refused connection: %s", self.url, result)
+            return
+
+        _LOGGER.debug("Connected to HFP broker %s", self.url)
+        self._hass.loop.call_soon_threadsafe(self._async_subscribe_all)
+
+    @callback
+    def _async_subscribe_all(self):
+        """Subscribe all topic filters in use."""
+        if self._client is not None and self._listeners:
+            self._client.subscribe([(topic, 0) for topic in self._listeners])
+
+    def _on_message(self, _client, _userdata, message):
+        """Hand a message over to the event loop, called from paho's thread."""
+        self._hass.loop.call_soon_threadsafe(
+            self._async_dispatch, message.topic, message.payload
+        )
+
+    @callback
+    def _async_dispatch(self, topic, payload):
+        """Decode a message once and pass it to the matching listeners."""
+        listeners = [
+            listener
+            for topic_filter, listeners in self._listeners.items()
+            if self._matches(topic_filter, topic)
+            for listener in listeners
+        ]
+        if not listeners:
+            return
+
+        try:
+            event_type = topic.split("/")[_TOPIC_EVENT]
+            # Payloads hold a single key named after the event in upper case
+            event = next(iter(json.loads(payload).values()))
+        except (IndexError, StopIteration, AttributeError, ValueError) as error:
+            _LOGGER.debug("Ignoring malformed HFP message on %s: %s", topic, error)
+            return
+
+        for listener in listeners:
+            listener(event_type, event)
+
+
+def async_get_hfp_client(hass, url):
+    """Return the HFP client of a broker URL, if push updates are enabled.
+
+    Returns None, so the entry keeps polling, when paho-mqtt is missing.
+    """
+    if not url:
+        return None
+
+    clients = hass.data[DOMAIN].setdefault(HFP_CLIENTS, {})
+    if url in clients:
+        return clients[url]
+
+    if mqtt is None:
+        _LOGGER.warning(
+            "Push updates from %s need the paho-mqtt package, polling instead", url
+        )
+        clients[url] = None
+        return None
+
+    client = clients[url] = HSLHRTHFPClient(hass, url)
+    hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, client.async_stop)
+    return client
@@ -0,0 +1,486 @@
+"""Shared per-stop data hub for HSL HRT config entries."""
+
+import asyncio
+import time
+
+from homeassistant.core import callback
+
+from .const import (
+    _LOGGER,
+    ALL,
+    DOMAIN,
+    HUBS,
+    HUB_MAX_AGE,
+    STOPTIME_FIELDS,
+    TRIP_MATCH_FIELDS,
+    HFP_FIELDS,
+    HFP_RECONCILE_INTERVAL,
+    GTFS_REALTIME_HORIZON,
+    GTFS_REALTIME_TRIPS,
+    TIMETABLE_REFRESH,
+)
+from .gtfs import overlay_realtime
+from .hfp import (
+    HFP_EVENT_DEPARTURE,
+    event_trip_key,
+    stop_number,
+    stoptime_trip_key,
+    topic_filters,
+)
+from .query import merge_horizon_stoptimes
+from .transport import is_transient
+
+
+class HSLHRTStopHub:
+    """Fetch one GTFS stop once per tick and share the payload between entries.
+
+    Every config entry watching the same stop attaches its coordinator to the
+    hub. The first coordinator to tick performs the request, concurrent callers
+    await the same in-flight fetch and later callers within HUB_MAX_AGE reuse
+    the cached payload. Each coordinator still applies its own route and
+    destination filter on the shared result.
+
+    The per-minute payload only carries stoptimes. Stop name, code and the
+    routes tree come from the persistent metadata cache and are merged in, so
+    consumers see the same shape as a full stop query.
+
+    When every attached entry opted into server-side filtering and watches a
+    specific route, only the stoptimes of those routes' patterns are fetched.
+    Pattern codes are taken from the cached routes tree.
+
+    When every attached entry opted into incremental updates, the rest of the
+    day is fetched once per TIMETABLE_REFRESH and each tick only re-queries a
+    short realtime horizon that is merged into the cached timetable.
+
+    When an entry has an offline GTFS timetable, the schedule is computed
+    locally and only the next few trips are asked for realtime deltas.
+
+    When an entry enabled push updates, the hub follows the HFP feed of the
+    routes its entries show and applies vehicle delays to the cached payload
+    as they arrive. Digitransit is then only polled once per
+    HFP_RECONCILE_INTERVAL to reconcile.
+    """
+
+    def __init__(self, hass, gtfs_id, fetch, metadata):
+        """Initialize."""
+        self._hass = hass
+        self.gtfs_id = gtfs_id
+        self._fetch = fetch
+        self._metadata = metadata
+        self._coordinators = set()
+        self._data = None
+        self._fetched_at = 0.0
+        self._inflight = None
+        self._patterns = {}
+        self._timetable_at = None
+        self._stop_number = stop_number(gtfs_id)
+        self._hfp_trips = {}
+        self._hfp_unsubs = {}
+        self._response_bytes = 0
+        self._fetched_for = None
+
+    @property
+    def refcount(self):
+        """Return the number of coordinators attached to this hub."""
+        return len(self._coordinators)
+
+    def attach(self, coordinator):
+        """Register a coordinator as a consumer of this stop."""
+        self._coordinators.add(coordinator)
+
+    def detach(self, coordinator):
+        """Unregister a coordinator."""
+        self._coordinators.discard(coordinator)
+        if not self._coordinators:
+            self._async_unsubscribe_hfp()
+
+    def pop_response_bytes(self, requester):
+        """Return the response size of the request made for `requester`, once.
+
+        Callers served from the cached payload or by another caller's
+        request made no request of their own and get 0.
+        """
+        if requester is None or requester is not self._fetched_for:
+            return 0
+        self._fetched_for = None
+        return self._response_bytes
+
+    def invalidate(self):
+        """Make the next caller fetch instead of reusing the cached payload."""
+        self._fetched_at = 0.0
+
+    async def async_get_data(self, apikey, requester=None):
+        """Return the raw stop payload, fetching it only if the cache is stale."""
+        max_age = HFP_RECONCILE_INTERVAL if self._hfp_unsubs else HUB_MAX_AGE
+        if (
+            self._data is not None
+            and time.monotonic() - self._fetched_at < max_age.total_seconds()
+        ):
+            if self._hfp_unsubs:
+                self._drop_departed(int(time.time()))
+            return self._data
+
+        if self._inflight is None:
+            schedule = self._gtfs_schedule()
+            if schedule is not None:
+                fetch = self._async_fetch_realtime(apikey, requester, schedule)
+            else:
+                fetch = self._async_fetch(apikey, requester, self._query_shape())
+            self._inflight = asyncio.ensure_future(fetch)
+
+        # Shield so that a caller timing out does not cancel the shared request
+        return await asyncio.shield(self._inflight)
+
+    def _gtfs_schedule(self):
+        """Return the offline scheduled payload of the stop, if available."""
+        engine = next(
+            (c.gtfs_engine for c in self._coordinators if c.gtfs_engine), None
+        )
+        if engine is None:
+            return None
+        return engine.stop_payload(self.gtfs_id, int(time.time()))
+
+    def _stoptime_fields(self):
+        """Return the stoptime fields the attached entries consume."""
+        fields = STOPTIME_FIELDS
+        if any(c.incremental or c.gtfs_engine for c in self._coordinators):
+            fields |= TRIP_MATCH_FIELDS
+        if any(c.hfp for c in self._coordinators):
+            fields |= HFP_FIELDS
+        return fields
+
+    def _query_shape(self):
+        """Return the keyword arguments describing what to fetch this tick."""
+        return self._pattern_shape() or self._horizon_shape() or {}
+
+    def _pattern_shape(self):
+        """Return the pattern codes and departure cap to fetch, if applicable."""
+        patterns = set()
+        departures = 0
+
+        if not self._patterns:
+            self._update_patterns(self._metadata.get_cached(self.gtfs_id))
+
+        for coordinator in self._coordinators:
+            routes = coordinator.departure_filter.groups or (
+                (coordinator.route or "").casefold(),
+            )
+            if not coordinator.server_filter:
+                return None
+
+            for route in routes:
+                if route in ("", ALL):
+                    return None
+
+                codes = self._patterns.get(route)
+                if not codes:
+                    # Unknown or vanished route, fall back to a full fetch
+                    return None
+
+                patterns.update(codes)
+            departures = max(departures, coordinator.max_departures)
+
+        if not patterns:
+            return None
+
+        return {"patterns": sorted(patterns), "departures": departures}
+
+    def _horizon_shape(self):
+        """Return the realtime horizon to fetch, if the timetable is fresh."""
+        if not self._coordinators or self._timetable_at is None:
+            return None
+        if time.monotonic() - self._timetable_at >= TIMETABLE_REFRESH.total_seconds():
+            return None
+        if not all(coordinator.incremental for coordinator in self._coordinators):
+            return None
+
+        minutes = max(coordinator.horizon for coordinator in self._coordinators)
+        return {"horizon": int(minutes * 60)}
+
+    async def _async_fetch(self, apikey, requester, shape):
+        """Perform the request and wake up sibling coordinators."""
+        stats = {}
+        try:
+            data = await self._fetch(
+                apikey,
+                self.gtfs_id,
+                fields=self._stoptime_fields(),
+                stats=stats,
+                **shape,
+            )
+            data = await self._async_add_metadata(apikey, data)
+        finally:
+            self._inflight = None
+        self._response_bytes = stats.get("bytes", 0)
+        self._fetched_for = requester
+
+        if "horizon" in shape:
+            data = self._merge_horizon(data, shape["horizon"])
+        elif "patterns" in shape:
+            self._timetable_at = None
+        else:
+            self._timetable_at = time.monotonic()
+
+        return self._publish(data, requester)
+
+    async def _async_fetch_realtime(self, apikey, requester, schedule):
+        """Overlay realtime deltas of the next few trips on the schedule.
+
+        If Digitransit is unreachable, slow or failing the schedule alone is
+        served. Rejected requests, e.g. a revoked API key, are raised like
+        on the polling path.
+        """
+        stats = {}
+        try:
+            data = await self._fetch(
+                apikey,
+                self.gtfs_id,
+                departures=GTFS_REALTIME_TRIPS,
+                horizon=int(GTFS_REALTIME_HORIZON.total_seconds()),
+                realtime=True,
+                fields=self._stoptime_fields(),
+                stats=stats,
+            )
+            realtime = ((data or {}).get("data") or {}).get("stop")
+        except Exception as error:  # pylint: disable=broad-except
+            if not is_transient(error):
+                raise
+            _LOGGER.debug("Realtime update of %s failed: %s", self.gtfs_id, error)
+            realtime = None
+        finally:
+            self._inflight = None
+        self._response_bytes = stats.get("bytes", 0)
+        self._fetched_for = requester
+
+        stop_data = overlay_realtime(schedule, realtime, int(time.time()))
+        return self._publish({"data": {"stop": stop_data}}, requester)
+
+    def _publish(self, data, requester):
+        """Cache a payload and wake up sibling coordinators."""
+        self._data = data
+        self._fetched_at = time.monotonic()
+        self._follow_hfp(data)
+
+        # Pull siblings onto the same tick so the next round is fetched once
+        for coordinator in self._coordinators:
+            if coordinator is not requester:
+                self._hass.async_create_task(coordinator.async_request_refresh())
+
+        return data
+
+    def _follow_hfp(self, data):
+        """Index the payload's trips and follow their routes on the HFP feed."""
+        client = next((c.hfp for c in self._coordinators if c.hfp), None)
+        self._hfp_trips = {}
+        if client is None:
+            self._async_unsubscribe_hfp()
+            return
+
+        # None follows every route of the stop
+        wanted = set()
+        for coordinator in self._coordinators:
+            departure_filter = coordinator.departure_filter
+            if departure_filter.groups:
+                wanted.update(departure_filter.groups)
+            elif departure_filter.route is None:
+                wanted = None
+                break
+            else:
+                wanted.add(departure_filter.route)
+
+        rows = self._stoptimes(data)
+        self._hfp_trips = self._index_trips(rows)
+
+        routes = set()
+        for row in rows:
+            if stoptime_trip_key(row) is None:
+                continue
+
+            trip = row["trip"]
+            short_name = (trip["route"].get("shortName") or "").casefold()
+            if wanted is None or short_name in wanted:
+                routes.add((trip["route"]["gtfsId"], trip["directionId"]))
+
+        self._hass.async_create_task(
+            self._async_subscribe_hfp(client, topic_filters(self.gtfs_id, routes))
+        )
+
+    async def _async_subscribe_hfp(self, client, topics):
+        """Change the HFP subscriptions to the given topic filters."""
+        for topic in set(self._hfp_unsubs) - topics:
+            self._hfp_unsubs.pop(topic)()
+
+        for topic in topics - set(self._hfp_unsubs):
+            unsubscribe = await client.async_subscribe(topic, self._async_handle_hfp)
+            if topic in self._hfp_unsubs or not self._coordinators:
+                # Subscribed concurrently, or the hub was released meanwhile
+                unsubscribe()
+                continue
+            self._hfp_unsubs[topic] = unsubscribe
+
+    @callback
+    def _async_unsubscribe_hfp(self):
+        """Drop all HFP subscriptions."""
+        while self._hfp_unsubs:
+            self._hfp_unsubs.popitem()[1]()
+
+    @staticmethod
+    def _index_trips(rows):
+        """Map the trip keys of stoptimes to their positions in `rows`."""
+        trips = {}
+        for position, row in enumerate(rows):
+            key = stoptime_trip_key(row)
+            if key is not None:
+                trips.setdefault(key, []).append(position)
+        return trips
+
+    @callback
+    def _async_handle_hfp(self, event_type, event):
+        """Apply an HFP event to the cached payload."""
+        key = event_trip_key(event)
+        positions = self._hfp_trips.get(key)
+        if not positions:
+            return
+
+        rows = self._stoptimes(self._data)
+        if event_type == HFP_EVENT_DEPARTURE:
+            if str(event.get("stop")) != self._stop_number:
+                return
+            departed = set(positions)
+            self._set_stoptimes(
+                [row for position, row in enumerate(rows) if position not in departed]
+            )
+        else:
+            # dl is the offset from schedule, positive when running early
+            delay = event.get("dl")
+            if delay is None:
+                return
+
+            # Only the trip's own slots are swapped for updated copies. Rows
+            # are never changed in place, as a parse in the executor may be
+            # reading the current ones
+            updated = False
+            for position in positions:
+                row = rows[position]
+                arrival = row.get("scheduledArrival")
+                if arrival is None or row.get("realtimeArrival") == arrival - delay:
+                    continue
+                copy = {
+                    **row,
+                    "realtimeArrival": arrival - delay,
+                    "arrivalDelay": -delay,
+                    "realtime": True,
+                    "realtimeState": "UPDATED",
+                }
+                if row.get("scheduledDeparture") is not None:
+                    copy["realtimeDeparture"] = row["scheduledDeparture"] - delay
+                    copy["departureDelay"] = -delay
+                rows[position] = copy
+                updated = True
+
+            if not updated:
+                return
+
+        # Coordinators debounce these, so a burst of events is parsed once
+        for coordinator in self._coordinators:
+            self._hass.async_create_task(coordinator.async_request_refresh())
+
+    def _drop_departed(self, now):
+        """Remove departed rows between reconciliations."""
+        rows = self._stoptimes(self._data)
+        upcoming = [
+            row
+            for row in rows
+            if row.get("serviceDay", 0)
+            + (
+                row["realtimeArrival"]
+                if row.get("realtimeArrival") is not None
+                else row.get("scheduledArrival", 0)
+            )
+            >= now
+        ]
+        if len(upcoming) != len(rows):
+            self._set_stoptimes(upcoming)
+
+    @staticmethod
+    def _stoptimes(data):
+        """Return the stoptimes of a payload."""
+        stop = ((data or {}).get("data") or {}).get("stop") or {}
+        return stop.get("stoptimesWithoutPatterns") or []
+
+    def _set_stoptimes(self, rows):
+        """Replace the stoptimes of the cached payload."""
+        stop = ((self._data or {}).get("data") or {}).get("stop")
+        if stop is not None:
+            stop["stoptimesWithoutPatterns"] = rows
+        if self._hfp_trips:
+            # Positions shift when rows are dropped
+            self._hfp_trips = self._index_trips(rows)
+
+    def _merge_horizon(self, data, horizon):
+        """Merge a realtime horizon payload into the cached timetable."""
+        timetable = ((self._data or {}).get("data") or {}).get("stop")
+        fresh = ((data or {}).get("data") or {}).get("stop")
+
+        return {
+            "data": {
+                "stop": merge_horizon_stoptimes(
+                    timetable, fresh, int(time.time()), horizon
+                )
+            }
+        }
+
+    async def _async_add_metadata(self, apikey, data):
+        """Merge the cached stop metadata into a stoptimes-only payload."""
+        stop_data = ((data or {}).get("data") or {}).get("stop")
+        if stop_data is None:
+            return data
+
+        metadata = await self._metadata.async_get(apikey, self.gtfs_id)
+        if metadata is None:
+            return data
+
+        self._update_patterns(metadata)
+        return {"data": {"stop": {**metadata, **stop_data}}}
+
+    def _update_patterns(self, metadata):
+        """Remember the pattern codes of each route serving the stop."""
+        routes = (metadata or {}).get("routes")
+        if routes is None:
+            return
+
+        patterns = {}
+        for route in routes:
+            short_name = route.get("shortName")
+            if not short_name:
+                continue
+            patterns.setdefault(short_name.casefold(), []).extend(
+                pattern["code"]
+                for pattern in route.get("patterns") or []
+                if pattern.get("code")
+            )
+        self._patterns = patterns
+
+
+def async_get_stop_hub(hass, gtfs_id, fetch, metadata):
+    """Return the hub for a stop, creating it on first use."""
+    hubs = hass.data[DOMAIN].setdefault(HUBS, {})
+    key = gtfs_id.upper()
+
+    hub = hubs.get(key)
+    if hub is None:
+        _LOGGER.debug("Creating stop hub for %s", key)
+        hub = hubs[key] = HSLHRTStopHub(hass, key, fetch, metadata)
+
+    return hub
+
+
+def async_release_stop_hub(hass, coordinator):
+    """Detach a coordinator and drop its hub once nobody references it."""
+    hubs = hass.data[DOMAIN].get(HUBS, {})
+    hub = coordinator.hub
+
+    hub.detach(coordinator)
+    if hub.refcount == 0 and hubs.get(hub.gtfs_id) is hub:
+        _LOGGER.debug("Releasing stop hub for %s", hub.gtfs_id)
+        hubs.pop(hub.gtfs_id)
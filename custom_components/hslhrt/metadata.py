@@ -0,0 +1,103 @@
+"""Persistent cache of static stop metadata for HSL HRT."""
+
+import asyncio
+import time
+
+from homeassistant.helpers.storage import Store
+from homeassistant.helpers.update_coordinator import UpdateFailed
+
+from .const import (
+    _LOGGER,
+    METADATA_SAVE_DELAY,
+    METADATA_STORAGE_KEY,
+    METADATA_TTL,
+    STOP_ID_BY_GTFS_QUERY,
+    STORAGE_VERSION,
+)
+
+KEY_FETCHED = "fetched"
+KEY_STOP = "stop"
+
+
+class HSLHRTMetadataCache:
+    """Keep stop name, code and routes/patterns tree in `.storage`.
+
+    This data only changes with timetable updates, so it is fetched once per
+    METADATA_TTL and merged into the per-minute departures payload instead of
+    being downloaded with every poll. Stale entries are served immediately and
+    refreshed in the background.
+    """
+
+    def __init__(self, hass, execute):
+        """Initialize."""
+        self._hass = hass
+        self._execute = execute
+        self._store = Store(hass, STORAGE_VERSION, METADATA_STORAGE_KEY)
+        self._stops = {}
+        self._load_task = None
+        self._inflight = {}
+
+    async def async_load(self):
+        """Load the cache from storage once."""
+        if self._load_task is None:
+            self._load_task = asyncio.ensure_future(self._async_load())
+        await self._load_task
+
+    async def _async_load(self):
+        """Read the stored metadata."""
+        self._stops = await self._store.async_load() or {}
+
+    async def async_get(self, apikey, gtfs_id):
+        """Return the metadata of a stop, or None if the stop does not exist."""
+        gtfs_id = gtfs_id.upper()
+        cached = self._stops.get(gtfs_id)
+
+        if cached is None:
+            return await self._async_fetch(apikey, gtfs_id)
+
+        if time.time() - cached[KEY_FETCHED] > METADATA_TTL.total_seconds():
+            if gtfs_id not in self._inflight:
+                self._hass.async_create_task(
+                    self._async_background_refresh(apikey, gtfs_id)
+                )
+
+        return cached[KEY_STOP]
+
+    def get_cached(self, gtfs_id):
+        """Return the cached metadata of a stop without any I/O."""
+        cached = self._stops.get(gtfs_id.upper())
+        return cached[KEY_STOP] if cached else None
+
+    async def _async_background_refresh(self, apikey, gtfs_id):
+        """Refresh a stale entry, keeping the old one if that fails."""
+        try:
+            await self._async_fetch(apikey, gtfs_id)
+        except Exception as error:  # pylint: disable=broad-except
+            _LOGGER.warning("Refreshing metadata of %s failed: %s", gtfs_id, error)
+
+    async def _async_fetch(self, apikey, gtfs_id):
+        """Fetch a stop's metadata, coalescing concurrent requests."""
+        future = self._inflight.get(gtfs_id)
+        if future is None:
+            future = self._inflight[gtfs_id] = asyncio.ensure_future(
+                self._async_request(apikey, gtfs_id)
+            )
+            future.add_done_callback(lambda _: self._inflight.pop(gtfs_id, None))
+
+        return await asyncio.shield(future)
+
+    async def _async_request(self, apikey, gtfs_id):
+        """Request the metadata and persist it."""
+        data = await self._execute(apikey, STOP_ID_BY_GTFS_QUERY, {"ids": [gtfs_id]})
+
+        if data.get("errors") and not data.get("data"):
+            raise UpdateFailed(data["errors"][0].get("message", "Unknown error"))
+
+        stops = (data.get("data") or {}).get("stops") or []
+        stop = next((s for s in stops if s), None)
+        if stop is None:
+            return None
+
+        self._stops[gtfs_id] = {KEY_FETCHED: time.time(), KEY_STOP: stop}
+        self._store.async_delay_save(lambda: self._stops, METADATA_SAVE_DELAY)
+        return stop
@@ -0,0 +1,130 @@
+"""Per-entry fetch and parse metrics for HSL HRT."""
+
+from collections import deque
+
+from homeassistant.core import callback
+
+from .const import (
+    DICT_KEY_ROUTES,
+    METRIC_BUCKETS,
+    METRIC_BYTES,
+    METRIC_DEPARTURES,
+    METRIC_FAILURES,
+    METRIC_HIT_RATIO,
+    METRIC_LATENCY,
+    METRIC_PARSE_TIME,
+    METRICS_HISTORY,
+)
+
+
+class HSLHRTMetrics:
+    """Cost of the last updates of one coordinator.
+
+    `latest` holds the values of the last successful update, and
+    `consecutive_failures` counts the updates that have failed since then.
+    The last METRICS_HISTORY updates are kept for the diagnostics
+    histograms. Latency is how long the update waited for the stop payload,
+    so it is close to zero when a sibling entry already fetched it. Bytes
+    are the stop's share of the decoded batch response that carried it.
+    """
+
+    def __init__(self, size=METRICS_HISTORY):
+        """Initialize."""
+        self.latest = {}
+        self.consecutive_failures = 0
+        self._history = deque(maxlen=size)
+        self._listeners = []
+
+    def record(self, latency, response_bytes, data, parse_time, route_data):
+        """Record a successful update."""
+        stop = ((data or {}).get("data") or {}).get("stop") or {}
+        departures = len(stop.get("stoptimesWithoutPatterns") or ())
+        kept = len((route_data or {}).get(DICT_KEY_ROUTES) or ())
+
+        self.consecutive_failures = 0
+        self.latest = {
+            METRIC_LATENCY: round(latency * 1000, 1),
+            METRIC_BYTES: response_bytes,
+            METRIC_DEPARTURES: departures,
+            METRIC_PARSE_TIME: round(parse_time * 1000, 2),
+            METRIC_HIT_RATIO: round(100 * kept / departures, 1) if departures else None,
+        }
+        self._history.append(self.latest)
+        self._async_update_listeners()
+
+    def record_failure(self):
+        """Record a failed update."""
+        self.consecutive_failures += 1
+        self._async_update_listeners()
+
+    def value(self, metric):
+        """Return the latest value of a metric."""
+        if metric == METRIC_FAILURES:
+            return self.consecutive_failures
+        return self.latest.get(metric)
+
+    @callback
+    def async_add_listener(self, update_callback):
+        """Call update_callback after every update, return a remover."""
+        self._listeners.append(update_callback)
+
+        @callback
+        def remove_listener():
+            self._listeners.remove(update_callback)
+
+        return remove_listener
+
+    @callback
+    def _async_update_listeners(self):
+        """Notify the metric sensors."""
+        for update_callback in list(self._listeners):
+            update_callback()
+
+    def as_dict(self):
+        """Return the latest values and a summary of the kept updates."""
+        summary = {}
+        for metric in (
+            METRIC_LATENCY,
+            METRIC_BYTES,
+            METRIC_DEPARTURES,
+            METRIC_PARSE_TIME,
+            METRIC_HIT_RATIO,
+        ):
+            values = sorted(
+                sample[metric]
+                for sample in self._history
+                if sample.get(metric) is not None
+            )
+            if not values:
+                continue
+            summary[metric] = {
+                "min": values[0],
+                "p50": values[len(values) // 2],
+                "p90": values[min(len(values) - 1, len(values) * 9 // 10)],
+                "max": values[-1],
+            }
+            if metric in METRIC_BUCKETS:
+                summary[metric]["histogram"] = histogram(
+                    values, METRIC_BUCKETS[metric]
+                )
+
+        return {
+            "latest": dict(self.latest),
+            METRIC_FAILURES: self.consecutive_failures,
+            "updates": len(self._history),
+            "summary": summary,
+        }
+
+
+def histogram(values, edges):
+    """Count values per bucket, keyed by the bucket's upper edge."""
+    counts = {f"<={edge}": 0 for edge in edges}
+    counts[f">{edges[-1]}"] = 0
+    for value in values:
+        for edge in edges:
+            if value <= edge:
+                counts[f"<={edge}"] += 1
+                break
+        else:
+            counts[f">{edges[-1]}"] += 1
+    return counts
@@ -0,0 +1,328 @@
+"""Parse Digitransit stop payloads into sensor data for HSL HRT."""
+
+from collections import namedtuple
+import datetime
+
+from .const import (
+    _LOGGER,
+    ALL,
+    ATTR_ARR_TIME,
+    ATTR_ATTRIBUTION,
+    ATTR_DEST,
+    ATTR_ROUTE,
+    ATTR_STALE_SINCE,
+    ATTR_STOP_CODE,
+    ATTR_STOP_GTFS,
+    ATTR_STOP_NAME,
+    ATTRIBUTION,
+    DICT_KEY_ARRIVAL,
+    DICT_KEY_DEST,
+    DICT_KEY_EPOCH,
+    DICT_KEY_GROUPS,
+    DICT_KEY_REALTIME,
+    DICT_KEY_ROUTE,
+    DICT_KEY_ROUTES,
+    DICT_KEY_STALE_SINCE,
+    SECS_IN_DAY,
+    STOP_CODE,
+    STOP_GTFS,
+    STOP_NAME,
+)
+
+# Pre-normalized filter of a config entry. `route` and `dest` are case-folded,
+# `named_only` keeps only departures with a known route and destination.
+# `groups` maps case-folded routes to the sensor groups fed from them.
+DepartureFilter = namedtuple(
+    "DepartureFilter", "route dest named_only groups", defaults=(None,)
+)
+
+NO_FILTER = DepartureFilter(None, None, False)
+
+
+def build_filter(line_from_user=None, dest_from_user=None, groups=None):
+    """Normalize the user's route/destination choice once.
+
+    Given `groups`, a list of (route, headsign or None), only their routes
+    are kept and the departures are also split per group. Otherwise route
+    takes precedence over destination. An empty value or ALL disables
+    filtering, while giving neither keeps only fully identified departures.
+    """
+    if groups:
+        return DepartureFilter(None, None, False, build_group_index(groups))
+
+    if line_from_user is not None:
+        route = line_from_user.casefold()
+        if route in ("", ALL):
+            return NO_FILTER
+        return DepartureFilter(route, None, False)
+
+    if dest_from_user is not None:
+        dest = dest_from_user.casefold()
+        if dest in ("", ALL):
+            return NO_FILTER
+        return DepartureFilter(None, dest, False)
+
+    return DepartureFilter(None, None, True)
+
+
+def build_group_index(groups):
+    """Map case-folded routes to (case-folded headsign or None, position)."""
+    index = {}
+    for position, (route, headsign) in enumerate(groups):
+        index.setdefault(route.casefold(), []).append(
+            (headsign.casefold() if headsign else None, position)
+        )
+    return {route: tuple(targets) for route, targets in index.items()}
+
+
+def format_arrival(arrival):
+    """Return seconds since midnight as H:MM:SS."""
+    ## Arrival time is num of secs from midnight when the trip started.
+    ## If the trip starts on this day and arrival time is next day (e.g late night trips)
+    ## the arrival time shows the number of secs more than 24hrs ending up with a
+    ## 1 day, hh:mm:ss on the displays. This corrects it.
+    if arrival >= SECS_IN_DAY:
+        arrival = arrival - SECS_IN_DAY
+
+    if 0 <= arrival < SECS_IN_DAY:
+        minutes, seconds = divmod(arrival, 60)
+        hours, minutes = divmod(minutes, 60)
+        return f"{hours}:{minutes:02}:{seconds:02}"
+
+    return str(datetime.timedelta(seconds=arrival))
+
+
+def build_route_index(bus_lines):
+    """Map case-folded route short names to their display form."""
+    index = {}
+    for bus in bus_lines or ():
+        line = bus.get("shortName")
+        if line is not None:
+            index[line.casefold()] = line
+    return index
+
+
+def parse_data(data=None, line_from_user=None, dest_from_user=None, departure_filter=None):
+    """Parse a stop payload into the dict consumed by the sensor.
+
+    Every stoptime is visited once: its route is resolved through a prebuilt
+    short name index and rows rejected by the filter are skipped before any
+    output is built. With groups in the filter each kept departure is also
+    added to the list of every group it belongs to, under DICT_KEY_GROUPS.
+    A group with a headsign only matches that exact headsign, ignoring case,
+    so groups of similar headsigns do not overlap. Returns None for an
+    unknown stop.
+    """
+    if departure_filter is None:
+        departure_filter = build_filter(line_from_user, dest_from_user)
+
+    parsed_data = {}
+
+    graph_data = (data or {}).get("data", None)
+    if graph_data is None:
+        return parsed_data
+
+    hsl_stop_data = graph_data.get("stop", None)
+    if hsl_stop_data is None:
+        _LOGGER.error("Invalid GTFS Id")
+        return None
+
+    parsed_data[STOP_NAME] = hsl_stop_data.get("name", "")
+    parsed_data[STOP_CODE] = hsl_stop_data.get("code", "")
+    parsed_data[STOP_GTFS] = hsl_stop_data.get("gtfsId", "")
+
+    route_data = hsl_stop_data.get("stoptimesWithoutPatterns", None)
+    if route_data is None:
+        return parsed_data
+
+    route_index = build_route_index(hsl_stop_data.get("routes", None))
+    route_filter, dest_filter, named_only, groups = departure_filter
+
+    routes = []
+    if groups is not None:
+        grouped = [[] for _ in range(sum(map(len, groups.values())))]
+    for stoptime in route_data:
+        dest = stoptime.get("headsign") or ""
+
+        line = key = ""
+        if dest:
+            trip = stoptime.get("trip") or {}
+            trip_route = trip.get("route") or {}
+            key = (trip_route.get("shortName") or "").casefold()
+            if key:
+                line = route_index.get(key, "")
+
+        if groups is not None:
+            targets = groups.get(key) if line else None
+            if not targets:
+                continue
+        elif route_filter is not None:
+            if not line or key != route_filter:
+                continue
+        elif dest_filter is not None:
+            if dest_filter not in dest.casefold():
+                continue
+        elif named_only and not (line and dest):
+            continue
+
+        arrival = stoptime.get("realtimeArrival", None)
+        if arrival is None:
+            arrival = stoptime.get("scheduledArrival", 0)
+
+        departure = {
+            DICT_KEY_ARRIVAL: format_arrival(arrival),
+            DICT_KEY_DEST: dest,
+            DICT_KEY_ROUTE: line,
+            DICT_KEY_EPOCH: stoptime.get("serviceDay", 0) + arrival,
+            DICT_KEY_REALTIME: bool(stoptime.get("realtime")),
+        }
+        routes.append(departure)
+
+        if groups is not None:
+            folded = dest.casefold()
+            for headsign, position in targets:
+                if headsign is None or headsign == folded:
+                    grouped[position].append(departure)
+
+    parsed_data[DICT_KEY_ROUTES] = routes
+    if groups is not None:
+        parsed_data[DICT_KEY_GROUPS] = grouped
+    return parsed_data
+
+
+def route_attributes(parsed_data, limit, departures=None):
+    """Return the route sensor's attributes for parsed data with departures.
+
+    At most `limit` departures are listed, the primary one included; the
+    full list is available through the get_departures service. A group's
+    sensor passes its own non-empty `departures`.
+    """
+    if departures is None:
+        departures = parsed_data[DICT_KEY_ROUTES]
+
+    routes = []
+    for rt in departures[1:limit]:
+        routes.append({
+            ATTR_ROUTE: rt[DICT_KEY_ROUTE],
+            ATTR_DEST: rt[DICT_KEY_DEST] or "Unavailable",
+            ATTR_ARR_TIME: rt[DICT_KEY_ARRIVAL],
+        })
+
+    primary = departures[0]
+
+    attributes = {
+        ATTR_ROUTE: primary[DICT_KEY_ROUTE],
+        ATTR_DEST: primary[DICT_KEY_DEST] or "Unavailable",
+        ATTR_ARR_TIME: primary[DICT_KEY_ARRIVAL],
+        "ROUTES": routes,
+        ATTR_STOP_NAME: parsed_data[STOP_NAME],
+        ATTR_STOP_CODE: parsed_data[STOP_CODE],
+        ATTR_STOP_GTFS: parsed_data[STOP_GTFS],
+        ATTR_ATTRIBUTION: ATTRIBUTION,
+    }
+    if parsed_data.get(DICT_KEY_STALE_SINCE):
+        attributes[ATTR_STALE_SINCE] = parsed_data[DICT_KEY_STALE_SINCE]
+    return attributes
+
+
+def next_departure(routes, now):
+    """Return the first departure at or after `now`, or None."""
+    return next(
+        (route for route in routes or () if route.get(DICT_KEY_EPOCH, 0) >= now),
+        None,
+    )
+
+
+def stale_snapshot(parsed_data, now, stale_since):
+    """Return a copy of parsed data without departed trips, marked stale."""
+    snapshot = {
+        **parsed_data,
+        DICT_KEY_ROUTES: _upcoming(parsed_data.get(DICT_KEY_ROUTES), now),
+        DICT_KEY_STALE_SINCE: stale_since,
+    }
+    if parsed_data.get(DICT_KEY_GROUPS) is not None:
+        snapshot[DICT_KEY_GROUPS] = [
+            _upcoming(group, now) for group in parsed_data[DICT_KEY_GROUPS]
+        ]
+    return snapshot
+
+
+def trimmed_snapshot(parsed_data, now, horizon):
+    """Return a copy of parsed data with the next `horizon` seconds only.
+
+    This is what gets saved to storage: the whole day can hold over a
+    thousand departures, while a stale snapshot only needs the next ones.
+    """
+    until = now + horizon
+    snapshot = {
+        **parsed_data,
+        DICT_KEY_ROUTES: _upcoming(parsed_data.get(DICT_KEY_ROUTES), now, until),
+    }
+    if parsed_data.get(DICT_KEY_GROUPS) is not None:
+        snapshot[DICT_KEY_GROUPS] = [
+            _upcoming(group, now, until) for group in parsed_data[DICT_KEY_GROUPS]
+        ]
+    return snapshot
+
+
+def _upcoming(departures, now, until=None):
+    """Return the departures at or after `now`, and up to `until` if given."""
+    return [
+        route
+        for route in departures or ()
+        if now <= route.get(DICT_KEY_EPOCH, 0)
+        and (until is None or route.get(DICT_KEY_EPOCH, 0) <= until)
+    ]
+
+
+def departures_fingerprint(parsed_data):
+    """Return a cheap hash of everything a sensor shows from parsed data.
+
+    The realtime flag is included, so a departure switching from scheduled
+    to realtime within the same minute still counts as a change.
+    """
+    if not parsed_data:
+        return hash(None)
+
+    return hash(
+        (
+            parsed_data.get(STOP_NAME),
+            parsed_data.get(STOP_CODE),
+            parsed_data.get(STOP_GTFS),
+            tuple(
+                (
+                    route[DICT_KEY_ROUTE],
+                    route[DICT_KEY_DEST],
+                    route[DICT_KEY_ARRIVAL],
+                    route[DICT_KEY_EPOCH],
+                    route[DICT_KEY_REALTIME],
+                )
+                for route in parsed_data.get(DICT_KEY_ROUTES) or ()
+            ),
+        )
+    )
+
+
+def select_departures(
+    parsed_data, route=None, dest=None, start=None, end=None, offset=0, limit=None
+):
+    """Return a page of parsed departures matching a query.
+
+    `route` matches the short name exactly and `dest` is a substring of the
+    headsign, both case-insensitive. `start` and `end` bound the departure
+    epoch. Returns the page and the total number of matching departures.
+    """
+    route = route.casefold() if route else None
+    dest = dest.casefold() if dest else None
+
+    matches = [
+        departure
+        for departure in (parsed_data or {}).get(DICT_KEY_ROUTES) or ()
+        if (route is None or departure[DICT_KEY_ROUTE].casefold() == route)
+        and (dest is None or dest in departure[DICT_KEY_DEST].casefold())
+        and (start is None or departure[DICT_KEY_EPOCH] >= start)
+        and (end is None or departure[DICT_KEY_EPOCH] < end)
+    ]
+
+    stop = None if limit is None else offset + limit
+    return matches[offset:stop], len(matches)
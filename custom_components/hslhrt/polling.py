@@ -0,0 +1,37 @@
+"""Adaptive polling interval for HSL HRT coordinators."""
+
+from datetime import timedelta
+
+from .const import (
+    DEPARTURE_LEAD,
+    DICT_KEY_EPOCH,
+    DICT_KEY_REALTIME,
+)
+from .parser import next_departure
+
+
+def compute_update_interval(routes, now, floor, ceiling):
+    """Return how long to wait before the next poll.
+
+    - Within DEPARTURE_LEAD of the next departure the floor is used, so
+      realtime predictions stay fresh when they matter.
+    - Further away the interval grows with half of the remaining lead time,
+      and doubles again while the next departure is scheduled-only since its
+      time will not move before the vehicle starts reporting.
+    - Without any upcoming departure (end of service) the ceiling is used.
+
+    The result is always clamped to [floor, ceiling].
+    """
+    upcoming = next_departure(routes, now)
+    if upcoming is None:
+        return ceiling
+
+    wait = upcoming[DICT_KEY_EPOCH] - now - DEPARTURE_LEAD.total_seconds()
+    if wait <= 0:
+        return floor
+
+    seconds = wait / 2
+    if not upcoming.get(DICT_KEY_REALTIME):
+        seconds *= 2
+
+    return max(floor, min(ceiling, timedelta(seconds=int(seconds))))
@@ -0,0 +1,194 @@
+"""On-demand profiling of HSL HRT refresh cycles."""
+
+import asyncio
+import cProfile
+import io
+import pstats
+import time
+import tracemalloc
+
+from homeassistant.exceptions import HomeAssistantError
+from homeassistant.util import dt as dt_util
+
+from .const import (
+    _LOGGER,
+    DOMAIN,
+    METRIC_LATENCY,
+    METRIC_PARSE_TIME,
+    PROFILE_BLOCKED,
+    PROFILE_TICK,
+    PROFILE_TOP,
+)
+
+
+async def async_profile(hass, coordinators, cycles):
+    """Refresh coordinators `cycles` times under cProfile and tracemalloc.
+
+    `coordinators` maps entry ids to coordinators. Every cycle drops the
+    cached stop payloads and refreshes all of them together, so each goes
+    through fetch and parse. Large stops are parsed on the event loop
+    instead of the executor meanwhile, since cProfile only follows this
+    thread; their parses then also show up as loop lag. While the cycles
+    run a ticker measures how late the event loop wakes it up. A text
+    report and the cProfile dump are written to the config directory;
+    returns a summary with their paths.
+    """
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError as error:
+        # Another profiler, e.g. the profiler integration, is running
+        raise HomeAssistantError(f"Cannot start profiling: {error}") from error
+    profiler.disable()
+
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    before = await hass.async_add_executor_job(tracemalloc.take_snapshot)
+
+    lags = []
+    stop = asyncio.Event()
+    monitor = asyncio.ensure_future(_async_monitor_loop(lags, stop))
+    cycle_times = []
+    updates = []
+
+    for coordinator in coordinators.values():
+        coordinator.parse_inline = True
+    profiler.enable()
+    try:
+        for cycle in range(cycles):
+            for coordinator in coordinators.values():
+                coordinator.hub.invalidate()
+
+            started = time.perf_counter()
+            results = await asyncio.gather(
+                *(
+                    _async_timed_refresh(entry_id, coordinator)
+                    for entry_id, coordinator in coordinators.items()
+                )
+            )
+            cycle_times.append(round((time.perf_counter() - started) * 1000, 1))
+            for result in results:
+                result["cycle"] = cycle
+            updates.extend(results)
+    finally:
+        profiler.disable()
+        for coordinator in coordinators.values():
+            coordinator.parse_inline = False
+        stop.set()
+        await monitor
+        after = await hass.async_add_executor_job(tracemalloc.take_snapshot)
+        if started_tracing:
+            tracemalloc.stop()
+
+    fetch_to_parse = sorted(
+        update["request_ms"] + update["parse_ms"]
+        for update in updates
+        if update["success"]
+    )
+    lags.sort()
+    summary = {
+        "entries": len(coordinators),
+        "cycles": cycles,
+        "cycle_ms": cycle_times,
+        "fetch_to_parse_ms": {
+            "p50": _percentile(fetch_to_parse, 0.5),
+            "max": fetch_to_parse[-1] if fetch_to_parse else None,
+        },
+        "loop_lag_ms": {
+            "p99": _percentile(lags, 0.99),
+            "max": lags[-1] if lags else None,
+            "blocked": round(
+                sum(lag for lag in lags if lag > PROFILE_BLOCKED.total_seconds() * 1000),
+                1,
+            ),
+        },
+    }
+
+    stamp = dt_util.now().strftime("%Y%m%d_%H%M%S")
+    summary["report"] = hass.config.path(f"{DOMAIN}_profile.{stamp}.txt")
+    summary["profile"] = hass.config.path(f"{DOMAIN}_profile.{stamp}.cprof")
+    await hass.async_add_executor_job(
+        _write_report, summary, updates, profiler, before, after
+    )
+    _LOGGER.info("Profile of %d refresh cycle(s) written to %s", cycles, summary["report"])
+    return summary
+
+
+async def _async_timed_refresh(entry_id, coordinator):
+    """Refresh one coordinator and return its timings."""
+    started = time.perf_counter()
+    await coordinator.async_refresh()
+    refresh = (time.perf_counter() - started) * 1000
+
+    # Served stale data counts as a failure here, the metrics are older
+    success = coordinator.metrics.consecutive_failures == 0
+    metrics = coordinator.metrics.latest if success else {}
+    return {
+        "entry_id": entry_id,
+        "gtfs_id": coordinator.gtfs_id,
+        "success": success,
+        "refresh_ms": round(refresh, 1),
+        "request_ms": metrics.get(METRIC_LATENCY, 0.0),
+        "parse_ms": metrics.get(METRIC_PARSE_TIME, 0.0),
+    }
+
+
+async def _async_monitor_loop(lags, stop):
+    """Record in ms how late a PROFILE_TICK sleep wakes up until stopped."""
+    loop = asyncio.get_running_loop()
+    tick = PROFILE_TICK.total_seconds()
+    while not stop.is_set():
+        started = loop.time()
+        await asyncio.sleep(tick)
+        lags.append(round(max(0.0, loop.time() - started - tick) * 1000, 1))
+
+
+def _percentile(values, fraction):
+    """Return a percentile of sorted values."""
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def _write_report(summary, updates, profiler, before, after):
+    """Write the cProfile dump and the text report."""
+    profiler.dump_stats(summary["profile"])
+
+    lines = [
+        f"HSL HRT profile, {summary['entries']} entries, {summary['cycles']} cycle(s)",
+        "",
+        f"Cycle wall time (ms): {summary['cycle_ms']}",
+        f"Fetch to parsed (ms): {summary['fetch_to_parse_ms']}",
+        f"Event loop lag (ms): {summary['loop_lag_ms']}",
+        "",
+        f"{'cycle':>5}  {'entry':32}  {'stop':16}  {'refresh':>9}  "
+        f"{'request':>9}  {'parse':>7}",
+    ]
+    lines.extend(
+        f"{update['cycle']:>5}  {update['entry_id']:32}  {update['gtfs_id']:16}  "
+        f"{update['refresh_ms']:>9}  "
+        + (
+            f"{update['request_ms']:>9}  {update['parse_ms']:>7}"
+            if update["success"]
+            else "failed"
+        )
+        for update in updates
+    )
+
+    lines += ["", "Allocations during the cycles (tracemalloc)", ""]
+    differences = after.filter_traces(
+        (tracemalloc.Filter(False, tracemalloc.__file__),)
+    ).compare_to(before, "lineno")
+    lines.extend(str(difference) for difference in differences[:PROFILE_TOP])
+
+    stream = io.StringIO()
+    stats = pstats.Stats(profiler, stream=stream).sort_stats("cumulative")
+    stream.write("\nHSL HRT functions by cumulative time (cProfile)\n")
+    stats.print_stats(f"{DOMAIN}/", PROFILE_TOP)
+    stream.write("\nAll functions by cumulative time (cProfile)\n")
+    stats.print_stats(PROFILE_TOP)
+    lines.append(stream.getvalue())
+
+    with open(summary["report"], "w", encoding="utf-8") as report:
+        report.write("\n".join(lines))
@@ -0,0 +1,231 @@
+"""GraphQL document builders for HSL HRT."""
+
+from functools import lru_cache
+
+from .const import (
+    STOPTIME_FIELDS,
+    VAR_CURR_EPOCH,
+    VAR_DEPARTURES,
+    VAR_ID,
+    VAR_LIMIT,
+    VAR_PATTERN,
+    VAR_TIME_RANGE,
+)
+
+# Shapes of a stop selection; an int means a pattern-scoped fetch
+SHAPE_FULL = "full"
+SHAPE_HORIZON = "horizon"
+SHAPE_REALTIME = "realtime"
+
+
+def stop_alias(index):
+    """Return the response alias used for the stop at the given batch index."""
+    return f"s{index}"
+
+
+def pattern_alias(index):
+    """Return the response alias used for a pattern inside a stop selection."""
+    return f"p{index}"
+
+
+def _is_pattern_shape(shape):
+    """Return True if the shape is a pattern-scoped fetch."""
+    return isinstance(shape, int)
+
+
+def _stop_selection(index, shape):
+    """Return the selection fetching one stop.
+
+    A full shape fetches the rest of the day for the whole stop, a horizon
+    shape only the next `$time_range<index>` seconds and a realtime shape
+    only the next `$departures<index>` trips within that range. With
+    patterns only the stoptimes of those patterns are requested, one alias
+    per pattern, so the server does the route filtering.
+    """
+    alias = stop_alias(index)
+    departures = f"${VAR_DEPARTURES}{index}"
+    time_range = f"${VAR_TIME_RANGE}{index}"
+
+    if shape == SHAPE_FULL:
+        stoptimes = (
+            f"stoptimesWithoutPatterns (startTime: ${VAR_CURR_EPOCH}, "
+            f"numberOfDepartures: ${VAR_LIMIT}) {{ ...Stoptime }}"
+        )
+    elif shape == SHAPE_HORIZON:
+        stoptimes = (
+            f"stoptimesWithoutPatterns (startTime: ${VAR_CURR_EPOCH}, "
+            f"numberOfDepartures: ${VAR_LIMIT}, timeRange: {time_range}) "
+            "{ ...Stoptime }"
+        )
+    elif shape == SHAPE_REALTIME:
+        stoptimes = (
+            f"stoptimesWithoutPatterns (startTime: ${VAR_CURR_EPOCH}, "
+            f"numberOfDepartures: {departures}, timeRange: {time_range}) "
+            "{ ...Stoptime }"
+        )
+    else:
+        stoptimes = " ".join(
+            f"{pattern_alias(j)}: stopTimesForPattern (id: ${VAR_PATTERN}{index}_{j}, "
+            f"startTime: ${VAR_CURR_EPOCH}, numberOfDepartures: {departures}) "
+            "{ ...Stoptime }"
+            for j in range(shape)
+        )
+
+    # Name, code and routes come from the metadata cache, not every poll
+    return f"\t\t{alias}: stop (id: ${VAR_ID}{index}) {{ gtfsId {stoptimes} }}"
+
+
+@lru_cache(maxsize=16)
+def build_stoptime_fragment(fields):
+    """Build the Stoptime fragment selecting a frozenset of dotted paths."""
+    tree = {}
+    for path in sorted(fields):
+        node = tree
+        for name in path.split("."):
+            node = node.setdefault(name, {})
+    return f"\n\tfragment Stoptime on Stoptime {{ {_selection(tree)} }}\n"
+
+
+def _selection(tree):
+    """Render a nested dict of field names as a GraphQL selection."""
+    return " ".join(
+        f"{name} {{ {_selection(children)} }}" if children else name
+        for name, children in tree.items()
+    )
+
+
+@lru_cache(maxsize=128)
+def build_batch_query(shapes, fields=STOPTIME_FIELDS):
+    """Build a document fetching several stops in one request using aliases.
+
+    `shapes` holds one item per stop: SHAPE_FULL, SHAPE_HORIZON,
+    SHAPE_REALTIME or the number of patterns for a pattern-scoped fetch.
+    `fields` are the stoptime fields to select, see build_stoptime_fragment.
+    Ids, departure counts and time ranges are passed as variables, one per
+    stop, so every stop keeps its own limits and the document only depends
+    on the shapes and fields and can be cached.
+    """
+    var_defs = [f"${VAR_ID}{i}: String!" for i in range(len(shapes))]
+    # GraphQL rejects declared variables that are never used
+    for i, shape in enumerate(shapes):
+        if _is_pattern_shape(shape):
+            var_defs.extend(f"${VAR_PATTERN}{i}_{j}: String!" for j in range(shape))
+        if shape in (SHAPE_HORIZON, SHAPE_REALTIME):
+            var_defs.append(f"${VAR_TIME_RANGE}{i}: Int!")
+        if shape == SHAPE_REALTIME or _is_pattern_shape(shape):
+            var_defs.append(f"${VAR_DEPARTURES}{i}: Int!")
+    var_defs.append(f"${VAR_CURR_EPOCH}: Long!")
+    if SHAPE_FULL in shapes or SHAPE_HORIZON in shapes:
+        var_defs.append(f"${VAR_LIMIT}: Int!")
+
+    selections = "\n".join(
+        _stop_selection(i, shape) for i, shape in enumerate(shapes)
+    )
+
+    return f"""
+    query ({", ".join(var_defs)}) {{
+{selections}
+	}}
+{build_stoptime_fragment(fields)}"""
+
+
+def request_shape(patterns, horizon, realtime=False):
+    """Return the shape of a stop request."""
+    if patterns:
+        return len(patterns)
+    if realtime:
+        return SHAPE_REALTIME
+    if horizon:
+        return SHAPE_HORIZON
+    return SHAPE_FULL
+
+
+def build_batch_variables(requests, current_epoch, limit):
+    """Return the variables matching build_batch_query for the given requests.
+
+    `requests` is a list of (gtfs_id, shape, patterns, departures,
+    time_range) tuples where patterns is None unless the shape is
+    pattern-scoped; departures and time_range are only used by the shapes
+    that declare them.
+    """
+    variables = {VAR_CURR_EPOCH: current_epoch}
+
+    for i, (gtfs_id, shape, patterns, departures, time_range) in enumerate(requests):
+        variables[f"{VAR_ID}{i}"] = gtfs_id
+        if shape in (SHAPE_FULL, SHAPE_HORIZON):
+            variables[VAR_LIMIT] = limit
+        if shape in (SHAPE_HORIZON, SHAPE_REALTIME):
+            variables[f"{VAR_TIME_RANGE}{i}"] = time_range
+        if shape == SHAPE_REALTIME or _is_pattern_shape(shape):
+            variables[f"{VAR_DEPARTURES}{i}"] = departures
+        for j, code in enumerate(patterns or ()):
+            variables[f"{VAR_PATTERN}{i}_{j}"] = code
+
+    return variables
+
+
+def merge_pattern_stoptimes(stop_data, shape):
+    """Fold pattern-scoped stoptimes into `stoptimesWithoutPatterns`.
+
+    The result has the same shape as a full stop fetch, ordered by arrival,
+    so it can be parsed without knowing how it was fetched.
+    """
+    if stop_data is None or not _is_pattern_shape(shape):
+        return stop_data
+
+    stoptimes = []
+    for j in range(shape):
+        stoptimes.extend(stop_data.pop(pattern_alias(j), None) or [])
+
+    stoptimes.sort(key=_arrival_epoch)
+    stop_data["stoptimesWithoutPatterns"] = stoptimes
+    return stop_data
+
+
+def merge_horizon_stoptimes(timetable, fresh, now, horizon):
+    """Overlay a short realtime horizon on a cached long-range timetable.
+
+    Rows of `fresh` replace the same trips in `timetable`. Cached rows that
+    were scheduled inside the horizon but are missing from `fresh` have left
+    or were cancelled and are dropped, as is anything that already departed.
+    Returns a new stop payload; the inputs are not modified.
+    """
+    if fresh is None:
+        return None
+    if timetable is None:
+        return fresh
+
+    fresh_rows = fresh.get("stoptimesWithoutPatterns") or []
+    fresh_keys = {_trip_key(row) for row in fresh_rows}
+    horizon_end = now + horizon
+
+    kept = [
+        row
+        for row in timetable.get("stoptimesWithoutPatterns") or []
+        if _trip_key(row) not in fresh_keys
+        and _scheduled_epoch(row) >= horizon_end
+        and _arrival_epoch(row) >= now
+    ]
+
+    merged = dict(fresh)
+    merged["stoptimesWithoutPatterns"] = sorted(fresh_rows + kept, key=_arrival_epoch)
+    return merged
+
+
+def _trip_key(stoptime):
+    """Return a key identifying the trip of a stoptime on its service day."""
+    trip = stoptime.get("trip") or {}
+    return trip.get("gtfsId"), stoptime.get("serviceDay")
+
+
+def _scheduled_epoch(stoptime):
+    """Return the scheduled arrival of a stoptime as seconds since the epoch."""
+    return stoptime.get("serviceDay", 0) + stoptime.get("scheduledArrival", 0)
+
+
+def _arrival_epoch(stoptime):
+    """Return the arrival of a stoptime as seconds since the epoch."""
+    arrival = stoptime.get("realtimeArrival")
+    if arrival is None:
+        arrival = stoptime.get("scheduledArrival", 0)
+    return stoptime.get("serviceDay", 0) + arrival
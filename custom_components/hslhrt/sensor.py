@@ -1,36 +1,69 @@
 """Sensor platform for HSL HRT routes."""
 
-from homeassistant.util import Throttle
+import time
+
+from homeassistant.components.sensor import (
+    SensorDeviceClass,
+    SensorEntity,
+    SensorStateClass,
+)
+from homeassistant.core import callback
+from homeassistant.util import dt as dt_util
+from homeassistant.helpers.event import async_track_time_interval
 from homeassistant.helpers.update_coordinator import CoordinatorEntity
 
-from homeassistant.const import ATTR_ATTRIBUTION
+from homeassistant.const import ATTR_ATTRIBUTION, EntityCategory
 
 from . import base_unique_id
+from .parser import next_departure, route_attributes
 
 from .const import (
-    _LOGGER,
     DOMAIN,
     COORDINATOR,
     STOP_GTFS,
     STOP_NAME,
-    STOP_CODE,
     ROUTE,
+    NEXT_DEPARTURE,
+    COUNTDOWN,
+    COUNTDOWN_INTERVAL,
     ATTR_ROUTE,
     ATTR_DEST,
-    ATTR_ARR_TIME,
-    ATTR_STOP_NAME,
-    ATTR_STOP_CODE,
-    ATTR_STOP_GTFS,
+    ATTR_REALTIME,
+    ATTR_STALE_SINCE,
     DICT_KEY_ROUTE,
     DICT_KEY_ROUTES,
     DICT_KEY_DEST,
-    DICT_KEY_ARRIVAL,
+    DICT_KEY_EPOCH,
+    DICT_KEY_GROUPS,
+    DICT_KEY_REALTIME,
+    DICT_KEY_STALE_SINCE,
+    METRIC_LATENCY,
+    METRIC_BYTES,
+    METRIC_DEPARTURES,
+    METRIC_PARSE_TIME,
+    METRIC_HIT_RATIO,
+    METRIC_FAILURES,
     ATTRIBUTION,
-    ALL,
 )
 
 SENSOR_TYPES = {ROUTE: ["Route", None]}
 
+# Computed locally from the departure epochs between polls
+DEPARTURE_SENSOR_TYPES = {
+    NEXT_DEPARTURE: ["Next departure", None],
+    COUNTDOWN: ["Minutes until departure", "min"],
+}
+
+# Performance metrics, disabled by default
+METRIC_SENSOR_TYPES = {
+    METRIC_LATENCY: ["Request latency", "ms"],
+    METRIC_BYTES: ["Response size", "B"],
+    METRIC_DEPARTURES: ["Departures parsed", None],
+    METRIC_PARSE_TIME: ["Parse time", "ms"],
+    METRIC_HIT_RATIO: ["Filter hit ratio", "%"],
+    METRIC_FAILURES: ["Consecutive failures", None],
+}
+
 PARALLEL_UPDATES = 1
 
 
@@ -42,13 +75,26 @@ async def async_setup_entry(hass, config_entry, async_add_entities):
 
     entity_list = []
 
-    for sensor_type in SENSOR_TYPES:
-        entity_list.append(HSLHRTRouteSensor(name, coordinator, sensor_type))
+    if coordinator.groups:
+        # One sensor per route (and headsign), all fed by the same parse
+        for position, (route, headsign) in enumerate(coordinator.groups):
+            entity_list.append(
+                HSLHRTGroupSensor(name, coordinator, position, route, headsign)
+            )
+    else:
+        for sensor_type in SENSOR_TYPES:
+            entity_list.append(HSLHRTRouteSensor(name, coordinator, sensor_type))
+
+    for sensor_type in DEPARTURE_SENSOR_TYPES:
+        entity_list.append(HSLHRTDepartureSensor(name, coordinator, sensor_type))
+
+    for sensor_type in METRIC_SENSOR_TYPES:
+        entity_list.append(HSLHRTMetricSensor(name, coordinator, sensor_type))
 
     async_add_entities(entity_list, False)
 
 
-class HSLHRTRouteSensor(CoordinatorEntity):
+class HSLHRTRouteSensor(CoordinatorEntity, SensorEntity):
     """Implementation of a HSL HRT sensor."""
 
     _attr_icon = "mdi:bus"
@@ -66,55 +112,222 @@ class HSLHRTRouteSensor(CoordinatorEntity):
         self._attr_unique_id = base_unique_id(
             coordinator.gtfs_id,
             coordinator.route,
-            coordinator.dest
+            coordinator.dest,
+            groups=coordinator.groups,
         )
 
+        self._update_from_data()
+
     @property
     def device_info(self):
         return {
             "identifiers": {(DOMAIN, self.coordinator.gtfs_id)},
-            "name": self.coordinator.route_data.get(STOP_NAME, "HSL Stop"),
+            # Before the first refresh, fall back to the name from setup
+            "name": (self.coordinator.route_data or {}).get(STOP_NAME)
+            or self.coordinator.stop_name
+            or "HSL Stop",
             "manufacturer": "HSL / Digitransit",
             "model": "Routing API v2",
         }
 
-    @property
-    def native_value(self):
-        """Return the current route."""
+    @callback
+    def _handle_coordinator_update(self):
+        """Rebuild the cached state once per data change."""
+        self._update_from_data()
+        super()._handle_coordinator_update()
+
+    def _update_from_data(self):
+        """Build the state and attribute snapshot from coordinator data."""
         data = self.coordinator.route_data
+        departures = self._departures(data or {})
 
-        if not data or not data.get(DICT_KEY_ROUTES):
-            return None
+        if not departures:
+            self._attr_native_value = None
+            self._attr_extra_state_attributes = {ATTR_ATTRIBUTION: ATTRIBUTION}
+            return
 
         # First route is the primary one
-        primary = data[DICT_KEY_ROUTES][0]
-        return primary.get(DICT_KEY_ROUTE)
+        self._attr_native_value = departures[0].get(DICT_KEY_ROUTE)
+        self._attr_extra_state_attributes = route_attributes(
+            data, self.coordinator.attribute_departures, departures
+        )
+
+    def _departures(self, data):
+        """Return the departures this sensor shows."""
+        return data.get(DICT_KEY_ROUTES)
+
+
+class HSLHRTGroupSensor(HSLHRTRouteSensor):
+    """One route, or route and headsign, of a per-route stop entry."""
+
+    def __init__(self, name, coordinator, position, route, headsign=None):
+        self.position = position
+        super().__init__(name, coordinator, ROUTE)
+
+        if headsign:
+            self._attr_name = f"{route} → {headsign}"
+            self._attr_unique_id += f"_{route.upper()}_{headsign.upper()}"
+        else:
+            self._attr_name = f"Route {route}"
+            self._attr_unique_id += f"_{route.upper()}"
+
+    def _departures(self, data):
+        """Return the departures of this sensor's group."""
+        groups = data.get(DICT_KEY_GROUPS) or ()
+        return groups[self.position] if self.position < len(groups) else None
+
+
+class HSLHRTDepartureSensor(CoordinatorEntity, SensorEntity):
+    """Next departure as a timestamp or a countdown, ticking between polls.
+
+    The state is recomputed every COUNTDOWN_INTERVAL from the departure
+    epochs of the last update, without any API traffic, and only written
+    when it changes. An entry following several routes has one pair for all
+    of its selected routes, not one per group. Disabled by default, as the
+    countdown is recorded every minute.
+    """
+
+    _attr_has_entity_name = True
+    _attr_entity_registry_enabled_default = False
+
+    def __init__(self, name, coordinator, sensor_type):
+        super().__init__(coordinator)
+
+        self.client_name = name
+        self.type = sensor_type
+
+        self._attr_name = DEPARTURE_SENSOR_TYPES[sensor_type][0]
+        self._attr_native_unit_of_measurement = DEPARTURE_SENSOR_TYPES[sensor_type][1]
+        if sensor_type == NEXT_DEPARTURE:
+            self._attr_device_class = SensorDeviceClass.TIMESTAMP
+            self._attr_icon = "mdi:clock-outline"
+        else:
+            self._attr_icon = "mdi:timer-outline"
+
+        unique_id = base_unique_id(
+            coordinator.gtfs_id,
+            coordinator.route,
+            coordinator.dest,
+            groups=coordinator.groups,
+        )
+        self._attr_unique_id = f"{unique_id}_{sensor_type}"
+
+        self._update_from_data()
 
     @property
-    def extra_state_attributes(self):
-        """Return the state attributes."""
-        data = self.coordinator.route_data
-        
-        if not data or not data.get(DICT_KEY_ROUTES):
-            return {ATTR_ATTRIBUTION: ATTRIBUTION}
-            
-        routes = []
-        for rt in data[DICT_KEY_ROUTES][1:]:
-            routes.append({
-                ATTR_ROUTE: rt[DICT_KEY_ROUTE],
-                ATTR_DEST: rt[DICT_KEY_DEST] or "Unavailable",
-                ATTR_ARR_TIME: rt[DICT_KEY_ARRIVAL],
-            })
-
-        primary = data[DICT_KEY_ROUTES][0]
-        
+    def device_info(self):
         return {
-            ATTR_ROUTE: primary[DICT_KEY_ROUTE],
-            ATTR_DEST: primary[DICT_KEY_DEST] or "Unavailable",
-            ATTR_ARR_TIME: primary[DICT_KEY_ARRIVAL],
-            "ROUTES": routes,
-            ATTR_STOP_NAME: data[STOP_NAME],
-            ATTR_STOP_CODE: data[STOP_CODE],
-            ATTR_STOP_GTFS: data[STOP_GTFS],
+            "identifiers": {(DOMAIN, self.coordinator.gtfs_id)},
+        }
+
+    async def async_added_to_hass(self):
+        """Start ticking once added."""
+        await super().async_added_to_hass()
+        self.async_on_remove(
+            async_track_time_interval(self.hass, self._async_tick, COUNTDOWN_INTERVAL)
+        )
+
+    @callback
+    def _async_tick(self, _now):
+        """Recompute the state locally and write it only if it changed."""
+        previous = (self._attr_native_value, self._attr_extra_state_attributes)
+        self._update_from_data()
+        if (self._attr_native_value, self._attr_extra_state_attributes) != previous:
+            self.async_write_ha_state()
+
+    @callback
+    def _handle_coordinator_update(self):
+        """Recompute the state from new data."""
+        self._update_from_data()
+        super()._handle_coordinator_update()
+
+    def _update_from_data(self):
+        """Find the next departure that has not left yet."""
+        now = time.time()
+        data = self.coordinator.route_data or {}
+        departure = next_departure(data.get(DICT_KEY_ROUTES), now)
+
+        if departure is None:
+            self._attr_native_value = None
+            self._attr_extra_state_attributes = {ATTR_ATTRIBUTION: ATTRIBUTION}
+            return
+
+        if self.type == NEXT_DEPARTURE:
+            self._attr_native_value = dt_util.utc_from_timestamp(
+                departure[DICT_KEY_EPOCH]
+            )
+        else:
+            self._attr_native_value = int(departure[DICT_KEY_EPOCH] - now) // 60
+
+        self._attr_extra_state_attributes = {
+            ATTR_ROUTE: departure[DICT_KEY_ROUTE],
+            ATTR_DEST: departure[DICT_KEY_DEST] or "Unavailable",
+            ATTR_REALTIME: departure[DICT_KEY_REALTIME],
             ATTR_ATTRIBUTION: ATTRIBUTION,
         }
+        if data.get(DICT_KEY_STALE_SINCE):
+            self._attr_extra_state_attributes[ATTR_STALE_SINCE] = data[
+                DICT_KEY_STALE_SINCE
+            ]
+
+
+class HSLHRTMetricSensor(CoordinatorEntity, SensorEntity):
+    """Fetch and parse cost of the entry, updated after every refresh.
+
+    The coordinator only notifies listeners when departures change, so
+    these sensors follow the coordinator's metrics instead.
+    """
+
+    _attr_has_entity_name = True
+    _attr_entity_category = EntityCategory.DIAGNOSTIC
+    _attr_entity_registry_enabled_default = False
+    _attr_state_class = SensorStateClass.MEASUREMENT
+    _attr_icon = "mdi:speedometer"
+
+    def __init__(self, name, coordinator, sensor_type):
+        super().__init__(coordinator)
+
+        self.client_name = name
+        self.type = sensor_type
+
+        self._attr_name = METRIC_SENSOR_TYPES[sensor_type][0]
+        self._attr_native_unit_of_measurement = METRIC_SENSOR_TYPES[sensor_type][1]
+        if sensor_type == METRIC_BYTES:
+            self._attr_device_class = SensorDeviceClass.DATA_SIZE
+
+        unique_id = base_unique_id(
+            coordinator.gtfs_id,
+            coordinator.route,
+            coordinator.dest,
+            groups=coordinator.groups,
+        )
+        self._attr_unique_id = f"{unique_id}_{sensor_type}"
+        self._attr_native_value = coordinator.metrics.value(sensor_type)
+
+    @property
+    def device_info(self):
+        return {
+            "identifiers": {(DOMAIN, self.coordinator.gtfs_id)},
+        }
+
+    @property
+    def available(self):
+        """Stay available while updates fail, to show the failure count."""
+        return True
+
+    async def async_added_to_hass(self):
+        """Follow the coordinator's metrics."""
+        await super().async_added_to_hass()
+        self.async_on_remove(
+            self.coordinator.metrics.async_add_listener(self._handle_metrics_update)
+        )
+
+    @callback
+    def _handle_metrics_update(self):
+        """Write the latest value of the metric."""
+        self._attr_native_value = self.coordinator.metrics.value(self.type)
+        self.async_write_ha_state()
+
+    @callback
+    def _handle_coordinator_update(self):
+        """Metrics listeners already wrote the state."""
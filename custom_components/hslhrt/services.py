@@ -0,0 +1,150 @@
+"""Services for HSL HRT."""
+
+import asyncio
+import time
+
+import voluptuous as vol
+
+from homeassistant.core import SupportsResponse
+from homeassistant.exceptions import HomeAssistantError
+from homeassistant.helpers import config_validation as cv
+from homeassistant.util import dt as dt_util
+
+from .const import (
+    DOMAIN,
+    COORDINATOR,
+    STOP_CODE,
+    STOP_GTFS,
+    STOP_NAME,
+    ROUTE,
+    DESTINATION,
+    DICT_KEY_ARRIVAL,
+    DICT_KEY_DEST,
+    DICT_KEY_EPOCH,
+    DICT_KEY_REALTIME,
+    DICT_KEY_ROUTE,
+    SERVICE_GET_DEPARTURES,
+    ATTR_ENTRY_ID,
+    ATTR_START,
+    ATTR_WITHIN,
+    ATTR_OFFSET,
+    ATTR_LIMIT,
+    DEFAULT_SERVICE_LIMIT,
+    MAX_SERVICE_LIMIT,
+    SERVICE_PROFILE,
+    ATTR_CYCLES,
+    DEFAULT_PROFILE_CYCLES,
+    MAX_PROFILE_CYCLES,
+)
+from .parser import select_departures
+from .profiling import async_profile
+
+GET_DEPARTURES_SCHEMA = vol.Schema(
+    {
+        vol.Required(ATTR_ENTRY_ID): cv.string,
+        vol.Optional(ROUTE): cv.string,
+        vol.Optional(DESTINATION): cv.string,
+        vol.Optional(ATTR_START): cv.datetime,
+        vol.Optional(ATTR_WITHIN): vol.All(vol.Coerce(int), vol.Range(min=1)),
+        vol.Optional(ATTR_OFFSET, default=0): cv.positive_int,
+        vol.Optional(ATTR_LIMIT, default=DEFAULT_SERVICE_LIMIT): vol.All(
+            vol.Coerce(int), vol.Range(min=1, max=MAX_SERVICE_LIMIT)
+        ),
+    }
+)
+
+PROFILE_SCHEMA = vol.Schema(
+    {
+        vol.Optional(ATTR_ENTRY_ID): cv.string,
+        vol.Optional(ATTR_CYCLES, default=DEFAULT_PROFILE_CYCLES): vol.All(
+            vol.Coerce(int), vol.Range(min=1, max=MAX_PROFILE_CYCLES)
+        ),
+    }
+)
+
+
+def async_setup_services(hass):
+    """Register the integration's services."""
+    profile_lock = asyncio.Lock()
+
+    async def async_get_departures(call):
+        """Return departures of an entry from its last update, without I/O."""
+        entry_data = hass.data[DOMAIN].get(call.data[ATTR_ENTRY_ID])
+        if not isinstance(entry_data, dict) or COORDINATOR not in entry_data:
+            raise HomeAssistantError(
+                f"HSL HRT entry {call.data[ATTR_ENTRY_ID]} is not loaded"
+            )
+
+        route_data = entry_data[COORDINATOR].route_data or {}
+
+        start = call.data.get(ATTR_START)
+        # Naive times are in Home Assistant's time zone, not the host's
+        start = dt_util.as_timestamp(dt_util.as_local(start)) if start else time.time()
+        within = call.data.get(ATTR_WITHIN)
+        end = start + within * 60 if within else None
+
+        departures, total = select_departures(
+            route_data,
+            route=call.data.get(ROUTE),
+            dest=call.data.get(DESTINATION),
+            start=start,
+            end=end,
+            offset=call.data[ATTR_OFFSET],
+            limit=call.data[ATTR_LIMIT],
+        )
+
+        return {
+            STOP_NAME: route_data.get(STOP_NAME),
+            STOP_CODE: route_data.get(STOP_CODE),
+            STOP_GTFS: route_data.get(STOP_GTFS),
+            "total": total,
+            ATTR_OFFSET: call.data[ATTR_OFFSET],
+            "departures": [
+                {
+                    DICT_KEY_ROUTE: departure[DICT_KEY_ROUTE],
+                    DICT_KEY_DEST: departure[DICT_KEY_DEST],
+                    DICT_KEY_ARRIVAL: departure[DICT_KEY_ARRIVAL],
+                    "time": dt_util.as_local(
+                        dt_util.utc_from_timestamp(departure[DICT_KEY_EPOCH])
+                    ).isoformat(),
+                    DICT_KEY_REALTIME: departure[DICT_KEY_REALTIME],
+                }
+                for departure in departures
+            ],
+        }
+
+    hass.services.async_register(
+        DOMAIN,
+        SERVICE_GET_DEPARTURES,
+        async_get_departures,
+        schema=GET_DEPARTURES_SCHEMA,
+        supports_response=SupportsResponse.ONLY,
+    )
+
+    async def async_profile_entries(call):
+        """Profile refresh cycles of one or all loaded entries."""
+        coordinators = {
+            entry_id: entry_data[COORDINATOR]
+            for entry_id, entry_data in hass.data[DOMAIN].items()
+            if isinstance(entry_data, dict) and COORDINATOR in entry_data
+        }
+        entry_id = call.data.get(ATTR_ENTRY_ID)
+        if entry_id is not None:
+            if entry_id not in coordinators:
+                raise HomeAssistantError(f"HSL HRT entry {entry_id} is not loaded")
+            coordinators = {entry_id: coordinators[entry_id]}
+        if not coordinators:
+            raise HomeAssistantError("No HSL HRT entries are loaded")
+        if profile_lock.locked():
+            raise HomeAssistantError("HSL HRT is already being profiled")
+
+        async with profile_lock:
+            return await async_profile(hass, coordinators, call.data[ATTR_CYCLES])
+
+    hass.services.async_register(
+        DOMAIN,
+        SERVICE_PROFILE,
+        async_profile_entries,
+        schema=PROFILE_SCHEMA,
+        supports_response=SupportsResponse.OPTIONAL,
+    )
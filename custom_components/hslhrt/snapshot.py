@@ -0,0 +1,50 @@
+"""Last good departures of each entry, kept in `.storage`."""
+
+import asyncio
+
+from homeassistant.helpers.storage import Store
+
+from .const import (
+    SNAPSHOT_SAVE_DELAY,
+    SNAPSHOT_STORAGE_KEY,
+    STORAGE_VERSION,
+)
+
+
+class HSLHRTSnapshotStore:
+    """Persist the last successfully parsed data of every entry.
+
+    Coordinators serve it while Digitransit fails, including right after a
+    restart, so sensors keep showing the departures that are still ahead.
+    Writes are delayed and coalesced by Store.
+    """
+
+    def __init__(self, hass):
+        """Initialize."""
+        self._store = Store(hass, STORAGE_VERSION, SNAPSHOT_STORAGE_KEY)
+        self._snapshots = {}
+        self._load_task = None
+
+    async def async_load(self):
+        """Load the snapshots from storage once."""
+        if self._load_task is None:
+            self._load_task = asyncio.ensure_future(self._async_load())
+        await self._load_task
+
+    async def _async_load(self):
+        """Read the stored snapshots."""
+        self._snapshots = await self._store.async_load() or {}
+
+    def get(self, entry_id):
+        """Return the last good data of an entry, or None."""
+        return self._snapshots.get(entry_id)
+
+    def set(self, entry_id, route_data):
+        """Remember new good data of an entry."""
+        self._snapshots[entry_id] = route_data
+        self._store.async_delay_save(lambda: self._snapshots, SNAPSHOT_SAVE_DELAY)
+
+    def remove(self, entry_id):
+        """Forget a removed entry."""
+        if self._snapshots.pop(entry_id, None) is not None:
+            self._store.async_delay_save(lambda: self._snapshots, SNAPSHOT_SAVE_DELAY)
@@ -0,0 +1,236 @@
+"""Local stop search index for the HSL HRT config flow."""
+
+import asyncio
+from array import array
+from bisect import bisect_left
+import difflib
+import re
+import time
+import unicodedata
+import zipfile
+
+from homeassistant.helpers.storage import Store
+from homeassistant.helpers.update_coordinator import UpdateFailed
+
+from .const import (
+    _LOGGER,
+    ALL_STOPS_QUERY,
+    DOMAIN,
+    GTFS_ENGINES,
+    STOP_INDEX_STORAGE_KEY,
+    STOP_INDEX_TTL,
+    STOP_SEARCH_LIMIT,
+    STORAGE_VERSION,
+)
+from .gtfs import read_stops
+
+KEY_FETCHED = "fetched"
+KEY_STOPS = "stops"
+
+# Minimum similarity of a fuzzy match, see difflib.SequenceMatcher.ratio
+FUZZY_CUTOFF = 0.75
+
+_WORD = re.compile(r"\w+")
+
+
+def fold(text):
+    """Return text case-folded and without diacritics, Töölö -> toolo."""
+    decomposed = unicodedata.normalize("NFKD", text or "")
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).casefold()
+
+
+class StopSearchIndex:
+    """Prefix and fuzzy search over stop names and codes.
+
+    Folded names, the words of each name and codes are kept in one sorted key
+    list with a parallel array of owning stops. A prefix query is a binary
+    search for the first key plus a scan while keys share the prefix, the
+    same walk a prefix trie does without a node object per character.
+    Queries without enough prefix matches fall back to fuzzy matching, so
+    small typos still find the stop.
+    """
+
+    def __init__(self, stops):
+        """Build the index of [gtfsId, name, code] rows (CPU bound)."""
+        self._stops = [tuple(stop) for stop in stops]
+
+        entries = set()
+        for position, (_, name, code) in enumerate(self._stops):
+            folded = fold(name)
+            entries.add((folded, position))
+            for word in _WORD.findall(folded):
+                entries.add((word, position))
+            if code:
+                entries.add((fold(code), position))
+
+        ordered = sorted(entries)
+        self._keys = [key for key, _ in ordered]
+        self._owners = array("I", [position for _, position in ordered])
+        self._fuzzy_keys = sorted(set(self._keys))
+
+    def __len__(self):
+        """Return the number of stops."""
+        return len(self._stops)
+
+    def _prefixed(self, prefix):
+        """Return the positions of stops having a key starting with prefix."""
+        found = set()
+        index = bisect_left(self._keys, prefix)
+        while index < len(self._keys) and self._keys[index].startswith(prefix):
+            found.add(self._owners[index])
+            index += 1
+        return found
+
+    def _exact(self, key):
+        """Return the positions of stops having exactly this key."""
+        found = set()
+        index = bisect_left(self._keys, key)
+        while index < len(self._keys) and self._keys[index] == key:
+            found.add(self._owners[index])
+            index += 1
+        return found
+
+    def search(self, query, limit=STOP_SEARCH_LIMIT):
+        """Return up to `limit` stops matching a query, best matches first.
+
+        Every word of the query must prefix a word of the stop's name or its
+        code, e.g. "toolon" and "h0209" both find "Töölöntori (H0209)".
+        """
+        folded = fold(query).strip()
+        words = _WORD.findall(folded)
+        if not words:
+            return []
+
+        candidates = self._prefixed(folded) | self._prefixed(words[0])
+
+        ranked = []
+        for position in candidates:
+            _, name, code = self._stops[position]
+            name_folded, code_folded = fold(name), fold(code)
+            stop_words = _WORD.findall(name_folded) + [code_folded]
+            if not all(
+                any(word.startswith(query_word) for word in stop_words)
+                for query_word in words
+            ):
+                continue
+
+            if folded in (name_folded, code_folded):
+                rank = 0
+            elif name_folded.startswith(folded):
+                rank = 1
+            elif code_folded.startswith(folded):
+                rank = 2
+            else:
+                rank = 3
+            ranked.append((rank, name_folded, code_folded, position))
+
+        ranked.sort()
+        positions = [position for *_, position in ranked]
+
+        if len(positions) < limit:
+            seen = set(positions)
+            for key in difflib.get_close_matches(
+                folded, self._fuzzy_keys, n=limit, cutoff=FUZZY_CUTOFF
+            ):
+                for position in sorted(self._exact(key) - seen):
+                    positions.append(position)
+                    seen.add(position)
+
+        return [
+            {"name": name, "code": code, "gtfsId": gtfs_id}
+            for gtfs_id, name, code in (
+                self._stops[position] for position in positions[:limit]
+            )
+        ]
+
+
+class HSLHRTStopDirectory:
+    """Keep the stop list in `.storage` and a search index in memory.
+
+    The list comes from a configured GTFS zip when there is one, otherwise
+    from a single bulk `stops` query. It is refreshed once per
+    STOP_INDEX_TTL; a stale list is still used if refreshing fails.
+    """
+
+    def __init__(self, hass, execute):
+        """Initialize."""
+        self._hass = hass
+        self._execute = execute
+        self._store = Store(hass, STORAGE_VERSION, STOP_INDEX_STORAGE_KEY)
+        self._index = None
+        self._fetched = 0.0
+        self._inflight = None
+
+    async def async_search(self, apikey, query, limit=STOP_SEARCH_LIMIT):
+        """Search stops without any request once the index is built."""
+        index = await self.async_get_index(apikey)
+        # Fuzzy matching scans every key, keep it off the event loop
+        return await self._hass.async_add_executor_job(index.search, query, limit)
+
+    async def async_get_index(self, apikey):
+        """Return the index, loading or refreshing it if needed."""
+        if (
+            self._index is not None
+            and time.time() - self._fetched < STOP_INDEX_TTL.total_seconds()
+        ):
+            return self._index
+
+        if self._inflight is None:
+            self._inflight = asyncio.ensure_future(self._async_build(apikey))
+            self._inflight.add_done_callback(self._clear_inflight)
+
+        return await asyncio.shield(self._inflight)
+
+    def _clear_inflight(self, _):
+        """Forget the finished build."""
+        self._inflight = None
+
+    async def _async_build(self, apikey):
+        """Build the index from storage, refreshing the stop list if stale."""
+        stored = None
+        if self._index is None:
+            stored = await self._store.async_load()
+
+        if stored and time.time() - stored[KEY_FETCHED] < STOP_INDEX_TTL.total_seconds():
+            stops, fetched = stored[KEY_STOPS], stored[KEY_FETCHED]
+        else:
+            try:
+                stops, fetched = await self._async_download(apikey), time.time()
+            except Exception:  # pylint: disable=broad-except
+                if self._index is not None:
+                    _LOGGER.warning("Refreshing the stop list failed, keeping the old one")
+                    self._fetched = time.time()
+                    return self._index
+                if not stored:
+                    raise
+                _LOGGER.warning("Refreshing the stop list failed, using the stored one")
+                stops, fetched = stored[KEY_STOPS], stored[KEY_FETCHED]
+            else:
+                await self._store.async_save({KEY_FETCHED: fetched, KEY_STOPS: stops})
+
+        self._index = await self._hass.async_add_executor_job(StopSearchIndex, stops)
+        self._fetched = fetched
+        _LOGGER.debug("Indexed %d stops for search", len(self._index))
+        return self._index
+
+    async def _async_download(self, apikey):
+        """Return every stop as [gtfsId, name, code] rows."""
+        engines = self._hass.data[DOMAIN].get(GTFS_ENGINES) or {}
+        for path in engines:
+            try:
+                stops = await self._hass.async_add_executor_job(read_stops, path)
+            except (OSError, KeyError, ValueError, zipfile.BadZipFile) as error:
+                _LOGGER.debug("Reading stops from %s failed: %s", path, error)
+                continue
+            if stops:
+                return [[s["gtfsId"], s["name"], s["code"]] for s in stops]
+
+        data = await self._execute(apikey, ALL_STOPS_QUERY)
+        if data.get("errors") and not data.get("data"):
+            raise UpdateFailed(data["errors"][0].get("message", "Unknown error"))
+
+        return [
+            [stop["gtfsId"], stop.get("name") or "", stop.get("code") or ""]
+            for stop in (data.get("data") or {}).get("stops") or []
+            if stop and stop.get("gtfsId")
+        ]
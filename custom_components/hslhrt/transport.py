@@ -0,0 +1,159 @@
+"""GraphQL transport for the Digitransit routing API."""
+
+import asyncio
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+from aiohttp import ClientError, ClientResponseError, ContentTypeError
+
+try:
+    from aiohttp.compression_utils import HAS_BROTLI
+except ImportError:
+    HAS_BROTLI = False
+
+from homeassistant.helpers.update_coordinator import UpdateFailed
+
+from .const import BASE_URL, DECODE_EXECUTOR_BYTES
+
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
+# aiohttp only decodes brotli when a brotli package is installed
+ACCEPT_ENCODING = "gzip, br" if HAS_BROTLI else "gzip"
+
+
+class HSLHRTTransientError(UpdateFailed):
+    """Digitransit is down, overloaded or busy; worth retrying later."""
+
+
+class HSLHRTServerError(HSLHRTTransientError):
+    """Digitransit answered with a 5xx status."""
+
+    def __init__(self, status):
+        """Initialize with the HTTP status."""
+        super().__init__(f"Digitransit server error {status}")
+        self.status = status
+
+
+class HSLHRTRequestRejected(UpdateFailed):
+    """Digitransit rejected a request with a 4xx status other than 429."""
+
+    def __init__(self, status):
+        """Initialize with the HTTP status."""
+        super().__init__(f"Digitransit rejected the request with status {status}")
+        self.status = status
+
+
+class HSLHRTAuthFailed(HSLHRTRequestRejected):
+    """Digitransit rejected the API key (401/403)."""
+
+
+class HSLHRTRateLimited(HSLHRTTransientError):
+    """Digitransit rejected a request with 429 Too Many Requests."""
+
+    def __init__(self, retry_after=None):
+        """Initialize with the server's Retry-After in seconds, if any."""
+        super().__init__("Digitransit rate limit exceeded")
+        self.retry_after = retry_after
+
+
+def is_transient(error):
+    """Return True for connection, timeout and 5xx failures.
+
+    Wrapped errors are followed through their causes. Rejected requests,
+    GraphQL errors and unexpected responses are not transient.
+    """
+    while error is not None:
+        if isinstance(error, (HSLHRTTransientError, asyncio.TimeoutError)):
+            return True
+        if isinstance(error, ClientError) and not isinstance(
+            error, ClientResponseError
+        ):
+            return True
+        error = error.__cause__
+    return False
+
+
+def parse_retry_after(value):
+    """Return a Retry-After header (seconds or HTTP date) in seconds."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+class HSLHRTGraphQLTransport:
+    """Post GraphQL documents over Home Assistant's shared aiohttp session.
+
+    The shared session keeps connections to Digitransit alive between polls,
+    so a request does not pay for a new TCP and TLS handshake. Headers are
+    built per request, so entries using different API keys never see each
+    other's key.
+
+    Responses are decoded with orjson when it is installed (it ships with
+    Home Assistant) and fall back to the standard library. Bodies larger
+    than DECODE_EXECUTOR_BYTES are decoded in the executor so a big stop
+    does not hold up the event loop.
+    """
+
+    def __init__(self, hass, session, endpoint=BASE_URL):
+        """Initialize."""
+        self._hass = hass
+        self._session = session
+        self._endpoint = endpoint
+
+    async def async_execute(self, apikey, query, variables=None, stats=None):
+        """Execute a document and return the decoded JSON response.
+
+        If a `stats` dict is given, the size of the decompressed response
+        body is stored in it under "bytes".
+        """
+        headers = {
+            # Some Digitransit gateways accept either header name
+            "digitransit-subscription-key": apikey,
+            "Ocp-Apim-Subscription-Key": apikey,
+            "Accept": "application/json",
+            "Accept-Encoding": ACCEPT_ENCODING,
+        }
+
+        async with self._session.post(
+            self._endpoint,
+            json={"query": query, "variables": variables or {}},
+            headers=headers,
+        ) as response:
+            if response.status == 429:
+                raise HSLHRTRateLimited(
+                    parse_retry_after(response.headers.get("Retry-After"))
+                )
+            if response.status in (401, 403):
+                raise HSLHRTAuthFailed(response.status)
+            if 400 <= response.status < 500:
+                raise HSLHRTRequestRejected(response.status)
+            if response.status >= 500:
+                raise HSLHRTServerError(response.status)
+            body = await response.read()
+            if "json" not in response.content_type:
+                raise ContentTypeError(
+                    response.request_info,
+                    response.history,
+                    status=response.status,
+                    message=f"Unexpected content type {response.content_type}",
+                    headers=response.headers,
+                )
+
+        if stats is not None:
+            stats["bytes"] = len(body)
+        if len(body) > DECODE_EXECUTOR_BYTES:
+            return await self._hass.async_add_executor_job(json_loads, body)
+        return json_loads(body)
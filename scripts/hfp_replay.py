@@ -0,0 +1,78 @@
+"""Replay recorded HSL HFP messages to a local MQTT broker.
+
+Record a few minutes of the routes serving a stop from HSL's broker:
+
+    mosquitto_sub -h mqtt.hsl.fi -p 1883 -v \\
+        -t '/hfp/v2/journey/ongoing/vp/+/+/+/2550/#' \\
+        -t '/hfp/v2/journey/ongoing/dep/+/+/+/2550/#' > hfp.log
+
+then start a local broker (`mosquitto -p 1883`), point the integration's
+push update option to `mqtt://localhost:1883` and replay:
+
+    python scripts/hfp_replay.py hfp.log --speed 10
+
+Each line of the recording is `<topic> <payload>` as printed by
+`mosquitto_sub -v`. The `tst` timestamps of the payloads are used to keep
+the original pacing, divided by `--speed`.
+"""
+
+import argparse
+from datetime import datetime
+import json
+import time
+
+import paho.mqtt.client as mqtt
+
+
+def read_recording(path):
+    """Yield (timestamp, topic, payload) of a mosquitto_sub -v recording."""
+    with open(path, encoding="utf-8") as recording:
+        for line in recording:
+            topic, _, payload = line.rstrip("\n").partition(" ")
+            if not payload:
+                continue
+            try:
+                event = next(iter(json.loads(payload).values()))
+                stamp = datetime.fromisoformat(event["tst"].replace("Z", "+00:00"))
+            except (ValueError, KeyError, StopIteration, AttributeError):
+                stamp = None
+            yield stamp, topic, payload
+
+
+def main():
+    """Publish the recording."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("recording")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument(
+        "--speed", type=float, default=1.0, help="replay speed, 0 for no pauses"
+    )
+    args = parser.parse_args()
+
+    if hasattr(mqtt, "CallbackAPIVersion"):
+        client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION1)
+    else:
+        client = mqtt.Client()
+    client.connect(args.host, args.port)
+    client.loop_start()
+
+    previous = None
+    count = 0
+    for stamp, topic, payload in read_recording(args.recording):
+        if args.speed and stamp is not None and previous is not None:
+            pause = (stamp - previous).total_seconds() / args.speed
+            if pause > 0:
+                time.sleep(pause)
+        previous = stamp or previous
+
+        client.publish(topic, payload).wait_for_publish()
+        count += 1
+
+    client.loop_stop()
+    client.disconnect()
+    print(f"Published {count} message(s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""Tests of the offline GTFS timetable engine, built from an in-memory feed."""
+
+from datetime import datetime
+import io
+import zipfile
+from zoneinfo import ZoneInfo
+
+import pytest
+
+# The integration package imports Home Assistant, see requirements_test.txt
+pytest.importorskip(
+    "homeassistant", reason="install requirements_test.txt to run the tests"
+)
+
+from custom_components.hslhrt.gtfs import (  # noqa: E402
+    GTFSTimetable,
+    overlay_realtime,
+    read_stops,
+)
+from custom_components.hslhrt.parser import parse_data  # noqa: E402
+
+HELSINKI = ZoneInfo("Europe/Helsinki")
+STOP = "HSL:1000001"
+
+FEED = {
+    "agency.txt": "agency_id,agency_name,agency_timezone\nHSL,HSL,Europe/Helsinki\n",
+    "stops.txt": (
+        "stop_id,stop_code,stop_name,location_type\n"
+        "1000001,H0001,Kamppi,0\n"
+        "1000002,H0002,Rautatientori,0\n"
+        "1000000,,Kamppi station,1\n"
+    ),
+    "routes.txt": (
+        "route_id,route_short_name,route_long_name\n"
+        "R550,550,Itäkeskus-Westendinasema\n"
+        "R55,55,Koskela-Rautatientori\n"
+    ),
+    "trips.txt": (
+        "route_id,service_id,trip_id,trip_headsign\n"
+        "R550,WEEKDAY,T1,Itäkeskus\n"
+        "R550,WEEKDAY,T2,Westendinasema\n"
+        "R55,WEEKDAY,T3,Koskela\n"
+        "R550,WEEKDAY,T4,Itäkeskus\n"
+        "R55,SATURDAY,T5,Koskela\n"
+    ),
+    "stop_times.txt": (
+        "trip_id,arrival_time,departure_time,stop_id,stop_sequence,stop_headsign\n"
+        "T1,08:10:00,08:10:00,1000001,1,\n"
+        "T2,07:50:00,07:50:00,1000001,1,\n"
+        "T3,08:05:00,08:05:00,1000001,1,Koskela via Kallio\n"
+        "T3,08:15:00,08:15:00,1000002,2,\n"
+        "T4,24:30:00,24:30:00,1000001,1,\n"
+        "T5,08:20:00,08:20:00,1000001,1,\n"
+    ),
+    "calendar.txt": (
+        "service_id,monday,tuesday,wednesday,thursday,friday,saturday,sunday,"
+        "start_date,end_date\n"
+        "WEEKDAY,1,1,1,1,1,0,0,20260101,20261231\n"
+        "SATURDAY,0,0,0,0,0,1,0,20260101,20261231\n"
+    ),
+    # No weekday service on Tuesday 13 October
+    "calendar_dates.txt": "service_id,date,exception_type\nWEEKDAY,20261013,2\n",
+}
+
+
+def feed_zip(files=FEED):
+    """Return an in-memory GTFS zip."""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as feed:
+        for name, content in files.items():
+            feed.writestr(name, content)
+    buffer.seek(0)
+    return buffer
+
+
+def epoch(*args):
+    """Return the epoch of a Helsinki wall clock time."""
+    return int(datetime(*args, tzinfo=HELSINKI).timestamp())
+
+
+@pytest.fixture
+def timetable():
+    """Return the timetable of the test stop."""
+    return GTFSTimetable.from_zip(feed_zip(), [STOP])
+
+
+def test_read_stops_skips_stations():
+    """Only boardable stops are listed."""
+    stops = read_stops(feed_zip())
+
+    assert [stop["gtfsId"] for stop in stops] == ["HSL:1000001", "HSL:1000002"]
+    assert stops[0]["name"] == "Kamppi"
+    assert stops[0]["code"] == "H0001"
+
+
+def test_only_wanted_stops_are_indexed(timetable):
+    """Stops that were not asked for are not kept."""
+    assert timetable.has_stop(STOP)
+    assert not timetable.has_stop("HSL:1000002")
+
+
+def test_stoptimes_after_now(timetable):
+    """Upcoming departures are ordered and shaped like Digitransit's."""
+    now = epoch(2026, 10, 12, 8, 0)
+
+    rows = timetable.stoptimes(STOP, now)
+
+    assert [row["trip"]["gtfsId"] for row in rows] == ["HSL:T3", "HSL:T1", "HSL:T4"]
+    assert [row["serviceDay"] + row["realtimeArrival"] for row in rows] == [
+        epoch(2026, 10, 12, 8, 5),
+        epoch(2026, 10, 12, 8, 10),
+        epoch(2026, 10, 13, 0, 30),
+    ]
+    assert rows[0]["headsign"] == "Koskela via Kallio"
+    assert rows[1]["headsign"] == "Itäkeskus"
+    assert rows[1]["trip"]["route"]["shortName"] == "550"
+    assert rows[1]["realtime"] is False
+
+
+def test_trip_past_midnight_runs_on_the_next_day(timetable):
+    """A 24:30 arrival of Monday's service shows up early on Tuesday."""
+    rows = timetable.stoptimes(STOP, epoch(2026, 10, 13, 0, 0))
+
+    assert [row["trip"]["gtfsId"] for row in rows] == ["HSL:T4"]
+    assert rows[0]["serviceDay"] + rows[0]["scheduledArrival"] == epoch(
+        2026, 10, 13, 0, 30
+    )
+
+
+def test_calendar_dates_remove_service(timetable):
+    """A removed service date has no departures."""
+    assert timetable.stoptimes(STOP, epoch(2026, 10, 13, 7, 0)) == []
+
+
+def test_weekend_service(timetable):
+    """Saturday only runs the Saturday service."""
+    rows = timetable.stoptimes(STOP, epoch(2026, 10, 17, 7, 0))
+
+    assert [row["trip"]["gtfsId"] for row in rows] == ["HSL:T5"]
+
+
+def test_limit_and_time_range(timetable):
+    """Departures are capped by count and by time range."""
+    now = epoch(2026, 10, 12, 7, 0)
+
+    assert len(timetable.stoptimes(STOP, now, limit=2)) == 2
+    rows = timetable.stoptimes(STOP, now, time_range=3600)
+    assert [row["trip"]["gtfsId"] for row in rows] == ["HSL:T2"]
+
+
+def test_stop_payload_is_parsed_like_digitransit(timetable):
+    """The payload goes through the regular parser unchanged."""
+    payload = timetable.stop_payload(STOP, epoch(2026, 10, 12, 8, 0))
+
+    assert payload["name"] == "Kamppi"
+    assert {route["shortName"] for route in payload["routes"]} == {"55", "550"}
+
+    parsed = parse_data({"data": {"stop": payload}}, "550")
+    assert [route["destination"] for route in parsed["routes"]] == [
+        "Itäkeskus",
+        "Itäkeskus",
+    ]
+    assert parsed["routes"][0]["arrival"] == "8:10:00"
+
+
+def test_overlay_realtime_replaces_trips(timetable):
+    """Realtime rows replace their scheduled trip and departed rows drop out."""
+    now = epoch(2026, 10, 12, 8, 0)
+    schedule = timetable.stop_payload(STOP, now)
+    delayed = {
+        **schedule["stoptimesWithoutPatterns"][0],
+        "realtimeArrival": schedule["stoptimesWithoutPatterns"][0]["scheduledArrival"]
+        + 600,
+        "realtime": True,
+    }
+
+    merged = overlay_realtime(
+        schedule, {"stoptimesWithoutPatterns": [delayed]}, now
+    )
+
+    rows = merged["stoptimesWithoutPatterns"]
+    assert [row["trip"]["gtfsId"] for row in rows] == ["HSL:T1", "HSL:T3", "HSL:T4"]
+    assert rows[1]["realtime"] is True
@@ -0,0 +1,239 @@
+"""Tests of parsing, grouping and selecting departures."""
+
+import pytest
+
+# The integration package imports Home Assistant, see requirements_test.txt
+pytest.importorskip(
+    "homeassistant", reason="install requirements_test.txt to run the tests"
+)
+
+from custom_components.hslhrt.const import (  # noqa: E402
+    DICT_KEY_DEST,
+    DICT_KEY_EPOCH,
+    DICT_KEY_GROUPS,
+    DICT_KEY_REALTIME,
+    DICT_KEY_ROUTE,
+    DICT_KEY_ROUTES,
+    DICT_KEY_STALE_SINCE,
+)
+from custom_components.hslhrt.parser import (  # noqa: E402
+    build_filter,
+    departures_fingerprint,
+    parse_data,
+    route_attributes,
+    select_departures,
+    stale_snapshot,
+    trimmed_snapshot,
+)
+
+SERVICE_DAY = 1_760_216_400
+
+ROWS = [
+    ("550", "Itäkeskus", 28800),
+    ("55", "Koskela", 29100),
+    ("550", "Westendinasema", 29400),
+    ("18", "Munkkivuori", 29700),
+    ("550", "Itäkeskus (M)", 30000),
+    ("55", "Koskela", 30300),
+]
+
+
+def payload(rows=ROWS):
+    """Return a Digitransit stop payload of (route, headsign, arrival) rows."""
+    return {
+        "data": {
+            "stop": {
+                "name": "Kamppi",
+                "code": "H0001",
+                "gtfsId": "HSL:1000001",
+                "routes": [
+                    {"shortName": name} for name in sorted({row[0] for row in rows})
+                ],
+                "stoptimesWithoutPatterns": [
+                    {
+                        "scheduledArrival": arrival,
+                        "realtimeArrival": arrival,
+                        "realtime": False,
+                        "serviceDay": SERVICE_DAY,
+                        "headsign": headsign,
+                        "trip": {"route": {"shortName": route}},
+                    }
+                    for route, headsign, arrival in rows
+                ],
+            }
+        }
+    }
+
+
+def summary(departures):
+    """Return the (route, destination) pairs of departures."""
+    return [(row[DICT_KEY_ROUTE], row[DICT_KEY_DEST]) for row in departures]
+
+
+def test_groups_split_departures_in_one_pass():
+    """Only grouped routes are kept and every group gets its departures."""
+    groups = [("550", None), ("550", "itäkeskus"), ("55", None)]
+
+    parsed = parse_data(
+        payload(), departure_filter=build_filter("all", "all", groups)
+    )
+
+    assert ("18", "Munkkivuori") not in summary(parsed[DICT_KEY_ROUTES])
+    assert len(parsed[DICT_KEY_ROUTES]) == 5
+    route_550, itakeskus, route_55 = parsed[DICT_KEY_GROUPS]
+    assert summary(route_550) == [
+        ("550", "Itäkeskus"),
+        ("550", "Westendinasema"),
+        ("550", "Itäkeskus (M)"),
+    ]
+    # Headsigns match exactly, ignoring case, so "Itäkeskus (M)" is left out
+    assert summary(itakeskus) == [("550", "Itäkeskus")]
+    assert summary(route_55) == [("55", "Koskela"), ("55", "Koskela")]
+    # Groups share the departure dicts of the full list
+    assert route_550[0] is parsed[DICT_KEY_ROUTES][0]
+
+
+def test_groups_match_a_single_route_entry():
+    """A route group holds what a single-route entry would show."""
+    grouped = parse_data(
+        payload(), departure_filter=build_filter(groups=[("550", None)])
+    )
+    single = parse_data(payload(), "550")
+
+    assert grouped[DICT_KEY_GROUPS][0] == single[DICT_KEY_ROUTES]
+
+
+def test_unknown_group_route_is_empty():
+    """A route that has no departures gets an empty group."""
+    parsed = parse_data(
+        payload(), departure_filter=build_filter(groups=[("550", None), ("7", None)])
+    )
+
+    assert parsed[DICT_KEY_GROUPS][1] == []
+
+
+def test_without_groups_there_is_no_group_key():
+    """Single route entries keep the previous output."""
+    assert DICT_KEY_GROUPS not in parse_data(payload(), "550")
+
+
+def test_route_attributes_of_a_group():
+    """A group sensor's attributes come from its own departures."""
+    parsed = parse_data(
+        payload(), departure_filter=build_filter(groups=[("55", None)])
+    )
+
+    attributes = route_attributes(parsed, 10, parsed[DICT_KEY_GROUPS][0])
+
+    assert attributes["ROUTE"] == "55"
+    assert attributes["DESTINATION"] == "Koskela"
+    assert [route["ROUTE"] for route in attributes["ROUTES"]] == ["55"]
+    assert attributes["STOP NAME"] == "Kamppi"
+
+
+def test_stale_snapshot_trims_groups():
+    """Departed trips are dropped from the groups too."""
+    parsed = parse_data(
+        payload(), departure_filter=build_filter(groups=[("550", None), ("55", None)])
+    )
+
+    stale = stale_snapshot(parsed, SERVICE_DAY + 29400, "2026-10-12T05:00:00")
+
+    assert len(stale[DICT_KEY_ROUTES]) == 3
+    assert [len(group) for group in stale[DICT_KEY_GROUPS]] == [2, 1]
+    assert len(parsed[DICT_KEY_GROUPS][0]) == 3
+
+
+def test_fingerprint_ignores_identical_data():
+    """Parsing the same payload twice gives the same fingerprint."""
+    assert departures_fingerprint(parse_data(payload())) == departures_fingerprint(
+        parse_data(payload())
+    )
+
+
+def test_fingerprint_follows_realtime():
+    """A departure turning realtime at the same minute changes the fingerprint."""
+    parsed = parse_data(payload())
+    before = departures_fingerprint(parsed)
+
+    parsed[DICT_KEY_ROUTES][0][DICT_KEY_REALTIME] = True
+
+    assert departures_fingerprint(parsed) != before
+
+
+def test_stale_snapshot_drops_departed_trips():
+    """A stale snapshot keeps the upcoming departures and when it went stale."""
+    parsed = parse_data(payload())
+
+    stale = stale_snapshot(parsed, SERVICE_DAY + 29400, "2026-10-12T05:00:00")
+
+    assert summary(stale[DICT_KEY_ROUTES]) == [
+        ("550", "Westendinasema"),
+        ("18", "Munkkivuori"),
+        ("550", "Itäkeskus (M)"),
+        ("55", "Koskela"),
+    ]
+    assert stale[DICT_KEY_STALE_SINCE] == "2026-10-12T05:00:00"
+    assert len(parsed[DICT_KEY_ROUTES]) == 6
+
+
+def test_trimmed_snapshot_keeps_the_next_departures():
+    """A saved snapshot only holds the departures within the horizon."""
+    parsed = parse_data(
+        payload(), departure_filter=build_filter(groups=[("550", None), ("55", None)])
+    )
+
+    trimmed = trimmed_snapshot(parsed, SERVICE_DAY + 29000, 600)
+
+    assert summary(trimmed[DICT_KEY_ROUTES]) == [
+        ("55", "Koskela"),
+        ("550", "Westendinasema"),
+    ]
+    assert [len(group) for group in trimmed[DICT_KEY_GROUPS]] == [1, 1]
+    assert DICT_KEY_STALE_SINCE not in trimmed
+
+
+@pytest.fixture
+def parsed():
+    """Return every departure of the stop."""
+    return parse_data(payload(), "all")
+
+
+def test_select_by_route_and_destination(parsed):
+    """Route matches exactly and destination as a substring, ignoring case."""
+    page, total = select_departures(parsed, route="550")
+    assert total == 3
+    assert {row[DICT_KEY_ROUTE] for row in page} == {"550"}
+
+    page, total = select_departures(parsed, dest="ITÄKESKUS")
+    assert summary(page) == [("550", "Itäkeskus"), ("550", "Itäkeskus (M)")]
+
+    assert select_departures(parsed, route="5") == ([], 0)
+
+
+def test_select_by_time_window(parsed):
+    """Start is inclusive and end exclusive."""
+    page, total = select_departures(
+        parsed, start=SERVICE_DAY + 29100, end=SERVICE_DAY + 29700
+    )
+
+    assert total == 2
+    assert [row[DICT_KEY_EPOCH] - SERVICE_DAY for row in page] == [29100, 29400]
+
+
+def test_select_pages(parsed):
+    """Offset and limit page through the matches, total counts them all."""
+    page, total = select_departures(parsed, offset=2, limit=3)
+
+    assert total == 6
+    assert [row[DICT_KEY_EPOCH] - SERVICE_DAY for row in page] == [
+        29400,
+        29700,
+        30000,
+    ]
+    assert select_departures(parsed, offset=10) == ([], 6)
+
+
+def test_select_without_data():
+    """Missing data selects nothing."""
+    assert select_departures(None) == ([], 0)